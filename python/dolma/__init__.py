@@ -1,5 +1,6 @@
 import json
 import warnings
+from typing import List
 
 # warning raised by pkg_resources used in a lot of google packages
 warnings.filterwarnings("ignore", message=r".*declare_namespace\(\'.*google.*", category=DeprecationWarning)
@@ -54,3 +55,26 @@ def mixer(config: dict):
         _dolma.mixer_entrypoint(json.dumps(config))
     except RuntimeError as e:
         raise DolmaRustPipelineError(f"Error running mixer: {e}") from e
+
+
+def mixer_plan(config: dict, sample_size: int = 10_000, max_files: int = 16) -> List[dict]:
+    """
+    Estimate how many documents and bytes the mixer would keep for each stream in the configuration,
+    without running it.
+
+    Args:
+        config (dict): A dictionary containing the configuration parameters for the mixer.
+        sample_size (int): Number of documents to sample from each stream.
+        max_files (int): Maximum number of input files to sample documents from in each stream.
+
+    Returns:
+        List[dict]: One estimate for each stream; each estimate of a count or size has a `value`, and
+            the `low` and `high` bounds of its 95% confidence interval.
+
+    Raises:
+        DolmaRustPipelineError: If an error occurs while sampling documents.
+    """
+    try:
+        return json.loads(_dolma.mixer_plan_entrypoint(json.dumps(config), sample_size, max_files))
+    except RuntimeError as e:
+        raise DolmaRustPipelineError(f"Error planning mixer: {e}") from e
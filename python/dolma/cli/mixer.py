@@ -1,7 +1,10 @@
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional
 
-from dolma import mixer
+from rich.console import Console
+from rich.table import Table
+
+from dolma import mixer, mixer_plan
 from dolma.cli import BaseCli, field, print_config
 from dolma.cli.shared import CompressionConfig, WorkDirConfig, make_workdirs
 from dolma.core.errors import DolmaConfigError
@@ -17,6 +20,14 @@ class StreamOutputConfig:
     )
     discard_fields: List[str] = field(default=[], help="List of fields to discard from the output documents.")
     min_text_length: Optional[int] = field(default=0, help="Minimum length of the text in the output documents.")
+    passthrough: bool = field(
+        default=False,
+        help=(
+            "If true, kept documents are copied from the input as they are: attributes are not merged into them. "
+            "When filters only read attributes, documents are not fully parsed. Cannot be used with span "
+            "replacements, discard_fields, or min_text_length."
+        ),
+    )
 
 
 @dataclass
@@ -47,6 +58,22 @@ class SpanReplacementConfig:
     )
 
 
+@dataclass
+class AttributesJoinConfig:
+    strategy: str = field(
+        default="lockstep",
+        help=(
+            "How attribute files are matched with documents. `lockstep` (default) reads attributes in the same "
+            "order as documents, and fails if ids don't match. `sorted` merges documents and attributes that "
+            "are both sorted by id, and switches to `hash` if they are not. `hash` joins on id in any order, buffering attributes that are read ahead."
+        ),
+    )
+    max_buffered_rows: int = field(
+        default=100_000,
+        help="Number of attribute rows the hash join keeps in memory; further rows are spilled to disk.",
+    )
+
+
 @dataclass
 class StreamConfig:
     name: str = field(help="Name of the stream. Required.")
@@ -66,6 +93,9 @@ class StreamConfig:
             "from the file extension."
         ),
     )
+    join: AttributesJoinConfig = field(
+        default=AttributesJoinConfig(), help="Configuration for matching attribute files with documents."
+    )
 
 
 @dataclass
@@ -78,6 +108,56 @@ class MixerConfig:
         default=False,
         help="If true, only print the configuration and exit without running the mixer.",
     )
+    plan: bool = field(
+        default=False,
+        help=(
+            "If true, estimate how many documents and bytes each stream would keep from a sample of its "
+            "documents, and exit without running the mixer."
+        ),
+    )
+    plan_sample_size: int = field(default=10_000, help="Number of documents to sample from each stream.")
+    plan_max_files: int = field(
+        default=16, help="Maximum number of input files to sample documents from in each stream."
+    )
+
+
+def _format_estimate(estimate: Dict[str, float], fmt: Callable[[float], str]) -> str:
+    if estimate["low"] == estimate["high"]:
+        return fmt(estimate["value"])
+    return f"{fmt(estimate['value'])} ({fmt(estimate['low'])} - {fmt(estimate['high'])})"
+
+
+def _format_bytes(num_bytes: float) -> str:
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if abs(num_bytes) < 1024 or unit == "TB":
+            break
+        num_bytes /= 1024
+    return f"{num_bytes:,.1f} {unit}"
+
+
+def print_plan(plans: List[Dict[str, Any]], console: Optional[Console] = None) -> None:
+    """Print estimates returned by `dolma.mixer_plan` as a table; ranges are 95% confidence intervals."""
+    table = Table(title="dolma mix plan", style="bold")
+    table.add_column("stream", justify="left", style="cyan")
+    table.add_column("files (sampled)", justify="right")
+    table.add_column("input", justify="right")
+    table.add_column("documents", justify="right")
+    table.add_column("kept documents", justify="right", style="magenta")
+    table.add_column("kept bytes", justify="right", style="magenta")
+    table.add_column("shards", justify="right")
+
+    for plan in plans:
+        table.add_row(
+            plan["name"],
+            f"{plan['input_files']:,} ({plan['sampled_files']:,})",
+            _format_bytes(plan["input_bytes"]),
+            _format_estimate(plan["documents"], lambda v: f"{v:,.0f}"),
+            _format_estimate(plan["kept_documents"], lambda v: f"{v:,.0f}"),
+            _format_estimate(plan["kept_bytes"], _format_bytes),
+            f"{plan['shards']:,}",
+        )
+
+    (console or Console()).print(table)
 
 
 class MixerCli(BaseCli):
@@ -171,6 +251,15 @@ class MixerCli(BaseCli):
                     "output": str(o) if (o := stream_config.compression.output) is not None else None,
                 }
 
+                if stream_config.join.strategy not in ("lockstep", "sorted", "hash"):
+                    raise DolmaConfigError(
+                        f"Invalid join strategy {stream_config.join.strategy}; must be lockstep, sorted, or hash"
+                    )
+                stream_config_dict["join"] = {
+                    "strategy": str(stream_config.join.strategy),
+                    "max_buffered_rows": int(stream_config.join.max_buffered_rows),
+                }
+
                 if stream_config.output.min_text_length:
                     stream_config_dict["output"]["min_text_length"] = int(stream_config.output.min_text_length)
                     if stream_config.output.min_text_length < 0:
@@ -181,6 +270,18 @@ class MixerCli(BaseCli):
                         str(f) for f in stream_config.output.discard_fields
                     ]
 
+                if stream_config.output.passthrough:
+                    if (
+                        "span_replacement" in stream_config_dict
+                        or stream_config.output.discard_fields
+                        or stream_config.output.min_text_length
+                    ):
+                        raise DolmaConfigError(
+                            "`output.passthrough` cannot be used with `span_replacement`, "
+                            "`output.discard_fields`, or `output.min_text_length`"
+                        )
+                    stream_config_dict["output"]["passthrough"] = True
+
                 if len(stream_config_dict["documents"]) == 0:
                     raise ValueError("No documents to mix")
 
@@ -189,9 +290,21 @@ class MixerCli(BaseCli):
             if len(dict_config["streams"]) == 0:
                 raise DolmaConfigError("No streams to mix")
 
+            if parsed_config.plan and (parsed_config.plan_sample_size < 1 or parsed_config.plan_max_files < 1):
+                raise DolmaConfigError("plan_sample_size and plan_max_files must be at least 1")
+
             print_config(dict_config)
             if parsed_config.dryrun:
                 logger.info("Exiting due to dryrun.")
                 return
 
+            if parsed_config.plan:
+                plans = mixer_plan(
+                    dict_config,
+                    sample_size=int(parsed_config.plan_sample_size),
+                    max_files=int(parsed_config.plan_max_files),
+                )
+                print_plan(plans)
+                return
+
             mixer(dict_config)
@@ -94,6 +94,40 @@ class TokenizerConfig:
         )
 
 
+@dataclass
+class PackingConfig:
+    seq_len: Optional[int] = field(
+        default=None,
+        help=(
+            "If provided, documents are packed into instances of exactly this many tokens. Documents longer "
+            "than seq_len are split, and instances are padded with the pad token. By default, no packing is done."
+        ),
+    )
+    algorithm: str = field(
+        default="best_fit",
+        help="Algorithm to use to pack documents into instances. Can be either 'best_fit' or 'first_fit'.",
+    )
+    max_open_bins: Optional[int] = field(
+        default=None,
+        help="Maximum number of partially filled instances to keep while packing.",
+    )
+
+
+@dataclass
+class TokenCacheConfig:
+    path: Optional[str] = field(
+        default=None,
+        help=(
+            "Local or S3 location of a cache of tokenized documents. Documents whose text is found in the cache "
+            "are not tokenized again. By default, no cache is used."
+        ),
+    )
+    max_size: Optional[int] = field(
+        default=None,
+        help="Maximum size of a local cache in bytes; least recently used entries are evicted past this size.",
+    )
+
+
 @dataclass
 class TokenizationConfig:
     documents: List[str] = field(
@@ -151,6 +185,14 @@ class TokenizationConfig:
         default=3920,
         help="Seed for random number generation.",
     )
+    ignore_existing: bool = field(
+        default=False,
+        help="Whether to ignore files completed by a previous run in the same work directory and redo them.",
+    )
+    packing: PackingConfig = field(
+        default=PackingConfig(), help="Configuration for packing documents into fixed-length instances."
+    )
+    cache: TokenCacheConfig = field(default=TokenCacheConfig(), help="Configuration for the token cache.")
     work_dir: WorkDirConfig = field(default=WorkDirConfig(), help="Configuration for temporary work directories.")
     dryrun: bool = field(
         default=False,
@@ -221,4 +263,10 @@ class TokenizerCli(BaseCli):
                 sample_ring_prop=parsed_config.sample_ring_prop,
                 use_fast_tokenizer=parsed_config.tokenizer.fast,
                 refresh_tokenizer=parsed_config.tokenizer.refresh,
+                seq_len=parsed_config.packing.seq_len,
+                packing_algorithm=parsed_config.packing.algorithm,
+                packing_max_open_bins=parsed_config.packing.max_open_bins,
+                token_cache_path=parsed_config.cache.path,
+                token_cache_max_size=parsed_config.cache.max_size,
+                ignore_existing=parsed_config.ignore_existing,
             )
@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import List
+from typing import List, Optional
 
 from dolma.cli import BaseCli, field, print_config
 from dolma.cli.shared import WorkDirConfig, make_workdirs
@@ -21,6 +21,34 @@ class TaggerConfig:
     )
 
 
+@dataclass
+class PrefilterConfig:
+    content_types: List[str] = field(
+        default=[],
+        help="HTTP content types of the records to keep (e.g. text/html); type/* keeps all subtypes. If empty, all are kept.",
+    )
+    status_codes: List[int] = field(
+        default=[],
+        help="HTTP status codes of the records to keep (e.g. 200). If empty, all are kept.",
+    )
+    blocked_domains: List[str] = field(
+        default=[],
+        help="Domains whose records are dropped, together with all their subdomains.",
+    )
+    blocked_url_patterns: List[str] = field(
+        default=[],
+        help="Regular expressions; records whose target URL matches any of them are dropped.",
+    )
+    min_content_length: Optional[int] = field(
+        default=None,
+        help="Drop records shorter than this many bytes (HTTP headers and payload).",
+    )
+    max_content_length: Optional[int] = field(
+        default=None,
+        help="Drop records longer than this many bytes (HTTP headers and payload).",
+    )
+
+
 @dataclass
 class WarcExtractorConfig:
     documents: List[str] = field(
@@ -39,6 +67,13 @@ class WarcExtractorConfig:
         default=1,
         help="Number of parallel processes to use.",
     )
+    parallel_records: bool = field(
+        default=False,
+        help=(
+            "If true, split the records of each file across all processes instead of processing files in "
+            "parallel; useful when there are fewer files than processes."
+        ),
+    )
     ignore_existing: bool = field(
         default=False,
         help="Whether to ignore existing outputs and re-run the taggers.",
@@ -55,6 +90,10 @@ class WarcExtractorConfig:
     )
     pre: TaggerConfig = field(default=TaggerConfig(), help="Configuration for pre-extraction taggers.")
     post: TaggerConfig = field(default=TaggerConfig(), help="Configuration for post-extraction taggers.")
+    prefilter: PrefilterConfig = field(
+        default=PrefilterConfig(),
+        help="Configuration for dropping records based on their headers, before their content is decoded.",
+    )
     store_html_in_metadata: bool = field(
         default=False,
         help="Whether to store the HTML content in the metadata.",
@@ -107,6 +146,7 @@ class WarcExtractorCli(BaseCli):
                 destination=(destination[0] if len(destination) == 1 else destination),
                 metadata=work_dirs.output,
                 num_processes=parsed_config.processes,
+                parallel_records=parsed_config.parallel_records,
                 ignore_existing=parsed_config.ignore_existing,
                 debug=parsed_config.debug,
                 source_name=source_name,
@@ -116,4 +156,10 @@ class WarcExtractorCli(BaseCli):
                 skip_no_post_taggers=parsed_config.post.skip,
                 store_html_in_metadata=parsed_config.store_html_in_metadata,
                 linearizer_name=parsed_config.linearizer,
+                allowed_content_types=parsed_config.prefilter.content_types,
+                allowed_status_codes=parsed_config.prefilter.status_codes,
+                blocked_domains=parsed_config.prefilter.blocked_domains,
+                blocked_url_patterns=parsed_config.prefilter.blocked_url_patterns,
+                min_content_length=parsed_config.prefilter.min_content_length,
+                max_content_length=parsed_config.prefilter.max_content_length,
             )
@@ -0,0 +1,85 @@
+import re
+from typing import Dict, Iterable, Optional, Tuple
+
+from necessary import necessary
+
+with necessary("pyahocorasick", soft=True) as AHOCORASICK_AVAILABLE:
+    if AHOCORASICK_AVAILABLE:
+        import ahocorasick  # pylint: disable=import-error # pyright: ignore
+
+__all__ = ["KeywordMatcher"]
+
+
+def _trie_pattern(keywords: Iterable[str]) -> str:
+    """Build a regex that matches any of the keywords, with alternatives arranged as a prefix trie, so
+    that the regex engine never has to try more than one branch per character."""
+    trie: dict = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: dict) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            # a keyword ends here, and longer keywords continue from it
+            pattern = f"(?:{pattern})?"
+        return pattern
+
+    return build(trie)
+
+
+class KeywordMatcher:
+    """Find occurrences of many keywords in a text in a single pass.
+
+    Keywords are either words, which only match whole whitespace-delimited tokens (as if the text was split
+    with `str.split()`), or phrases, which match anywhere in the text. Matching is case sensitive, so both
+    keywords and texts are usually lowercased.
+
+    Keywords are compiled into an Aho-Corasick automaton when `pyahocorasick` is installed; otherwise, into
+    a regular expression structured as a trie, which is slower but needs no extra dependency. Building a
+    matcher is expensive, so it should be done once and reused for all texts.
+    """
+
+    def __init__(self, words: Iterable[str] = (), phrases: Iterable[str] = ()):
+        self.words = frozenset(w for w in words if w)
+        self.phrases = frozenset(p for p in phrases if p)
+
+        self._automaton = None
+        self._regex: Optional[re.Pattern] = None
+
+        if AHOCORASICK_AVAILABLE:
+            keywords: Dict[str, bool] = {phrase: False for phrase in self.phrases}
+            # a keyword that is both a word and a phrase matches anywhere
+            keywords.update({word: keywords.get(word, True) for word in self.words})
+            if keywords:
+                self._automaton = ahocorasick.Automaton()
+                for keyword, is_word in keywords.items():
+                    self._automaton.add_word(keyword, (keyword, is_word))
+                self._automaton.make_automaton()
+        else:
+            patterns = []
+            if self.words:
+                patterns.append(r"(?<!\S)" + _trie_pattern(self.words) + r"(?!\S)")
+            if self.phrases:
+                patterns.append(_trie_pattern(self.phrases))
+            if patterns:
+                self._regex = re.compile("|".join(patterns))
+
+    def search(self, text: str) -> Optional[Tuple[int, int, str]]:
+        """Return start, end, and keyword of a match in text, or None if no keyword occurs in it."""
+        if self._automaton is not None:
+            for end, (keyword, is_word) in self._automaton.iter(text):
+                start = end - len(keyword) + 1
+                if is_word and not (
+                    (start == 0 or text[start - 1].isspace()) and (end + 1 == len(text) or text[end + 1].isspace())
+                ):
+                    continue
+                return start, end + 1, keyword
+        elif self._regex is not None and (match := self._regex.search(text)):
+            return match.start(), match.end(), match.group()
+        return None
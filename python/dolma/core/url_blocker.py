@@ -1,3 +1,5 @@
+import os
+from hashlib import sha256
 from pathlib import Path
 from typing import List, Optional, Union
 
@@ -5,6 +7,9 @@ import smart_open
 import urllib3.util
 
 from .. import dolma as _dolma  # type: ignore   # noqa: E402
+from .loggers import get_logger
+
+LOGGER = get_logger(__name__)
 
 
 class UrlBlocker:
@@ -18,11 +23,17 @@ class UrlBlocker:
         engine: The underlying engine used for URL blocking.
 
     Methods:
-        from_adblockplus_filepath: Create an instance of UrlBlocker from an AdBlock Plus file.
+        from_adb_paths: Create an instance of UrlBlocker from AdBlock Plus files, optionally cached.
+        save: Save the compiled engine to a file.
+        load: Create an instance of UrlBlocker from an engine saved with `save`.
         check_network_urls: Check if a given URL should be blocked based on the rules.
+        check_network_urls_batch: Check many URLs at once.
 
     """
 
+    # bump if the way rules are collected changes; engines cached before that are ignored
+    CACHE_VERSION = "1"
+
     def __init__(
         self,
         rules: List[str],
@@ -40,12 +51,16 @@ class UrlBlocker:
     def from_adb_paths(
         cls,
         *file_paths: Union[str, Path],
+        cache_dir: Optional[Union[str, Path]] = None,
     ) -> "UrlBlocker":
         """
         Create an instance of UrlBlocker from one or more AdBlock Plus files.
 
         Args:
             file_paths (Union[str, Path]): The filepath of the AdBlock Plus file.
+            cache_dir (Union[str, Path], optional): If provided, the compiled engine is saved in this directory,
+                in a file named after a hash of the rules; later calls with the same rules load it instead of
+                compiling the rules again. Failing to save the engine is logged, not raised.
 
         Returns:
             UrlBlocker: An instance of UrlBlocker created from the AdBlock Plus file.
@@ -55,7 +70,62 @@ class UrlBlocker:
         for fp in file_paths:
             with smart_open.open(fp, "rt") as adb_file:
                 rules.extend([ln.strip() for ln in adb_file if not ln.startswith("!")])
-        return cls(sorted(set(rules)))
+        rules = sorted(set(rules))
+
+        if cache_dir is None:
+            return cls(rules)
+
+        rules_hash = sha256("\n".join([cls.CACHE_VERSION, *rules]).encode("utf-8")).hexdigest()
+        cache_path = Path(cache_dir) / f"{rules_hash}.bin"
+        if cache_path.exists():
+            try:
+                return cls.load(cache_path)
+            except ValueError as e:
+                # e.g., the engine was saved by a different version of the adblock library
+                LOGGER.warning(f"Could not load cached engine {cache_path}, compiling rules again: {e}")
+
+        blocker = cls(rules)
+        try:
+            blocker.save(cache_path)
+        except OSError as e:
+            # the cache is an optimization; e.g., a read-only cache directory should not prevent tagging
+            LOGGER.warning(f"Could not save compiled engine to {cache_path}: {e}")
+        return blocker
+
+    def save(self, path: Union[str, Path]) -> None:
+        """
+        Save the compiled engine to a file.
+
+        Args:
+            path (Union[str, Path]): The file to save the engine to; parent directories are created as needed.
+
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # write to a temporary file first, so that processes loading the engine never see a partial file
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp_path.write_bytes(self.engine.serialize())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "UrlBlocker":
+        """
+        Create an instance of UrlBlocker from an engine saved with `save`.
+
+        Args:
+            path (Union[str, Path]): The file the engine was saved to.
+
+        Returns:
+            UrlBlocker: An instance of UrlBlocker with the saved engine.
+
+        Raises:
+            ValueError: If the file does not contain a valid engine.
+
+        """
+        blocker = cls.__new__(cls)
+        blocker.engine = _dolma.UrlBlocker.deserialize(Path(path).read_bytes())
+        return blocker
 
     def check_network_urls(
         self,
@@ -90,3 +160,32 @@ class UrlBlocker:
             source_url=str(source_url),
             request_type=request_type,
         )
+
+    def check_network_urls_batch(
+        self,
+        urls: List[str],
+        source_url: Optional[str] = None,
+        request_type: str = "",
+    ) -> List[Optional[bool]]:
+        """
+        Check if each of the given URLs should be blocked based on the rules; all URLs are checked in a
+        single call to the engine, which is much faster than calling `check_network_urls` in a loop.
+
+        Args:
+            urls (List[str]): The URLs to be checked.
+            source_url (str): The source URL of the requests. If not provided, the host from each URL will be used.
+            request_type (str): The type of the requests; see `check_network_urls`.
+
+        Returns:
+            List[Optional[bool]]: For each URL, True if it should be blocked, False if not, and None if the URL
+                is not valid.
+
+        """
+        # if a URL does not have a scheme, we assume it is an HTTP URL
+        urls = [url if urllib3.util.parse_url(url).scheme is not None else f"http://{url}" for url in urls]
+
+        return self.engine.check_network_urls_batch(
+            urls=[str(url) for url in urls],
+            source_url=str(source_url or ""),
+            request_type=request_type,
+        )
@@ -1,9 +1,11 @@
 import logging
 from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
 from typing import List, Set
 
 from dolma.core.data_types import DocResult, Document, Span
+from dolma.core.keyword_matcher import KeywordMatcher
 from dolma.core.registry import TaggerRegistry
 from dolma.core.taggers import BaseTagger
 from dolma.utils.language_config import get_language_config, get_spaceless_languages
@@ -30,6 +32,14 @@ def load_naughty_words(language: str) -> tuple[Set[str], Set[str]]:
 
     return words, phrases
 
+
+@lru_cache(maxsize=None)
+def load_naughty_words_matcher(language: str) -> KeywordMatcher:
+    """Matcher for the naughty words and phrases of a language; it is built once per process."""
+    words, phrases = load_naughty_words(language)
+    return KeywordMatcher(words=words, phrases=phrases)
+
+
 @dataclass
 class C4Attributes:
     lines_with_no_ending_punctuation: List[Span]
@@ -61,7 +71,7 @@ class MC4Tagger(BaseTagger):
     def __init__(self, language: str = "en"):
         super().__init__()
         self.language = language
-        self.naughty_words, self.naughty_phrases = load_naughty_words(language)
+        self.naughty_matcher = load_naughty_words_matcher(language)
 
         config = get_language_config(language)
         self.min_words_per_line = config["min_words_per_line"]
@@ -80,9 +90,7 @@ class MC4Tagger(BaseTagger):
         if "javascript" in text:
             spans.append(Span(0, len(doc.text), type="has_javascript"))
 
-        if any(word in self.naughty_words for word in text.split()) or any(
-            phrase in text for phrase in self.naughty_phrases
-        ):
+        if self.naughty_matcher.search(text) is not None:
             spans.append(Span(0, len(doc.text), type="has_naughty_word"))
         
         start = count = 0
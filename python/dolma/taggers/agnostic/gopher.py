@@ -10,6 +10,7 @@ from typing import List, Tuple, Union
 from dolma.core.data_types import DocResult, Document, Span
 from dolma.core.registry import TaggerRegistry
 from dolma.core.taggers import BaseTagger
+from dolma.taggers.gopher import ngram_statistics
 from dolma.utils.language_config import get_language_config
 
 SYMBOLS = {"#", "\u2026"}
@@ -138,7 +139,8 @@ class AgnosticGopherTagger(BaseTagger):
             return attrs
 
         try:
-            tokens = self.tokenizer.encode(sequence=text, add_special_tokens=False).tokens
+            encoding = self.tokenizer.encode(sequence=text, add_special_tokens=False)
+            tokens = encoding.tokens
             token_count = len(tokens)
             character_count = sum(len(token) for token in tokens)
 
@@ -152,21 +154,10 @@ class AgnosticGopherTagger(BaseTagger):
             ) / max(token_count, 1)
             attrs.required_token_count = sum(1 for token in tokens if token in self.required_words)
 
-            all_counts = all_ngram_counts(tokens)
-            count_most_common_ngrams = {2, 3, 4}
-            for n, ngram_counts in all_counts:
-                if not ngram_counts:
-                    continue
-                if n in count_most_common_ngrams:
-                    most_common_ngram, count = ngram_counts.most_common(1)[0]
-                    value = count * sum(len(w) for w in most_common_ngram) / max(character_count, 1)
-                    attrs.fraction_of_characters_in_most_common_ngram.append((n, value))
-                else:
-                    ng_char_count = sum(count * sum(len(w) for w in ng) for ng, count in ngram_counts.items())
-                    value = sum(
-                        count * sum(len(w) for w in ng) for ng, count in ngram_counts.items() if count > 1
-                    ) / max(ng_char_count, 1)
-                    attrs.fraction_of_characters_in_duplicate_ngrams.append((n, value))
+            (
+                attrs.fraction_of_characters_in_most_common_ngram,
+                attrs.fraction_of_characters_in_duplicate_ngrams,
+            ) = ngram_statistics(tokens, ids=encoding.ids)
 
             # NOTE: This assumes newlines are meaningful. In some languages (e.g. Chinese, Japanese),
             # newline characters may not correspond to natural sentence/paragraph boundaries.
@@ -4,6 +4,7 @@ from pathlib import Path
 from typing import List, Set
 
 from dolma.core.data_types import DocResult, Document, Span
+from dolma.core.keyword_matcher import KeywordMatcher
 from dolma.core.registry import TaggerRegistry
 from dolma.core.taggers import BaseTagger
 
@@ -11,6 +12,7 @@ MIN_WORDS_PER_LINE = 3
 NAUGHTY_LINES = (Path(__file__).parent / "../data/naughty_words_en.txt").absolute().open().read().splitlines()
 NAUGHTY_WORDS: Set[str] = set(w for w in NAUGHTY_LINES if " " not in w)
 NAUGHTY_PHRASES: Set[str] = set(w for w in NAUGHTY_LINES if " " in w)
+NAUGHTY_MATCHER = KeywordMatcher(words=NAUGHTY_WORDS, phrases=NAUGHTY_PHRASES)
 EOL_PUNCTUATION = {".", "?", "!", '"'}
 
 
@@ -45,6 +47,7 @@ def get_attributes(text: str) -> C4Attributes:
     attrs = C4Attributes([], [])
     attrs.character_count = len(text)
     try:
+        attrs.has_naughty_word = NAUGHTY_MATCHER.search(text.lower()) is not None
         lines = text.split("\n")
         attrs.line_count = len(lines)
         offset = 0
@@ -61,8 +64,6 @@ def get_attributes(text: str) -> C4Attributes:
             words = line.split()
             if len(words) < MIN_WORDS_PER_LINE:
                 attrs.lines_with_too_few_words.append(Span(offset, end_offset, type="lines_with_too_few_words"))
-            if any(word in NAUGHTY_WORDS for word in words) or any(phrase in line for phrase in NAUGHTY_PHRASES):
-                attrs.has_naughty_word = True
             if any(word == "javascript" for word in words):
                 attrs.has_javascript = True
             if "lorem ipsum" in line:
@@ -99,9 +100,7 @@ class FasterC4Tagger(BaseTagger):
         if "javascript" in text:
             spans.append(Span(0, len(doc.text), type="has_javascript"))
 
-        if any(word in NAUGHTY_WORDS for word in text.split()) or any(
-            phrase in text for phrase in NAUGHTY_PHRASES
-        ):
+        if NAUGHTY_MATCHER.search(text) is not None:
             spans.append(Span(0, len(doc.text), type="has_naughty_word"))
 
         start = count = 0
@@ -124,4 +123,4 @@ class FasterC4Tagger(BaseTagger):
             start = end
 
         spans.append(Span(0, len(doc.text), type="line_count", score=count))
-        return DocResult(doc=doc, spans=spans)
\ No newline at end of file
+        return DocResult(doc=doc, spans=spans)
@@ -21,9 +21,9 @@ with necessary(["detect_secrets", "bs4", "regex", "pygments"], soft=True) as COD
     if CODE_DEPENDENCIES_AVAILABLE:
         from .starcoder import get_nl_ratio
         from .utils import (
+            SecretsScanner,
             filter_html,
             get_ext_to_lang_mapping,
-            get_secrets,
             get_whitespace_regex,
         )
 
@@ -42,13 +42,13 @@ class CodeSecretsTagger(BaseTagger):
     def __init__(self) -> None:
         check_code_dependencies()
         super().__init__()
+        self.secrets_scanner = SecretsScanner()
 
-    @classmethod
-    def _extract_code_secrets(cls, text: str) -> List[Span]:
+    def _extract_code_secrets(self, text: str) -> List[Span]:
         secrets_spans: List[Span] = []
 
         text_lines = text.splitlines()
-        secrets = get_secrets(text)
+        secrets = self.secrets_scanner.get_secrets(text)
         for _, secret in secrets:
             line_number = secret.line_number - 1
             span = secret.secret_value
@@ -4,7 +4,9 @@ from collections import Counter
 from dataclasses import dataclass
 from statistics import median
 from typing import Counter as CounterType
-from typing import List, Tuple, Union
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
 
 from dolma.core.data_types import DocResult, Document, Span
 from dolma.core.registry import TaggerRegistry
@@ -14,6 +16,12 @@ REQUIRED_ENGLISH_WORDS = {"the", "be", "to", "of", "and", "that", "have", "with"
 SYMBOLS = {"#", "\u2026"}
 BULLET_POINTS = {"*", "-"}
 
+COUNT_MOST_COMMON_NGRAMS = (2, 3, 4)
+COUNT_DUPLICATE_NGRAMS = (5, 6, 7, 8, 9, 10)
+
+# odd multiplier for the rolling hash of n-grams; any odd 64-bit constant works
+NGRAM_HASH_BASE = np.uint64(0x9E3779B97F4A7C15)
+
 
 def robust_median(values: List[Union[int, float]]) -> float:
     if not values:
@@ -157,22 +165,10 @@ def get_attributes(text: str, ignore_empty_lines: bool = False) -> GopherAttribu
         ) / max(word_count, 1)
         attrs.required_word_count = sum(1 for word in words if word in REQUIRED_ENGLISH_WORDS)
 
-        all_counts = all_ngram_counts(words)
-
-        count_most_common_ngrams = {2, 3, 4}
-        for n, ngram_counts in all_counts:
-            if not ngram_counts:
-                continue
-            if n in count_most_common_ngrams:
-                most_common_ngram, count = ngram_counts.most_common(1)[0]
-                value = count * sum(len(w) for w in most_common_ngram) / max(character_count, 1)
-                attrs.fraction_of_characters_in_most_common_ngram.append((n, value))
-            else:
-                ng_char_count = sum(count * sum(len(w) for w in ng) for ng, count in ngram_counts.items())
-                value = sum(
-                    count * sum(len(w) for w in ng) for ng, count in ngram_counts.items() if count > 1
-                ) / max(ng_char_count, 1)
-                attrs.fraction_of_characters_in_duplicate_ngrams.append((n, value))
+        (
+            attrs.fraction_of_characters_in_most_common_ngram,
+            attrs.fraction_of_characters_in_duplicate_ngrams,
+        ) = ngram_statistics(words)
 
         if ignore_empty_lines:
             lines = re.split(r"\n+", text)
@@ -201,7 +197,76 @@ def get_attributes(text: str, ignore_empty_lines: bool = False) -> GopherAttribu
     return attrs
 
 
+def _splitmix64(values: np.ndarray) -> np.ndarray:
+    """Scramble 64-bit integers, so that ids of similar value get unrelated hashes."""
+    values = values.astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def ngram_statistics(
+    words: Sequence[str], ids: Optional[Sequence[int]] = None
+) -> Tuple[List[Tuple[int, float]], List[Tuple[int, float]]]:
+    """Compute the n-gram repetition statistics of Gopher rules.
+
+    For each n in COUNT_MOST_COMMON_NGRAMS, returns the fraction of characters (over all words) covered by
+    occurrences of the most common n-gram; for each n in COUNT_DUPLICATE_NGRAMS, returns the fraction of
+    characters of all n-grams that belong to n-grams occurring more than once. Values of n for which there
+    are no n-grams are skipped. Results are the same as the ones computed from `all_ngram_counts`.
+
+    Instead of counting tuples of words, each n-gram is represented by a 64-bit rolling hash of the ids
+    of its words, so memory is linear in the number of words regardless of n.
+
+    Args:
+        words (Sequence[str]): Words (or tokens) of the document.
+        ids (Optional[Sequence[int]]): Ids of the words, if available (e.g., from a tokenizer); identical
+            words must have identical ids. If not provided, ids are assigned to words.
+    """
+    most_common: List[Tuple[int, float]] = []
+    duplicate: List[Tuple[int, float]] = []
+
+    if ids is None:
+        vocab: Dict[str, int] = {}
+        ids = [vocab.setdefault(word, len(vocab)) for word in words]
+
+    num_words = len(words)
+    if num_words < 2:
+        return most_common, duplicate
+
+    character_count = sum(len(word) for word in words)
+    cumulative_lengths = np.zeros(num_words + 1, dtype=np.int64)
+    np.cumsum(np.fromiter(map(len, words), dtype=np.int64, count=num_words), out=cumulative_lengths[1:])
+
+    word_hashes = _splitmix64(np.asarray(ids, dtype=np.int64))
+    hashes = word_hashes
+    for n in range(2, max(*COUNT_MOST_COMMON_NGRAMS, *COUNT_DUPLICATE_NGRAMS) + 1):
+        if n > num_words:
+            break
+
+        # hash of the n-gram starting at each position; uint64 arithmetic wraps around
+        hashes = hashes[:-1] * NGRAM_HASH_BASE + word_hashes[n - 1 :]
+        ngram_lengths = cumulative_lengths[n:] - cumulative_lengths[:-n]
+
+        if n in COUNT_MOST_COMMON_NGRAMS:
+            _, first_index, counts = np.unique(hashes, return_index=True, return_counts=True)
+            # like Counter.most_common, ties are broken in favor of the n-gram that occurs first
+            most_common_count = counts.max()
+            position = first_index[counts == most_common_count].min()
+            value = int(most_common_count) * int(ngram_lengths[position]) / max(character_count, 1)
+            most_common.append((n, value))
+
+        if n in COUNT_DUPLICATE_NGRAMS:
+            _, inverse, counts = np.unique(hashes, return_inverse=True, return_counts=True)
+            ng_char_count = int(ngram_lengths.sum())
+            duplicate_char_count = int(ngram_lengths[counts[inverse] > 1].sum())
+            duplicate.append((n, duplicate_char_count / max(ng_char_count, 1)))
+
+    return most_common, duplicate
+
+
 def all_ngram_counts(words) -> List[Tuple[int, CounterType[Tuple[str, ...]]]]:
+    """Count all n-grams for n between 2 and 10; this is a slow reference for `ngram_statistics`."""
     return [(n, Counter(list(zip(*[words[i:] for i in range(n)])))) for n in range(2, 11)]
 
 
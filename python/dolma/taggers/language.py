@@ -4,7 +4,17 @@ Language Detection
 @kylel, @soldni
 """
 
-from typing import TYPE_CHECKING, List, Tuple
+from collections import OrderedDict
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Generic,
+    Hashable,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
 
 import necessary
 import regex
@@ -35,40 +45,130 @@ with necessary.necessary("lingua", soft=True) as LINGUA_AVAILABLE:
         from lingua import Language, LanguageDetectorBuilder
 
 
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class LruCache(Generic[K, V]):
+    """A dictionary that holds at most `max_size` items, evicting the least recently used ones first."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items: "OrderedDict[K, V]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: K) -> Optional[V]:
+        if (value := self._items.get(key)) is not None:
+            self._items.move_to_end(key)
+        return value
+
+    def put(self, key: K, value: V) -> None:
+        self._items[key] = value
+        self._items.move_to_end(key)
+        if len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+
 class BaseLanguageTagger(BaseTagger):
     INCLUDE_NEGATIVE = True
     PREDICT_ON_PARAGRAPHS = False
 
+    # Short texts such as "Home" or "Share this" recur across millions of web pages; predictions for texts of
+    # at most CACHE_MAX_LENGTH characters are kept in a per-tagger LRU cache of CACHE_SIZE entries, keyed on
+    # the text as normalized by `cache_key`. Setting CACHE_SIZE to 0 disables the cache.
+    CACHE_SIZE = 0
+    CACHE_MAX_LENGTH = 100
+
+    def __init__(self) -> None:
+        self._cache: LruCache[str, List[Tuple[str, float]]] = LruCache(self.CACHE_SIZE)
+
     def predict_text(self, text: str) -> List[Tuple[str, float]]:
         return []
 
+    def predict_texts(self, texts: List[str]) -> List[List[Tuple[str, float]]]:
+        """Predict languages for many texts at once; taggers whose backend accepts multiple inputs in a
+        single call should override this method."""
+        return [self.predict_text(text) for text in texts]
+
+    def cache_key(self, text: str) -> str:
+        """Key under which predictions for text are cached. Two texts with the same key must get the same
+        prediction, so this should normalize text exactly like the backend does before classifying it."""
+        return text
+
+    def predict_texts_cached(self, texts: List[str]) -> List[List[Tuple[str, float]]]:
+        """Same as `predict_texts`, but each distinct text is classified once, and predictions for short
+        texts are looked up in the cache first."""
+        use_cache = self.CACHE_SIZE > 0
+        predictions: Dict[str, List[Tuple[str, float]]] = {}
+        keys: List[str] = []
+        to_predict: Dict[str, str] = {}
+
+        for text in texts:
+            keys.append(key := self.cache_key(text))
+            if key in predictions or key in to_predict:
+                continue
+            if use_cache and len(text) <= self.CACHE_MAX_LENGTH and (cached := self._cache.get(key)) is not None:
+                predictions[key] = cached
+            else:
+                to_predict[key] = text
+
+        if to_predict:
+            for (key, text), prediction in zip(to_predict.items(), self.predict_texts(list(to_predict.values()))):
+                predictions[key] = prediction
+                if use_cache and len(text) <= self.CACHE_MAX_LENGTH:
+                    self._cache.put(key, prediction)
+
+        return [predictions[key] for key in keys]
+
     def make_negative(self, spans: List[Span]) -> List[Span]:
         return [
             Span(start=span.start, end=span.end, type=f"not_{span.type}", score=1.0 - span.score) for span in spans
         ]
 
     def predict_doc(self, doc: Document) -> DocResult:
-        spans = [
-            Span(start=0, end=len(doc.text), type=str(lang), score=score)
-            for lang, score in self.predict_text(doc.text)
-        ]
-        return DocResult(doc=doc, spans=spans)
+        return self.predict_docs([doc])[0]
 
     def predict_paragraph(self, doc: Document) -> DocResult:
-        paragraphs = split_paragraphs(doc.text)
-        spans: List[Span] = []
-        for paragraph in paragraphs:
-            spans.extend(
-                Span(start=paragraph.start, end=paragraph.end, type=lang, score=score)
-                for lang, score in self.predict_text(paragraph.text)
+        return self.predict_paragraphs([doc])[0]
+
+    def predict_docs(self, docs: List[Document]) -> List[DocResult]:
+        predictions = self.predict_texts_cached([doc.text for doc in docs])
+        return [
+            DocResult(
+                doc=doc,
+                spans=[Span(start=0, end=len(doc.text), type=str(lang), score=score) for lang, score in preds],
             )
-        return DocResult(doc=doc, spans=spans)
+            for doc, preds in zip(docs, predictions)
+        ]
 
-    def predict(self, doc: Document) -> DocResult:
-        doc_result = self.predict_paragraph(doc) if self.PREDICT_ON_PARAGRAPHS else self.predict_doc(doc)
+    def predict_paragraphs(self, docs: List[Document]) -> List[DocResult]:
+        # classify the paragraphs of all documents together, so that backends can batch them
+        paragraphs_per_doc = [split_paragraphs(doc.text) for doc in docs]
+        predictions = iter(self.predict_texts_cached([p.text for ps in paragraphs_per_doc for p in ps]))
+
+        results = []
+        for doc, paragraphs in zip(docs, paragraphs_per_doc):
+            spans: List[Span] = []
+            for paragraph in paragraphs:
+                spans.extend(
+                    Span(start=paragraph.start, end=paragraph.end, type=lang, score=score)
+                    for lang, score in next(predictions)
+                )
+            results.append(DocResult(doc=doc, spans=spans))
+        return results
+
+    def predict_batch(self, docs: List[Document]) -> List[DocResult]:
+        """Predict many documents at once; returns the same results as calling `predict` on each of them."""
+        doc_results = self.predict_paragraphs(docs) if self.PREDICT_ON_PARAGRAPHS else self.predict_docs(docs)
         if self.INCLUDE_NEGATIVE:
-            doc_result.spans.extend(self.make_negative(doc_result.spans))
-        return doc_result
+            for doc_result in doc_results:
+                doc_result.spans.extend(self.make_negative(doc_result.spans))
+        return doc_results
+
+    def predict(self, doc: Document) -> DocResult:
+        return self.predict_batch([doc])[0]
 
 
 @TaggerRegistry.add("cld3_en_doc_v2")
@@ -93,6 +193,7 @@ class Cld3LanguageTaggerParagraph(Cld3LanguageTagger):
 class Cld2LanguageTagger(BaseLanguageTagger):
     INCLUDE_NEGATIVE = False
     PREDICT_ON_PARAGRAPHS = False
+    CACHE_SIZE = 2**16
     RE_BAD_CHARS = regex.compile(r"[\p{Cc}\p{Cs}]+")
 
     def __init__(self) -> None:
@@ -109,8 +210,8 @@ class Cld2LanguageTagger(BaseLanguageTagger):
     def _identity_fn(self, text: str) -> str:
         return text
 
-    def predict_text(self, text: str) -> List[Tuple[str, float]]:
-        details = []
+    def _detect(self, text: str) -> Tuple[bool, tuple]:
+        details: tuple = ()
         is_reliable = False
         for fn in (self._identity_fn, self._to_ascii_input, self._sanitize_input):
             try:
@@ -118,6 +219,10 @@ class Cld2LanguageTagger(BaseLanguageTagger):
                 break
             except cld2.error:
                 ...
+        return is_reliable, details
+
+    def predict_text(self, text: str) -> List[Tuple[str, float]]:
+        is_reliable, details = self._detect(text)
         return [(d[0][:2].lower(), d[2] / 100.0) for d in details if d[0] != "UNKNOWN_LANGUAGE" and is_reliable]
 
 
@@ -149,20 +254,34 @@ class FastTextAllLanguagesDocumentTagger(BaseLanguageTagger, BaseFastTextTagger)
     MODEL_PATH = "https://dl.fbaipublicfiles.com/fasttext/supervised-models/lid.176.bin"
     INCLUDE_NEGATIVE = False
     PREDICT_ON_PARAGRAPHS = False
+    CACHE_SIZE = 2**16
 
     def __init__(self):
+        BaseLanguageTagger.__init__(self)
         BaseFastTextTagger.__init__(self, model_path=self.MODEL_PATH, model_mode=self.DOCUMENT_LEVEL_TAGGER)
 
+    def cache_key(self, text: str) -> str:
+        return text.lower().replace("\n", " ").strip()
+
     def predict_text(self, text: str) -> List[Tuple[str, float]]:
-        preds = self.classifier.predict(text.lower().replace("\n", " ").strip(), k=-1)
-        return [(label.replace("__label__", ""), float(score)) for label, score in zip(*preds)]
+        return self.predict_texts([text])[0]
+
+    def predict_texts(self, texts: List[str]) -> List[List[Tuple[str, float]]]:
+        # fasttext classifies a list of texts in a single call to the native library
+        all_labels, all_scores = self.classifier.predict([self.cache_key(text) for text in texts], k=-1)
+        return [
+            [(label.replace("__label__", ""), float(score)) for label, score in zip(labels, scores)]
+            for labels, scores in zip(all_labels, all_scores)
+        ]
 
 
 @TaggerRegistry.add("ft_lang_id_1e2")
 class FastTextAllLanguagesDocumentMinScoreTagger(FastTextAllLanguagesDocumentTagger):
-    def predict_text(self, text: str) -> List[Tuple[str, float]]:
-        out = super().predict_text(text)
-        return [(lang, round(score, 2)) for lang, score in out if score > 0.01]
+    def predict_texts(self, texts: List[str]) -> List[List[Tuple[str, float]]]:
+        return [
+            [(lang, round(score, 2)) for lang, score in out if score > 0.01]
+            for out in super().predict_texts(texts)
+        ]
 
 
 @TaggerRegistry.add("ft_lang_id_paragraph_v1")
@@ -176,10 +295,11 @@ class FastTextEnglishLanguageDocumentTagger(FastTextAllLanguagesDocumentTagger):
     INCLUDE_NEGATIVE = True
     PREDICT_ON_PARAGRAPHS = False
 
-    def predict_text(self, text: str) -> List[Tuple[str, float]]:
-        preds = super().predict_text(text)
-        filtered_preds = [(lang, score) for lang, score in preds if lang == "en"] or [("en", 0.0)]
-        return filtered_preds  # pyright: ignore
+    def predict_texts(self, texts: List[str]) -> List[List[Tuple[str, float]]]:
+        return [
+            [(lang, score) for lang, score in preds if lang == "en"] or [("en", 0.0)]
+            for preds in super().predict_texts(texts)
+        ]
 
 
 @TaggerRegistry.add("ft_lang_id_en_only_v2")
@@ -248,6 +368,11 @@ class LangdetectEnglishTaggerParagraph(LangdetectEnglishTagger):
 class LinguaTagger(BaseLanguageTagger):
     INCLUDE_NEGATIVE = False
     PREDICT_ON_PARAGRAPHS = False
+    CACHE_SIZE = 2**16
+
+    # lingua can classify a batch of texts on its own thread pool, one thread per core; taggers already run in
+    # one process per core, so this would oversubscribe the CPU. Only enable it when running a single process.
+    PARALLEL_PREDICTION = False
 
     def __init__(self) -> None:
         super().__init__()
@@ -256,15 +381,26 @@ class LinguaTagger(BaseLanguageTagger):
         self.detector = LanguageDetectorBuilder.from_languages(*Language.all()).build()
 
     def predict_text(self, text: str) -> List[Tuple[str, float]]:
-        langs_conf = self.detector.compute_language_confidence_values(text) or []
-        return [(lang.language.iso_code_639_1.name.lower(), float(lang.value)) for lang in langs_conf]
+        return self.predict_texts([text])[0]
+
+    def predict_texts(self, texts: List[str]) -> List[List[Tuple[str, float]]]:
+        if self.PARALLEL_PREDICTION and len(texts) > 1:
+            all_langs_conf = self.detector.compute_language_confidence_values_in_parallel(texts)
+        else:
+            all_langs_conf = [self.detector.compute_language_confidence_values(text) for text in texts]
+        return [
+            [(lang.language.iso_code_639_1.name.lower(), float(lang.value)) for lang in (langs_conf or [])]
+            for langs_conf in all_langs_conf
+        ]
 
 
 @TaggerRegistry.add("lingua_1e2")
 class LinguaMinScoreTagger(LinguaTagger):
-    def predict_text(self, text: str) -> List[Tuple[str, float]]:
-        out = super().predict_text(text)
-        return [(lang, round(score, 2)) for lang, score in out if score > 0.01]
+    def predict_texts(self, texts: List[str]) -> List[List[Tuple[str, float]]]:
+        return [
+            [(lang, round(score, 2)) for lang, score in out if score > 0.01]
+            for out in super().predict_texts(texts)
+        ]
 
 
 @TaggerRegistry.add("lingua_doc_en_v1")
@@ -272,10 +408,11 @@ class LinguaEnglishTagger(LinguaTagger):
     INCLUDE_NEGATIVE = True
     PREDICT_ON_PARAGRAPHS = False
 
-    def predict_text(self, text: str) -> List[Tuple[str, float]]:
-        pred = super().predict_text(text)
-        filtered_langs = [(lang, score) for lang, score in pred if lang == "en"] or [("en", 0.0)]
-        return filtered_langs  # pyright: ignore
+    def predict_texts(self, texts: List[str]) -> List[List[Tuple[str, float]]]:
+        return [
+            [(lang, score) for lang, score in pred if lang == "en"] or [("en", 0.0)]
+            for pred in super().predict_texts(texts)
+        ]
 
 
 @TaggerRegistry.add("lingua_en_only_v1")
@@ -296,6 +433,154 @@ class LinguaEnglishTaggerParagraph(LinguaEnglishTagger):
     INCLUDE_NEGATIVE = True
 
 
+# Scripts in which languages other than the ones written in Latin script are usually written; codes are the ones
+# used by lid.176 and ISO 639-1, which covers the codes returned by cld2 and lingua too.
+LANGUAGE_SCRIPTS: Dict[str, Tuple[str, ...]] = {
+    **{
+        lang: ("Cyrillic",)
+        for lang in ("ru", "uk", "be", "bg", "mk", "kk", "ky", "tg", "mn", "ba", "tt", "cv", "ce")
+    },
+    **{lang: ("Cyrillic", "Latin") for lang in ("sr", "uz")},
+    **{lang: ("Arabic",) for lang in ("ar", "fa", "ur", "ps", "ug", "sd", "ckb", "arz", "azb", "pnb", "mzn")},
+    **{lang: ("Hebrew",) for lang in ("he", "yi")},
+    **{lang: ("Devanagari",) for lang in ("hi", "mr", "ne", "sa", "mai", "new")},
+    **{lang: ("Bengali",) for lang in ("bn", "as", "bpy")},
+    **{lang: ("Ethiopic",) for lang in ("am", "ti")},
+    "el": ("Greek",),
+    "ta": ("Tamil",),
+    "te": ("Telugu",),
+    "kn": ("Kannada",),
+    "ml": ("Malayalam",),
+    "gu": ("Gujarati",),
+    "pa": ("Gurmukhi",),
+    "or": ("Oriya",),
+    "si": ("Sinhala",),
+    "th": ("Thai",),
+    "lo": ("Lao",),
+    "km": ("Khmer",),
+    "my": ("Myanmar",),
+    "bo": ("Tibetan",),
+    "dv": ("Thaana",),
+    "ka": ("Georgian",),
+    "hy": ("Armenian",),
+    "ko": ("Hangul", "Han"),
+    "ja": ("Han", "Hiragana", "Katakana"),
+    **{lang: ("Han",) for lang in ("zh", "wuu", "yue")},
+}
+DEFAULT_LANGUAGE_SCRIPTS = ("Latin",)
+RE_SCRIPTS = regex.compile(
+    "|".join(
+        rf"(?P<{script}>\p{{{script}}}+)"
+        for script in sorted({s for scripts in LANGUAGE_SCRIPTS.values() for s in scripts} | {"Latin"})
+    )
+)
+
+
+def dominant_script(text: str) -> Optional[str]:
+    """Return the script most letters of text are written in, or None if text has no letters."""
+    counts: Dict[str, int] = {}
+    for match in RE_SCRIPTS.finditer(text):
+        script = str(match.lastgroup)
+        counts[script] = counts.get(script, 0) + match.end() - match.start()
+    return max(counts, key=counts.__getitem__) if counts else None
+
+
+@TaggerRegistry.add("cascade_lang_id_doc_v1")
+class CascadeLanguageTagger(BaseLanguageTagger):
+    """Identify languages with the cheapest backend that is confident about its prediction.
+
+    Backends in BACKENDS are tried in order; a text is passed on to the next backend if the top language
+    predicted by the current one has a score below its MIN_CONFIDENCE, or is not usually written in the script
+    most of the text is in. The last backend always decides. Predictions of the backend that decided are
+    returned as usual, together with a `decided_by_<backend>` span with score 1.0.
+    """
+
+    INCLUDE_NEGATIVE = False
+    PREDICT_ON_PARAGRAPHS = False
+    CACHE_SIZE = 2**16
+
+    BACKENDS: Tuple[str, ...] = ("cld2", "fasttext", "lingua")
+    MIN_CONFIDENCE: Dict[str, float] = {"cld2": 0.9, "fasttext": 0.8}
+
+    # predictions with lower scores than this are not returned
+    MIN_SCORE = 0.01
+
+    # cld2 uses a few codes that are different from the ones of the other backends
+    CLD2_CODES = {"iw": "he", "jw": "jv", "zh-Hant": "zh"}
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.cld2_tagger: Optional[Cld2LanguageTagger] = None
+        self.fasttext_tagger: Optional[FastTextAllLanguagesDocumentTagger] = None
+        self.lingua_tagger: Optional[LinguaTagger] = None
+
+        for backend in self.BACKENDS:
+            if backend == "cld2":
+                self.cld2_tagger = Cld2LanguageTagger()
+            elif backend == "fasttext":
+                self.fasttext_tagger = FastTextAllLanguagesDocumentTagger()
+            elif backend == "lingua":
+                self.lingua_tagger = LinguaTagger()
+            else:
+                raise ValueError(f"Unknown language identification backend {backend}")
+
+    def predict_with_backend(self, backend: str, texts: List[str]) -> List[List[Tuple[str, float]]]:
+        if backend == "cld2" and self.cld2_tagger is not None:
+            predictions = []
+            for text in texts:
+                is_reliable, details = self.cld2_tagger._detect(text)
+                predictions.append(
+                    [
+                        (self.CLD2_CODES.get(d[1], d[1]), d[2] / 100.0)
+                        for d in details
+                        if d[1] != "un" and is_reliable
+                    ]
+                )
+            return predictions
+        elif backend == "fasttext" and self.fasttext_tagger is not None:
+            return self.fasttext_tagger.predict_texts(texts)
+        elif backend == "lingua" and self.lingua_tagger is not None:
+            return self.lingua_tagger.predict_texts(texts)
+        raise ValueError(f"Unknown language identification backend {backend}")
+
+    def is_confident(self, backend: str, predictions: List[Tuple[str, float]], script: Optional[str]) -> bool:
+        if not predictions:
+            return False
+        lang, score = max(predictions, key=lambda p: p[1])
+        if score < self.MIN_CONFIDENCE.get(backend, 0.0):
+            return False
+        return script is None or script in LANGUAGE_SCRIPTS.get(lang, DEFAULT_LANGUAGE_SCRIPTS)
+
+    def predict_text(self, text: str) -> List[Tuple[str, float]]:
+        return self.predict_texts([text])[0]
+
+    def predict_texts(self, texts: List[str]) -> List[List[Tuple[str, float]]]:
+        scripts = [dominant_script(text) for text in texts]
+        outputs: List[List[Tuple[str, float]]] = [[] for _ in texts]
+
+        # each backend only sees the texts the previous ones were not confident about, in a single batch
+        pending = list(range(len(texts)))
+        for i, backend in enumerate(self.BACKENDS):
+            if not pending:
+                break
+            is_last = i == len(self.BACKENDS) - 1
+            still_pending = []
+            for j, predictions in zip(pending, self.predict_with_backend(backend, [texts[j] for j in pending])):
+                if is_last or self.is_confident(backend, predictions, scripts[j]):
+                    outputs[j] = [(lang, score) for lang, score in predictions if score >= self.MIN_SCORE]
+                    outputs[j].append((f"decided_by_{backend}", 1.0))
+                else:
+                    still_pending.append(j)
+            pending = still_pending
+
+        return outputs
+
+
+@TaggerRegistry.add("cascade_lang_id_paragraph_v1")
+class CascadeLanguageTaggerParagraph(CascadeLanguageTagger):
+    PREDICT_ON_PARAGRAPHS = True
+
+
 def add_global_language_score_from_slice_score(result: DocResult) -> DocResult:
     # the total document score is # of characters in each "english" span multiplied by the likelihood
     # of said span being english
@@ -317,23 +602,17 @@ def add_global_language_score_from_slice_score(result: DocResult) -> DocResult:
 
 @TaggerRegistry.add("cld2_en_paragraph_with_doc_score_v2")
 class Cld2LanguageFilterParagraphWithDocScoreTagger(Cld2EnglishLanguageParagraphTagger):
-    def predict(self, doc: Document) -> DocResult:
-        doc_result = super().predict(doc)
-        doc_result = add_global_language_score_from_slice_score(doc_result)
-        return doc_result
+    def predict_batch(self, docs: List[Document]) -> List[DocResult]:
+        return [add_global_language_score_from_slice_score(r) for r in super().predict_batch(docs)]
 
 
 @TaggerRegistry.add("cld3_en_paragraph_with_doc_score_v2")
 class Cld3LanguageFilterParagraphWithDocScoreTagger(Cld3LanguageTaggerParagraph):
-    def predict(self, doc: Document) -> DocResult:
-        doc_result = super().predict(doc)
-        doc_result = add_global_language_score_from_slice_score(doc_result)
-        return doc_result
+    def predict_batch(self, docs: List[Document]) -> List[DocResult]:
+        return [add_global_language_score_from_slice_score(r) for r in super().predict_batch(docs)]
 
 
 @TaggerRegistry.add("ft_lang_id_en_paragraph_with_doc_score_v2")
 class FastTextEnglishLanguageParagraphWithDocScoreTagger(FastTextEnglishLanguageParagraphTagger):
-    def predict(self, doc: Document) -> DocResult:
-        doc_result = super().predict(doc)
-        doc_result = add_global_language_score_from_slice_score(doc_result)
-        return doc_result
+    def predict_batch(self, docs: List[Document]) -> List[DocResult]:
+        return [add_global_language_score_from_slice_score(r) for r in super().predict_batch(docs)]
@@ -7,7 +7,7 @@ Filters.
 """
 
 import re
-from typing import List
+from typing import Dict, Iterator, List, Optional, Tuple
 from warnings import warn
 
 from necessary import necessary
@@ -21,7 +21,35 @@ from dolma.core.registry import TaggerRegistry
 from dolma.core.taggers import BaseTagger
 from dolma.core.utils import split_paragraphs
 
-__all__ = ["PiiPresidioV1", "PiiRegexV1", "PiiRegexV2", "FastPiiRegex", "PiiRegexWithCountV2"]
+__all__ = ["PiiPresidioV1", "PiiRegexV1", "PiiRegexV2", "FastPiiRegex", "PiiRegexWithCountV2", "PiiRegexScanner"]
+
+
+class PiiRegexScanner:
+    """Run a set of PII regular expressions over a text, skipping the ones that cannot match.
+
+    Each PII type has a pre-filter, a cheap regular expression that must occur in any text the PII regex
+    matches (e.g., an `@` for emails). Pre-filters are also combined into a single regex, so that a text
+    with no candidate for any type is rejected after one scan, which is the case for most web documents.
+    """
+
+    def __init__(self, patterns: Dict[str, "re.Pattern[str]"], prefilters: Dict[str, str]):
+        if missing := set(patterns) - set(prefilters):
+            raise ValueError(f"Missing pre-filter for PII types: {', '.join(sorted(missing))}")
+        self.patterns = patterns
+        self.prefilters = {pii_type: re.compile(prefilters[pii_type]) for pii_type in patterns}
+        self.any_prefilter = re.compile("|".join(f"(?:{prefilters[pii_type]})" for pii_type in patterns))
+
+    def may_contain_pii(self, text: str) -> bool:
+        return self.any_prefilter.search(text) is not None
+
+    def scan(self, text: str) -> Iterator[Tuple[str, "re.Match[str]"]]:
+        """Yield type and match for every PII match; matches are grouped by type, in order of `patterns`."""
+        if not self.may_contain_pii(text):
+            return
+        for pii_type, pattern in self.patterns.items():
+            if self.prefilters[pii_type].search(text) is not None:
+                for match in pattern.finditer(text):
+                    yield pii_type, match
 
 
 class BasePiiFilter(BaseTagger):
@@ -33,7 +61,7 @@ class BasePiiFilter(BaseTagger):
     REGEX = "regex"
 
     # ENGLISH = "en"
-    LANGUAGES = ["en", "es", "de"] # These are the languages Presidio supports by default.
+    LANGUAGES = ["en", "es", "de"]  # These are the languages Presidio supports by default.
     WINDOW = 100
 
     def __init__(
@@ -65,6 +93,11 @@ class BasePiiFilter(BaseTagger):
             "(\\([^\\s()<>]+\\)))*\\))+(?:\\(([^\\s()<>]+|(\\([^\\s()<>]+\\)))*\\)|[^\\s`!()\\[\\]"
             "{};:'\".,<>?«»“”‘’]))"
         )
+        # emails need an @, phone numbers end with four digits, and IP addresses have a digit, a dot, and a digit
+        self.pii_scanner = PiiRegexScanner(
+            patterns=self.pii_type_to_regex,
+            prefilters={self.EMAIL: "@", self.PHONE: r"\d{4}", self.IP: r"\d\.\d"},
+        )
 
         # presidio
         if self.method == self.PRESIDIO:
@@ -97,10 +130,9 @@ class BasePiiFilter(BaseTagger):
 
     def _extract_pii_regex(self, text: str) -> List[Span]:
         pii_spans: List[Span] = []
-        for pii_type, regex in self.pii_type_to_regex.items():
-            for match in regex.finditer(text):
-                start, end = match.span()
-                pii_spans.append(Span(start=start, end=end, type=pii_type))
+        for pii_type, match in self.pii_scanner.scan(text):
+            start, end = match.span()
+            pii_spans.append(Span(start=start, end=end, type=pii_type))
         return pii_spans
 
     def _extract_pii_presidio(self, text: str) -> List[Span]:
@@ -117,6 +149,8 @@ class BasePiiFilter(BaseTagger):
     def _postprocess(self, text: str, pii_spans: List[Span], window: int) -> List[Span]:
         """Applies some rules to remove over-prediction of PII types."""
         new_pii_spans = []
+        # whether the text contains a URL is only computed once, and only if there is a phone number
+        contains_url: Optional[bool] = None
         for pii_span in pii_spans:
             if pii_span.type == self.EMAIL:
                 if self._is_email(text, pii_span):
@@ -134,7 +168,9 @@ class BasePiiFilter(BaseTagger):
                     new_pii_spans.append(pii_span)
                 elif pii_span.type == self.PHONE:
                     # for phone numbers, additionally shouldnt be URL
-                    if self._contains_url(text=text):
+                    if contains_url is None:
+                        contains_url = self._contains_url(text=text)
+                    if contains_url:
                         pass
                     else:
                         new_pii_spans.append(pii_span)
@@ -144,7 +180,7 @@ class BasePiiFilter(BaseTagger):
         return new_pii_spans
 
     def _contains_url(self, text: str) -> bool:
-        return len(self.url_regex.findall(text)) > 0
+        return self.url_regex.search(text) is not None
 
     def _is_email(self, text: str, pii_span: Span) -> bool:
         """
@@ -207,6 +243,18 @@ class FastPiiRegex(BaseTagger):
 
         self.pre_ip_regex = re.compile(r"\.[^\s]")
         self.pre_phone_regex = re.compile(r"\d")
+        self.pii_scanner = PiiRegexScanner(
+            patterns={
+                self.EMAIL_KEY: self.email_regex,
+                self.PHONE_KEY: self.phone_regex,
+                self.IP_KEY: self.ip_regex,
+            },
+            prefilters={
+                self.EMAIL_KEY: "@",
+                self.PHONE_KEY: self.pre_phone_regex.pattern,
+                self.IP_KEY: self.pre_ip_regex.pattern,
+            },
+        )
 
     def _false_positive_identifiers(self, text: str) -> bool:
         return "isbn" in text or "doi" in text or "#" in text
@@ -254,12 +302,17 @@ class FastPiiRegex(BaseTagger):
         return self.url_regex.search(text) is not None
 
     def predict(self, doc: Document) -> DocResult:
-        paragraphs = split_paragraphs(doc.text)
         spans: List[Span] = []
+        paragraphs: List[TextSlice]
 
-        if doc.text.count("?") > 10_000:
+        if not self.pii_scanner.may_contain_pii(doc.text):
+            # no paragraph can have a match if the whole document has no candidate
+            paragraphs = []
+        elif doc.text.count("?") > 10_000:
             warn("Skipping regex PII detection for doc with >10k question marks")
             paragraphs = []
+        else:
+            paragraphs = split_paragraphs(doc.text)
 
         for paragraph in paragraphs:
             spans.extend(self._predict_email(paragraph))
@@ -4,18 +4,27 @@ Taggers to detect repetitions in the text.
 @soldni
 """
 
-import re
+import time
 from abc import abstractmethod
-from typing import Generator, List
+from typing import Generator, Iterable, List, Optional, Tuple
 
 import numpy as np
 from tokenizers import Tokenizer
 
 from dolma.core.data_types import DocResult, Document, Span
+from dolma.core.loggers import get_logger
 from dolma.core.registry import TaggerRegistry
 from dolma.core.taggers import BaseTagger
 from dolma.core.utils import split_paragraphs
-from .utils import find_periodic_sequences
+
+from .utils import (
+    RepetitionTuple,
+    find_char_repetitions,
+    find_periodic_sequences,
+    find_periodic_sequences_batch,
+)
+
+LOGGER = get_logger(__name__)
 
 
 class BaseRepetitionsTagger(BaseTagger):
@@ -60,26 +69,30 @@ class BaseRepetitionsTagger(BaseTagger):
 
 @TaggerRegistry.add("repetitions_v1")
 class RepetitionsTagger(BaseRepetitionsTagger):
-    """Tagger to detect repetitions of of groups of characters.
-    Only repetitions that occur at least 4 times are detected."""
+    r"""Tagger to detect repetitions of of groups of characters.
+    Only repetitions that occur at least 4 times are detected.
 
-    def __init__(self) -> None:
-        self.re_char_repetitions = re.compile(r"(.+?)(\s?\1){3,}")
-        super().__init__()
+    Matches are the same as the ones of the regex `(.+?)(\s?\1){3,}`, but are found without backtracking (see
+    `find_char_repetitions`). If a document takes longer than `time_budget` seconds, the search stops and only
+    the repetitions found so far are returned."""
 
-    def _extract_from_text(self, text: str) -> Generator[Span, None, None]:
+    time_budget: Optional[float] = 30.0
+
+    def _extract_from_text(self, text: str, deadline: Optional[float] = None) -> Generator[Span, None, None]:
         """Extract repetitions of characters in the text."""
-        for match in self.re_char_repetitions.finditer(text):
-            repeated_text = match.group(1)
-            span = Span(
-                start=match.start(),
-                end=match.end(),
-                type="repetition",
-                # score=float(end - start) // len(repeated_text),
-                score=match.group(0).count(repeated_text),
-            )
+        for seq in find_char_repetitions(text, deadline=deadline):
+            span = Span(start=seq.start, end=seq.end, type="repetition", score=seq.times)
             yield span
 
+    def _get_deadline(self) -> Optional[float]:
+        return time.monotonic() + self.time_budget if self.time_budget is not None else None
+
+    def _extract_from_doc(self, doc: Document) -> Generator[Span, None, None]:
+        try:
+            yield from self._extract_from_text(doc.text, deadline=self._get_deadline())
+        except TimeoutError as e:
+            LOGGER.warning(f"Document {doc.id} from {doc.source} exceeded repetitions time budget: {e}")
+
 
 @TaggerRegistry.add("paragraph_repetitions_v1")
 class ParagraphRepetitionsTagger(RepetitionsTagger):
@@ -88,13 +101,16 @@ class ParagraphRepetitionsTagger(RepetitionsTagger):
     repetitions of characters that span multiple paragraphs."""
 
     def _extract_from_doc(self, doc: Document) -> Generator[Span, None, None]:
-        offset = 0
-        for paragraph in split_paragraphs(doc.text, remove_empty=False):
-            for span in self._extract_from_text(paragraph.text):
-                span.start += offset
-                span.end += offset
-                yield span
-            offset += len(paragraph.text)
+        offset, deadline = 0, self._get_deadline()
+        try:
+            for paragraph in split_paragraphs(doc.text, remove_empty=False):
+                for span in self._extract_from_text(paragraph.text, deadline=deadline):
+                    span.start += offset
+                    span.end += offset
+                    yield span
+                offset += len(paragraph.text)
+        except TimeoutError as e:
+            LOGGER.warning(f"Document {doc.id} from {doc.source} exceeded repetitions time budget: {e}")
 
 
 @TaggerRegistry.add("tokenizer_repetitions_v1")
@@ -116,10 +132,15 @@ class TokenizerRepetitionsTagger(BaseRepetitionsTagger):
         sequences_iter = find_periodic_sequences(
             arr=np.array(tokens.ids), min_period=self.MIN_PERIOD, max_period=self.MAX_PERIOD
         )
-        for seq in sequences_iter:
+        yield from self._spans_from_sequences(tokens.offsets, sequences_iter)
+
+    def _spans_from_sequences(
+        self, offsets: List[Tuple[int, int]], sequences: Iterable[RepetitionTuple]
+    ) -> Generator[Span, None, None]:
+        for seq in sequences:
             out = Span(
-                start=tokens.offsets[seq.start][0],
-                end=tokens.offsets[seq.end - 1][1],
+                start=offsets[seq.start][0],
+                end=offsets[seq.end - 1][1],
                 type="repetition",
                 score=seq.times,
             )
@@ -133,11 +154,20 @@ class ParagraphTokenizerRepetitionsTagger(TokenizerRepetitionsTagger):
     for repetitions of tokens that span multiple paragraphs."""
 
     def _extract_from_doc(self, doc: Document) -> Generator[Span, None, None]:
+        paragraphs = split_paragraphs(doc.text, remove_empty=False)
+
+        # space is required to avoid first symbol in the paragraph to be
+        # tokenized as a different token.
+        all_tokens = self.tokenizer.encode_batch([" " + p.text for p in paragraphs], add_special_tokens=False)
+
+        # all paragraphs are searched for repetitions at once
+        all_sequences = find_periodic_sequences_batch(
+            [np.array(tokens.ids) for tokens in all_tokens], min_period=self.MIN_PERIOD, max_period=self.MAX_PERIOD
+        )
+
         offset = 0
-        for paragraph in split_paragraphs(doc.text, remove_empty=False):
-            # space is required to avoid first symbol in the paragraph to be
-            # tokenized as a different token.
-            for span in self._extract_from_text(" " + paragraph.text):
+        for paragraph, tokens, sequences in zip(paragraphs, all_tokens, all_sequences):
+            for span in self._spans_from_sequences(tokens.offsets, sequences):
                 span.start += offset - 1
                 span.end += offset - 1
                 yield span
@@ -1,4 +1,7 @@
-from typing import Generator, List, NamedTuple
+import sys
+import time
+from functools import lru_cache
+from typing import Generator, List, NamedTuple, Optional, Sequence
 
 import numpy as np
 
@@ -42,77 +45,242 @@ def find_periodic_sequences(
 ) -> Generator[RepetitionTuple, None, None]:
     """Function to find periodic sequences in an array.
 
-    This function sweeps through the array and checks for sequences of length
-    [min_period, max_period] that repeat at least 3 times. To do so, it
-    reshape the array into a matrix with `period` columns and checks if each
-    row is equal to the previous row. Blocks of repeating rows indicates repeating
-    sequences.
-
-    Because there's no guarantee that the sequences start at the beginning of each
-    row, it can only detect sequences that repeat at least 3 times. To account
-    for the fact that sequences may not start at the beginning of each row (or
-    end at the end of each row), we check the end of the previous row and the
-    start of the next row to determine the actual start and end positions of the
-    sequence.
+    This function finds sequences of length [min_period, max_period] that repeat at least 3 times. It
+    looks for runs of positions where `arr[i] == arr[i + period]`; for a run to be reported, it must contain a
+    whole block `arr[k * period : (k + 1) * period]` for some k, and the sequence must repeat at least 3 times.
+    These are the sequences found by reshaping the array into a matrix with `period` columns and looking for
+    rows equal to the previous row, but all periods are compared in one pass, without padding, reshaping, and
+    rolling a copy of the array for each period. See `find_periodic_sequences_batch` to process many arrays at
+    once.
 
     Args:
         arr (np.ndarray): The array to search for periodic sequences.
         max_period (int): The maximum period to check for.
         min_period (int, optional): The minimum period to check for. Defaults to 1.
-        mask_value (int, optional): The value to use to pad the array. Defaults to -1.
+        mask_value (int, optional): A value that does not occur in the array. Defaults to -1.
     """
-    # make sure the mask_value is not in the array
-    if (arr == mask_value).sum() > 0:
+    (sequences,) = find_periodic_sequences_batch(
+        [arr], max_period=max_period, min_period=min_period, mask_value=mask_value
+    )
+    yield from sequences
+
+
+def find_periodic_sequences_batch(
+    arrs: Sequence[np.ndarray], max_period: int, min_period: int = 1, mask_value: int = -1
+) -> List[List[RepetitionTuple]]:
+    """Same as `find_periodic_sequences`, but for many arrays at once; the arrays are concatenated (separated
+    by `mask_value`), so that all of them are compared in a single pass. Returns one list of sequences per array,
+    sorted by period and then by start position.
+    """
+    results: List[List[RepetitionTuple]] = [[] for _ in arrs]
+    if any((arr == mask_value).any() for arr in arrs):
         raise ValueError("`mask_value` is in the array")
 
-    # no since we can only detect sequences that repeat at least 3 times,
-    # there is no point in checking for periods greater than 1/3 of the length
-    max_period = min(max_period, len(arr) // 3)
+    # since we can only detect sequences that repeat at least 3 times, there is no point in checking for
+    # periods greater than 1/3 of the length
+    max_periods = np.array([min(max_period, len(arr) // 3) for arr in arrs], dtype=np.int64)
+    longest = int(max_periods.max(initial=0))
+    if longest < min_period:
+        return results
+
+    # separate arrays with enough mask values that no comparison crosses from one array to the next
+    separator = np.full(longest, mask_value, dtype=np.result_type(*arrs, np.array(mask_value)))
+    offsets = np.cumsum([0] + [len(arr) + longest for arr in arrs[:-1]])
+    flat = np.concatenate([part for arr in arrs for part in (arr, separator)])
+
+    # equal[j, i] is True if flat[i] == flat[i + periods[j]]; separators are never equal to anything
+    periods = np.arange(min_period, longest + 1)
+    length = len(flat) - longest
+    equal = np.empty((len(periods), length), dtype=bool)
+    for j, period in enumerate(periods):
+        np.equal(flat[:length], flat[period : period + length], out=equal[j])
+    equal &= flat[:length] != mask_value
+
+    # start (inclusive) and end (exclusive) of runs of equal positions, sorted by period and then position
+    transitions = np.diff(np.pad(equal.view(np.int8), ((0, 0), (1, 1))), axis=1)
+    period_idx, run_starts = np.nonzero(transitions == 1)
+    _, run_ends = np.nonzero(transitions == -1)
+
+    # move runs to the coordinates of the array they belong to
+    array_idx = np.searchsorted(offsets, run_starts, side="right") - 1
+    run_starts = run_starts - offsets[array_idx]
+    run_ends = run_ends - offsets[array_idx]
+    run_periods = periods[period_idx]
+
+    # a run must include a whole block aligned to the period, and cover at least 3 repetitions
+    first_block_start = -(-run_starts // run_periods) * run_periods
+    keep = (
+        (first_block_start + run_periods <= run_ends)
+        & (run_ends - run_starts >= 2 * run_periods)
+        & (run_periods <= max_periods[array_idx])
+    )
+
+    for i, start, end, period in zip(
+        array_idx[keep].tolist(), run_starts[keep].tolist(), run_ends[keep].tolist(), run_periods[keep].tolist()
+    ):
+        # the run is over the first element of each pair, so the sequence ends one period later
+        end += period
+        results[i].append(RepetitionTuple(start=start, end=end, period=period, times=(end - start) // period))
+
+    return results
+
+
+# below this length, units of repeated characters are checked directly; longer units are only checked
+# where the text has a matching k-gram at the right distance, with k the largest power of 2 <= unit length
+MIN_HASHED_UNIT_LENGTH = 8
+
+# odd multiplier for the polynomial hash of k-grams; arithmetic is modulo 2**64
+KGRAM_HASH_BASE = 0x9E3779B97F4A7C15
+
+
+@lru_cache(maxsize=1)
+def _whitespace_codepoints() -> np.ndarray:
+    """Code points matched by `\\s` in a `str` regular expression, that is, the ones for which isspace() is true."""
+    return np.array([c for c in range(sys.maxunicode + 1) if chr(c).isspace()], dtype=np.uint32)
+
+
+def _repetition_end(text: str, unit: str, pos: int, count: int) -> Optional[int]:
+    """End of the repetitions of unit that follow pos, matched as `(\\s?unit){3,}` would be by `re`, or None if
+    there is no match. `count` is the number of repetitions matched so far."""
+    if count >= 3:
+        # from here on, any path is accepted, so the regex engine never backtracks: it greedily repeats
+        # the unit, preferring to consume a whitespace character before it.
+        if not unit[0].isspace():
+            # no whitespace can precede a repetition in the middle of a run of units, so skip runs in blocks
+            block = unit * 64
+            while text.startswith(block, pos):
+                pos += len(block)
+        while True:
+            if pos < len(text) and text[pos].isspace() and text.startswith(unit, pos + 1):
+                pos += len(unit) + 1
+            elif text.startswith(unit, pos):
+                pos += len(unit)
+            else:
+                return pos
 
-    for period in range(min_period, max_period + 1):
-        # pad the array so that it can be reshaped into a matrix matching the period
-        padded_arr = np.pad(arr, (0, period - (len(arr) % period)), constant_values=mask_value)
-        shaped_arr = padded_arr.reshape(-1, period)
+    if pos < len(text) and text[pos].isspace() and text.startswith(unit, pos + 1):
+        end = _repetition_end(text, unit, pos + len(unit) + 1, count + 1)
+        if end is not None:
+            return end
+    if text.startswith(unit, pos):
+        return _repetition_end(text, unit, pos + len(unit), count + 1)
+    return None
 
-        # find rows that are equal to the previous  row; these are the possibly-periodic sequences
-        is_equal_to_prev_row = shaped_arr == np.roll(shaped_arr, shift=1, axis=0)
-        rows_with_period, *_ = np.where(is_equal_to_prev_row.all(axis=1))
 
-        # no sequences found with this period
-        if len(rows_with_period) == 0:
+def find_char_repetitions(text: str, deadline: Optional[float] = None) -> Generator[RepetitionTuple, None, None]:
+    """Find repetitions of characters in a text; the matches are the same as the ones of
+    `re.finditer(r"(.+?)(\\s?\\1){3,}", text)`, that is, a unit of characters without newlines followed by at least
+    3 repetitions, each optionally preceded by a whitespace character; for each match, the smallest unit wins.
+
+    Unlike the regular expression, which tries every unit length at every position, this function only tries
+    unit lengths for which the text repeats at the right distance. For short units, that is checked directly;
+    for a unit of length L >= MIN_HASHED_UNIT_LENGTH, a repetition must start with the same k-gram as the unit,
+    with k the largest power of 2 <= L. Positions of equal k-grams are found by sorting k-gram hashes, so only
+    a handful of lengths is verified at each position, and text with no repetitions is skipped in bulk.
+
+    Args:
+        text (str): The text to search for repetitions.
+        deadline (float, optional): A `time.monotonic()` value after which the search stops with a TimeoutError;
+            repetitions found before then have already been yielded.
+
+    Yields:
+        RepetitionTuple: start and end of each match, the length of its unit as period, and the number of
+            non-overlapping occurrences of the unit in the match as times.
+    """
+    n = len(text)
+    if n < 4:
+        return
+
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    is_space = np.isin(codes, _whitespace_codepoints())
+
+    # units cannot contain newlines, and need room for 3 more repetitions
+    positions = np.arange(n)
+    newline_positions = np.append(np.flatnonzero(codes == ord("\n")), n)
+    next_newline = newline_positions[np.searchsorted(newline_positions, positions)]
+    max_unit_length = np.minimum(next_newline - positions, (n - positions) // 4)
+    longest_unit = int(max_unit_length.max())
+
+    # positions where a unit of length < MIN_HASHED_UNIT_LENGTH is immediately repeated
+    maybe = np.zeros(n, dtype=bool)
+    for length in range(1, min(MIN_HASHED_UNIT_LENGTH - 1, longest_unit) + 1):
+        equal = codes[: n - length] == codes[length:]
+        maybe[: n - 2 * length + 1] |= np.logical_and.reduce(
+            [equal[o : o + n - 2 * length + 1] for o in range(length)]
+        )
+        equal_after_one = codes[: n - length - 1] == codes[length + 1 :]
+        maybe[: n - 2 * length] |= is_space[length : n - length] & np.logical_and.reduce(
+            [equal_after_one[o : o + n - 2 * length] for o in range(length)]
+        )
+
+    # for each power of 2 k >= MIN_HASHED_UNIT_LENGTH, the next position that starts with the same k-gram
+    next_same_kgram = {}
+    hashes = codes.astype(np.uint64) + np.uint64(1)
+    repeated = np.ones(n, dtype=bool)
+    k, base = 1, KGRAM_HASH_BASE
+    while 2 * k <= longest_unit:
+        # hash of a 2k-gram from the hashes of its two halves
+        hashes = hashes[: n - 2 * k + 1] * np.uint64(base) + hashes[k : n - k + 1]
+        base = (base * base) % 2**64
+        k *= 2
+        if k < MIN_HASHED_UNIT_LENGTH:
             continue
 
-        # this finds the start and end positions of the sequences with period `period`
-        where_true_consecutive = group_consecutive_values(rows_with_period)
-
-        for sequence in where_true_consecutive:
-            start_row = sequence[0]
-            end_row = sequence[-1]
-
-            # we check if any value at the end of the previous row is True, e.g.:
-            #     [[False, False, True, True]
-            #      [True, True, True, True]]
-            # (in the case above, start offset is 2). If so, we subtract that from the
-            # period to get the actual start offset.
-            start_offset = find_start_last_consecutive_true(is_equal_to_prev_row[start_row - 1])
-            start_offset = period - start_offset if start_offset > 0 else 0
-
-            # same idea as above, we want to compute offset. Only difference is that
-            # `find_end_first_consecutive_true` already returns the offset, so we don't
-            # need to subtract from the period.
-            end_offset = find_end_first_consecutive_true(is_equal_to_prev_row[end_row + 1])
-
-            # because we are always comparing with preceding row in
-            # `is_equal_to_prev_row`, we need to subtract 1 from the row number
-            start_pos = (start_row - 1) * period - start_offset
-
-            # note that the end position is exclusive
-            end_pos = ((end_row + 1) * period) + end_offset
-
-            out = RepetitionTuple(
-                start=start_pos, end=end_pos, period=period, times=(end_pos - start_pos) // period
-            )
-            if out.times > 2:
-                # cannot accurately determine the period of a sequence that repeats
-                # less than 3 times with this algorithm
-                yield out
+        # only k-grams without newlines can be part of a unit, and a k-gram can only occur more than once
+        # if its first half does too; in most text, few k-grams are left after a couple of doublings.
+        valid = np.flatnonzero((next_newline[: n - k + 1] >= positions[: n - k + 1] + k) & repeated[: n - k + 1])
+        if len(valid) == 0:
+            break
+        order = valid[np.argsort(hashes[valid], kind="stable")]
+        same_as_next = hashes[order[1:]] == hashes[order[:-1]]
+        next_same = np.full(n, n, dtype=np.int32 if n < 2**31 else np.int64)
+        next_same[order[:-1][same_as_next]] = order[1:][same_as_next]
+        next_same_kgram[k] = next_same
+
+        repeated = np.zeros(n, dtype=bool)
+        repeated[order[:-1][same_as_next]] = True
+        repeated[order[1:][same_as_next]] = True
+
+        # a repetition of a unit of length in [k, 2k) starts at most 2k characters after the unit
+        maybe |= (next_same < n) & (next_same <= positions + 2 * k) & (max_unit_length >= k)
+
+    candidates = np.flatnonzero(maybe & (max_unit_length >= 1))
+    pos = 0
+    for checked, start in enumerate(candidates.tolist()):
+        if start < pos:
+            continue
+        if deadline is not None and checked % 256 == 0 and time.monotonic() > deadline:
+            raise TimeoutError(f"Repetition search stopped at character {start} of {n}")
+
+        end = unit_length = None
+        max_length = int(max_unit_length[start])
+
+        # shortest unit first, like the lazy `.+?` of the regex
+        for length in range(1, min(MIN_HASHED_UNIT_LENGTH - 1, max_length) + 1):
+            unit = text[start : start + length]
+            if (end := _repetition_end(text, unit, start + length, 0)) is not None:
+                unit_length = length
+                break
+
+        k = MIN_HASHED_UNIT_LENGTH
+        while end is None and k <= max_length and k in next_same_kgram:
+            next_same, tried = next_same_kgram[k], 0
+            other = int(next_same[start])
+            while other <= start + 2 * k and end is None:
+                # the repetition either starts right after the unit, or after a whitespace character
+                lengths = (other - start - 1, other - start) if is_space[other - 1] else (other - start,)
+                for length in lengths:
+                    if length <= tried or length < k or length >= 2 * k or length > max_length:
+                        continue
+                    tried = length
+                    unit = text[start : start + length]
+                    if (end := _repetition_end(text, unit, start + length, 0)) is not None:
+                        unit_length = length
+                        break
+                other = int(next_same[other])
+            k *= 2
+
+        if end is not None and unit_length is not None:
+            unit = text[start : start + unit_length]
+            yield RepetitionTuple(start=start, end=end, period=unit_length, times=text[start:end].count(unit))
+            pos = end
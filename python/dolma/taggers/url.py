@@ -1,14 +1,18 @@
 import json
+import os
 import re
 import socket
-from typing import Generator, List, Set
+from hashlib import sha256
+from typing import Generator, List, Optional
 
 import smart_open
 import urllib3.util
+from cached_path import cached_path as download_cached_path
 
+from dolma.core.blocklist_index import BlocklistIndex
 from dolma.core.data_types import DocResult, DocumentWithMetadata, Span
 from dolma.core.loggers import get_logger
-from dolma.core.paths import cached_path
+from dolma.core.paths import get_cache_dir, is_local, join_path, split_path
 from dolma.core.registry import TaggerRegistry
 from dolma.core.taggers import BaseTaggerWithMetadata
 from dolma.core.url_blocker import UrlBlocker
@@ -65,22 +69,62 @@ class BaseUrlTagger(BaseTaggerWithMetadata):
     ADP_FORMAT_REGEX = re.compile(f"\\|+{URL_REGEX.pattern}\\^")
     MAYBE_IP_AND_URL_REGEX = re.compile(f"{MAYBE_IP_REGEX.pattern}\\s+{URL_REGEX.pattern}")
 
+    # blocklists are compiled into an index that is shared by all processes on the machine; by default, it is
+    # stored in the dolma cache directory. Bump the version if parsing changes in a way that affects entries.
+    BLOCKLIST_INDEX_DIR: Optional[str] = None
+    BLOCKLIST_INDEX_VERSION = "1"
+
     def __init__(self) -> None:
-        self.blocklist: Set[str] = set()
+        index_path = self.blocklist_index_path()
+        if os.path.exists(index_path):
+            self.blocklist = BlocklistIndex.load(index_path)
+        else:
+            # only the first process to run the tagger pays for parsing the blocklists
+            LOGGER.info(f"Building blocklist index for {self.__class__.__name__} tagger at {index_path}")
+            self.blocklist = BlocklistIndex.build(self.iter_blocklist(), index_path)
 
-        # doing the loading here
+        assert len(self.blocklist) > 0, f"Blocklist is empty for {self.__class__.__name__} tagger"
+
+    @classmethod
+    def blocklist_index_path(cls) -> str:
+        """Location of the compiled index; it depends on the tagger and on the version of its blocklists (ETag
+        of remote blocklists, size and modification time of local ones), so that a change to either builds a
+        new index."""
+        key = [f"{cls.__module__}.{cls.__qualname__}", cls.BLOCKLIST_INDEX_VERSION]
+        for blocklist_path in cls.BLOCKLIST_PATHS:
+            key.append(blocklist_path)
+            local_path = cls.fetch_blocklist(blocklist_path)
+            stat = os.stat(local_path)
+            if is_local(blocklist_path):
+                key.append(f"{stat.st_size}:{stat.st_mtime_ns}")
+            else:
+                # the name of a download is a hash of the URL and of the ETag of the remote file
+                key.append(f"{os.path.basename(local_path)}:{stat.st_size}")
+
+        index_dir = cls.BLOCKLIST_INDEX_DIR or f"{get_cache_dir()}/blocklist_index"
+        index_name = sha256("\n".join(key).encode("utf-8")).hexdigest()
+        return f"{index_dir}/{index_name}.npy"
+
+    @staticmethod
+    def fetch_blocklist(blocklist_path: str) -> str:
+        """Local path of a blocklist. Remote blocklists are downloaded once per ETag, so a blocklist that
+        changed upstream is downloaded again instead of being read from a stale copy."""
+        if is_local(blocklist_path):
+            # local paths may have a file:// prefix, which os.stat does not understand
+            return join_path("", split_path(blocklist_path)[1])
+        return str(download_cached_path(blocklist_path, quiet=True))
+
+    def iter_blocklist(self) -> Generator[str, None, None]:
+        """Parse all blocklists, yielding their entries."""
         for blocklist_path in self.BLOCKLIST_PATHS:
-            with smart_open.open(cached_path(blocklist_path)) as blocklist_file:
+            with smart_open.open(self.fetch_blocklist(blocklist_path)) as blocklist_file:
                 for i, ln in enumerate(blocklist_file):
                     try:
-                        for url in self.parse_line(ln):
-                            self.blocklist.add(url)
+                        yield from self.parse_line(ln)
                     except UrlNotParsedError:
                         message = f"Invalid line {i} in {blocklist_path}: '{ln}'"
                         LOGGER.info(message)
 
-        assert len(self.blocklist) > 0, f"Blocklist is empty for {self.__class__.__name__} tagger"
-
     def parse_line(self, ln: str) -> Generator[str, None, None]:
         if not (ln := ln.strip().lower()) or ln.startswith("#") or ln.startswith(";") or ln.startswith("!"):
             # either empty or a comment
@@ -172,9 +216,15 @@ class DomainBlocklistPhishingTagger(BaseDomainTagger):
 
 
 class AdbUrlTagger(BaseUrlTagger):
+    # compiled engines are shared by all processes on the machine, like blocklist indices
+    ENGINE_CACHE_DIR: Optional[str] = None
+
     def __init__(self) -> None:
         # from dolma import UrlBlocker
-        self.engine = UrlBlocker.from_adb_paths(*[cached_path(p) for p in self.BLOCKLIST_PATHS])
+        self.engine = UrlBlocker.from_adb_paths(
+            *[self.fetch_blocklist(p) for p in self.BLOCKLIST_PATHS],
+            cache_dir=self.ENGINE_CACHE_DIR or f"{get_cache_dir()}/url_blocker",
+        )
 
     def check_url(self, url: str) -> bool:
         return self.engine.check_network_urls(url)
@@ -415,10 +465,7 @@ class AllowlistWikidataTagger(BaseDomainTagger):
                 pass
 
     def check_url(self, url: str) -> bool:
-        for cleaned_url in self.clean_url(url):
-            if cleaned_url in self.blocklist:
-                return True
-        return False
+        return self.blocklist.contains_any(self.clean_url(url))
 
 
 @TaggerRegistry.add("allowlist_wikidata_cleaned_v1")
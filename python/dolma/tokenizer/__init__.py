@@ -1,10 +1,14 @@
+from .cache import TokenCache
 from .data_types import TokenizerOutput
 from .executor import tokenize_in_parallel
+from .reader import TokenizedDataset
 from .tokenizer import Tokenizer, tokenize_file
 
 __all__ = [
     "Tokenizer",
     "tokenize_file",
+    "TokenCache",
     "tokenize_in_parallel",
+    "TokenizedDataset",
     "TokenizerOutput",
 ]
@@ -0,0 +1,283 @@
+import hashlib
+import os
+import re
+import uuid
+from io import BytesIO
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+import smart_open
+
+from ..core.loggers import get_logger
+from ..core.paths import cached_path, exists, glob_path, is_local, join_path, mkdir_p
+
+if TYPE_CHECKING:
+    from .tokenizer import Tokenizer
+
+__all__ = ["TokenCache"]
+
+log = get_logger(__name__)
+
+CacheKey = Tuple[int, int]
+
+
+class _ShardIndex(NamedTuple):
+    """Sorted index of all entries in a shard of the cache."""
+
+    hi: np.ndarray
+    lo: np.ndarray
+    segment: np.ndarray
+    offsets: np.ndarray
+
+    @classmethod
+    def empty(cls) -> "_ShardIndex":
+        return cls(
+            hi=np.empty(0, dtype=np.uint64),
+            lo=np.empty(0, dtype=np.uint64),
+            segment=np.empty(0, dtype=np.int32),
+            offsets=np.empty((0, 2), dtype=np.int64),
+        )
+
+    def find(self, key: CacheKey) -> int:
+        """Return the position of the entry for key, or -1 if the key is not in the index."""
+        # values must be cast to uint64; otherwise, numpy compares them as (imprecise) floats
+        hi = np.uint64(key[0])
+        left = int(np.searchsorted(self.hi, hi, side="left"))
+        right = int(np.searchsorted(self.hi, hi, side="right"))
+        for i in range(left, right):
+            if int(self.lo[i]) == key[1]:
+                return i
+        return -1
+
+
+class TokenCache:
+    """Content-addressed cache of tokenized documents.
+
+    Entries are keyed on a 128-bit hash of the text of a document; the cache directory is further namespaced by
+    the fingerprint of the tokenizer, so caches for different tokenizers (or tokenizer settings) never mix.
+    New entries are buffered in memory and written in immutable segments: a raw token file that can be memory
+    mapped, and a `.idx.npz` index with the key and offsets of each entry. Segments are spread over shards
+    based on the key, so a lookup only needs to load the index of one shard.
+
+    The cache can be local or on S3; remote segments are downloaded to the local cache directory when first
+    needed. For local caches, `max_size` bounds the total size of the cache in bytes: once exceeded, least
+    recently used segments are evicted. Remote caches are never evicted; use bucket lifecycle rules instead.
+    """
+
+    TOKENS_EXTENSION = ".npy"
+    INDEX_EXTENSION = ".idx.npz"
+    DEFAULT_NUM_SHARDS = 16
+    DEFAULT_FLUSH_EVERY = 16 * 1024 * 1024  # tokens buffered in memory before writing segments
+
+    def __init__(
+        self,
+        path: str,
+        fingerprint: str,
+        dtype: Union[str, np.dtype],
+        max_size: Optional[int] = None,
+        num_shards: Optional[int] = None,
+        flush_every: Optional[int] = None,
+    ):
+        """Open a token cache.
+
+        Args:
+            path (str): Location of the cache; can be local or on S3.
+            fingerprint (str): Fingerprint of the tokenizer the cache is for.
+            dtype (Union[str, np.dtype]): Data type to store tokens with.
+            max_size (Optional[int], optional): Maximum size of a local cache in bytes. Defaults to None,
+                which means no limit.
+            num_shards (Optional[int], optional): Number of shards to spread entries over. Defaults to 16.
+            flush_every (Optional[int], optional): Number of new tokens to buffer before writing them to
+                the cache. Defaults to 16M tokens.
+        """
+        self.root = join_path(None, path, fingerprint)
+        self.fingerprint = fingerprint
+        self.dtype = np.dtype(dtype)
+        self.max_size = max_size
+        self.num_shards = num_shards or self.DEFAULT_NUM_SHARDS
+        self.flush_every = flush_every or self.DEFAULT_FLUSH_EVERY
+
+        self.hits = self.misses = 0
+
+        self._shards: Dict[int, _ShardIndex] = {}
+        self._segment_paths: List[str] = []
+        self._segment_ids: Dict[str, int] = {}
+        self._segments: Dict[int, np.memmap] = {}
+        self._pending: Dict[CacheKey, np.ndarray] = {}
+        self._pending_tokens = 0
+
+    @classmethod
+    def from_tokenizer(cls, path: str, tokenizer: "Tokenizer", **kwargs) -> "TokenCache":
+        return cls(path=path, fingerprint=tokenizer.fingerprint, dtype=tokenizer.dtype, **kwargs)
+
+    @staticmethod
+    def key(text: str) -> CacheKey:
+        hi, lo = np.frombuffer(hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest(), dtype="<u8")
+        return int(hi), int(lo)
+
+    def _shard_path(self, shard: int) -> str:
+        return join_path(None, self.root, f"{shard:02x}")
+
+    def _segment_id(self, index_path: str) -> int:
+        segment_path = re.sub(rf"{re.escape(self.INDEX_EXTENSION)}$", self.TOKENS_EXTENSION, index_path)
+        if (segment_id := self._segment_ids.get(segment_path)) is None:
+            segment_id = self._segment_ids[segment_path] = len(self._segment_paths)
+            self._segment_paths.append(segment_path)
+        return segment_id
+
+    def _load_shard(self, shard: int) -> _ShardIndex:
+        if (index := self._shards.get(shard)) is not None:
+            return index
+
+        hi, lo, segment, offsets = [], [], [], []
+        if exists(shard_path := self._shard_path(shard)):
+            for index_path in glob_path(shard_path, yield_dirs=False):
+                if not index_path.endswith(self.INDEX_EXTENSION):
+                    continue
+                try:
+                    with np.load(cached_path(index_path)) as data:
+                        hi.append(data["hi"])
+                        lo.append(data["lo"])
+                        offsets.append(data["offsets"])
+                except FileNotFoundError:
+                    # segment was evicted by another process while we were listing the shard
+                    continue
+                segment.append(np.full(len(hi[-1]), self._segment_id(index_path), dtype=np.int32))
+
+        if hi:
+            order = np.lexsort((np.concatenate(lo), np.concatenate(hi)))
+            index = _ShardIndex(
+                hi=np.concatenate(hi)[order],
+                lo=np.concatenate(lo)[order],
+                segment=np.concatenate(segment)[order],
+                offsets=np.concatenate(offsets)[order],
+            )
+        else:
+            index = _ShardIndex.empty()
+
+        self._shards[shard] = index
+        return index
+
+    def _open_segment(self, segment: int) -> np.memmap:
+        if (memmap := self._segments.get(segment)) is None:
+            path = self._segment_paths[segment]
+            memmap = self._segments[segment] = np.memmap(cached_path(path), dtype=self.dtype, mode="r")
+            if is_local(path):
+                # segments are evicted based on modification time, so we refresh it when a segment is used
+                os.utime(path)
+        return memmap
+
+    def get(self, key: CacheKey) -> Optional[np.ndarray]:
+        """Return the tokens for key, or None if the key is not in the cache."""
+        if (tokens := self._pending.get(key)) is None:
+            index = self._load_shard(key[0] % self.num_shards)
+            if (pos := index.find(key)) >= 0:
+                start, end = index.offsets[pos]
+                try:
+                    tokens = np.array(self._open_segment(int(index.segment[pos]))[start:end])
+                except FileNotFoundError:
+                    tokens = None
+
+        if tokens is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return tokens
+
+    def put(self, key: CacheKey, tokens: Sequence[int]):
+        """Add tokens for key to the cache; entries are written to the cache when `flush` is called, or
+        automatically once enough tokens have been buffered."""
+        if key in self._pending:
+            return
+
+        self._pending[key] = np.asarray(tokens, dtype=self.dtype)
+        self._pending_tokens += len(tokens)
+        if self._pending_tokens >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered entries to the cache, one new segment per shard."""
+        if not self._pending:
+            return
+
+        by_shard: Dict[int, List[CacheKey]] = {}
+        for key in self._pending:
+            by_shard.setdefault(key[0] % self.num_shards, []).append(key)
+
+        segment_id = uuid.uuid4().hex
+        for shard, keys in by_shard.items():
+            tokens = [self._pending[key] for key in keys]
+            offsets = np.zeros((len(keys), 2), dtype=np.int64)
+            offsets[:, 1] = np.cumsum([len(t) for t in tokens])
+            offsets[1:, 0] = offsets[:-1, 1]
+
+            segment_path = join_path(None, self._shard_path(shard), f"{segment_id}{self.TOKENS_EXTENSION}")
+            index_path = join_path(None, self._shard_path(shard), f"{segment_id}{self.INDEX_EXTENSION}")
+
+            keys_array = np.array(keys, dtype=np.uint64)
+            buffer = BytesIO()
+            np.savez(buffer, hi=keys_array[:, 0], lo=keys_array[:, 1], offsets=offsets)
+
+            mkdir_p(self._shard_path(shard))
+
+            # tokens are written before the index, so readers never see an incomplete segment
+            with smart_open.open(segment_path, "wb") as f:
+                f.write(np.concatenate(tokens).tobytes())
+            with smart_open.open(index_path, "wb") as f:
+                f.write(buffer.getvalue())
+
+            # next lookup in this shard will reload the index, including the new segment
+            self._shards.pop(shard, None)
+
+        self._pending = {}
+        self._pending_tokens = 0
+
+        if self.max_size is not None:
+            self.evict()
+
+    def evict(self):
+        """Remove least recently used segments until the cache is smaller than `max_size`."""
+        if self.max_size is None:
+            return
+        if not is_local(self.root):
+            log.warning("Eviction is not supported for remote token caches (%s); skipping.", self.root)
+            return
+
+        segments = []
+        for shard in range(self.num_shards):
+            if not os.path.exists(shard_path := self._shard_path(shard)):
+                continue
+            for entry in os.scandir(shard_path):
+                if entry.name.endswith(self.INDEX_EXTENSION):
+                    tokens_path = entry.path[: -len(self.INDEX_EXTENSION)] + self.TOKENS_EXTENSION
+                    try:
+                        tokens_stat = os.stat(tokens_path)
+                    except FileNotFoundError:
+                        continue
+                    segments.append(
+                        (tokens_stat.st_mtime, entry.path, tokens_path, tokens_stat.st_size + entry.stat().st_size)
+                    )
+
+        total_size = sum(size for *_, size in segments)
+        for _, index_path, tokens_path, size in sorted(segments):
+            if total_size <= self.max_size:
+                break
+            # remove the index first so other processes stop picking up the segment
+            for path in (index_path, tokens_path):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total_size -= size
+
+        # evicted segments might be in loaded indices
+        self._shards = {}
@@ -1,22 +1,34 @@
 import hashlib
 import multiprocessing
 import os
+import pickle
 import random
 import tempfile
 from contextlib import ExitStack
 from math import ceil, log10
 from queue import Queue  # pylint: disable=unused-import
-from typing import Any, Dict, Generator, List, Optional
+from typing import Any, Dict, Generator, List, NamedTuple, Optional
 
 import numpy as np
+import smart_open
 from typing_extensions import TypeAlias
 
 from ..core.loggers import get_logger
 from ..core.parallel import BaseParallelProcessor, QueueType
-from ..core.paths import get_size, glob_path, join_path, mkdir_p
+from ..core.paths import (
+    delete_file,
+    exists,
+    get_size,
+    glob_path,
+    is_local,
+    join_path,
+    mkdir_p,
+)
+from .cache import TokenCache
 from .data_types import TokenizerOutput  # pylint: disable=unused-import
 from .memmap_writer import MemmapWriter
-from .tokenizer import Tokenizer, tokenize_file
+from .packing import SequencePacker
+from .tokenizer import Tokenizer, make_tokenizer, tokenize_file
 
 TokenizedSeqsQueueType: TypeAlias = "Queue[List[TokenizerOutput]]"
 PathsQueueType: TypeAlias = "Queue[str]"
@@ -26,6 +38,22 @@ def sizes_to_probs(sizes: List[int]) -> np.ndarray:
     return np.array(sizes) / sum(sizes)
 
 
+class WriterCheckpoint(NamedTuple):
+    """State of a writer right after a memmap file is completed; it is enough to resume writing
+    from the next memmap file and get the same output as an uninterrupted run."""
+
+    fingerprint: str
+    memmap_index: int
+    source_paths: List[str]
+    ring_paths: List[str]
+    ring_locs: List[int]
+    ring_sizes: List[int]
+    random_state: Any
+    numpy_random_state: Dict[str, Any]
+    packer: Optional[SequencePacker]
+    pending: list
+
+
 class MemMapParallelWriter(BaseParallelProcessor):
     @classmethod
     def increment_progressbar(  # type: ignore[override]    # pylint: disable=arguments-differ
@@ -41,6 +69,32 @@ class MemMapParallelWriter(BaseParallelProcessor):
             queue, files=files, documents=documents, tokens=tokens, memmaps=memmaps
         )
 
+    @classmethod
+    def _save_checkpoint(cls, path: str, checkpoint: WriterCheckpoint):
+        data = pickle.dumps(checkpoint)
+        if is_local(path):
+            # write to a temporary file first, so that a crash while saving does not corrupt the checkpoint
+            with open(tmp_path := f"{path}.tmp", "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        else:
+            with smart_open.open(path, "wb") as f:
+                f.write(data)
+
+    @classmethod
+    def _load_checkpoint(cls, path: str, fingerprint: str) -> Optional[WriterCheckpoint]:
+        if not exists(path):
+            return None
+
+        with smart_open.open(path, "rb") as f:
+            checkpoint: WriterCheckpoint = pickle.load(f)
+
+        if checkpoint.fingerprint != fingerprint:
+            get_logger(__name__).warning("Checkpoint %s was saved with different settings; ignoring it.", path)
+            return None
+
+        return checkpoint
+
     @classmethod
     def process_single(cls, source_path: str, destination_path: str, queue: QueueType, **kwargs: Any):
         os.environ["TOKENIZERS_PARALLELISM"] = "false"
@@ -89,6 +143,65 @@ class MemMapParallelWriter(BaseParallelProcessor):
         # whether to split the special tokens into separate tokens, e.g. <s> -> < s >
         tokenizer_kwargs["encode_special_tokens"] = kwargs.pop("encode_special_tokens", None) or False
 
+        # if a sequence length is provided, documents are packed into instances of exactly seq_len tokens
+        seq_len: Optional[int] = kwargs.pop("seq_len", None)
+        packing_algorithm: str = kwargs.pop("packing_algorithm", None) or "best_fit"
+        packing_max_open_bins: Optional[int] = kwargs.pop("packing_max_open_bins", None)
+
+        packer: Optional[SequencePacker] = None
+        if seq_len:
+            if tokenizer_kwargs["pad_token_id"] is None:
+                raise ValueError("pad_token_id or eos_token_id must be provided to pack sequences.")
+            packer = SequencePacker(
+                seq_len=seq_len, algorithm=packing_algorithm, max_open_bins=packing_max_open_bins
+            )
+
+        def write_fn(writer: MemmapWriter, items: list, flush: bool = False) -> list:
+            if packer is None:
+                return writer.write_many(outputs=items, flush=flush)
+            return writer.write_many_instances(
+                instances=items, length=packer.seq_len, pad_token_id=tokenizer_kwargs["pad_token_id"], flush=flush
+            )
+
+        # optionally, tokens are looked up in (and added to) a cache keyed on the text of each document
+        token_cache_path: Optional[str] = kwargs.pop("token_cache_path", None)
+        token_cache_max_size: Optional[int] = kwargs.pop("token_cache_max_size", None)
+        token_cache: Optional[TokenCache] = None
+        if token_cache_path:
+            token_cache = TokenCache.from_tokenizer(
+                path=token_cache_path,
+                tokenizer=make_tokenizer(tokenizer_name_or_path, **tokenizer_kwargs),
+                max_size=token_cache_max_size,
+            )
+
+        # random number generators are seeded per group of files, so that the same seed gives the same output
+        seed: int = kwargs.pop("seed", None) or 0
+        rng = random.Random(f"{seed}-{source_path}")
+        np_rng = np.random.default_rng([seed, int(source_path)])
+
+        # if provided, we save a checkpoint every time a memmap file is completed; this is used to resume
+        checkpoint_paths: Optional[List[str]] = kwargs.pop("checkpoint_paths", None)
+        checkpoint_path = checkpoint_paths[int(source_path)] if checkpoint_paths else None
+        fingerprint = hashlib.sha256(
+            repr(
+                (
+                    source_paths,
+                    destination_path,
+                    tokenizer_name_or_path,
+                    sorted(tokenizer_kwargs.items()),
+                    str(dtype),
+                    max_size,
+                    local_shuffle,
+                    ring_size,
+                    sample_ring_prop,
+                    seed,
+                    seq_len,
+                    packing_algorithm,
+                    packing_max_open_bins,
+                )
+            ).encode("utf-8")
+        ).hexdigest()
+
         # this is useful for making sure the queue does not grows too much
         cpu_count = multiprocessing.cpu_count()
 
@@ -97,19 +210,46 @@ class MemMapParallelWriter(BaseParallelProcessor):
         update_interval = 1
         mm_cnt = 0
 
-        tokenizer_ring: List[Generator[TokenizerOutput, None, None]] = []
+        # for each file in the ring, we keep track of its path and location of last document read from it
+        ring_paths: List[str] = []
+        ring_locs: List[int] = []
         tokenizer_sizes: List[int] = []
-        for _ in range(min(ring_size, len(source_paths))):
-            path = source_paths.pop()
-            tokenizer_ring.append(
-                tokenize_file(
-                    tokenizer_name_or_path=tokenizer_name_or_path,
-                    path=path,
-                    refresh_tokenizer_every=refresh_tokenizer,
-                    **tokenizer_kwargs,
-                )
+
+        # sequences that did not fit in the last memmap before a checkpoint was saved
+        pending: list = []
+
+        if checkpoint_path and (checkpoint := cls._load_checkpoint(checkpoint_path, fingerprint)):
+            logger.info("Resuming from %s at memmap %d", checkpoint_path, checkpoint.memmap_index)
+            mm_cnt = checkpoint.memmap_index
+            source_paths = checkpoint.source_paths
+            ring_paths, ring_locs, tokenizer_sizes = (
+                checkpoint.ring_paths,
+                checkpoint.ring_locs,
+                checkpoint.ring_sizes,
             )
-            tokenizer_sizes.append(get_size(path))
+            rng.setstate(checkpoint.random_state)
+            np_rng.bit_generator.state = checkpoint.numpy_random_state
+            packer = checkpoint.packer
+            pending = checkpoint.pending
+        else:
+            source_paths = list(source_paths)
+            for _ in range(min(ring_size, len(source_paths))):
+                path = source_paths.pop()
+                ring_paths.append(path)
+                ring_locs.append(0)
+                tokenizer_sizes.append(get_size(path))
+
+        tokenizer_ring: List[Generator[TokenizerOutput, None, None]] = [
+            tokenize_file(
+                tokenizer_name_or_path=tokenizer_name_or_path,
+                path=path,
+                refresh_tokenizer_every=refresh_tokenizer,
+                skip_lines=loc,
+                cache=token_cache,
+                **tokenizer_kwargs,
+            )
+            for path, loc in zip(ring_paths, ring_locs)
+        ]
 
         # this is the probabilities with which we sample from the ring buffer if sample_ring_prop is True
         tokenizer_probs = sizes_to_probs(tokenizer_sizes)
@@ -122,11 +262,14 @@ class MemMapParallelWriter(BaseParallelProcessor):
             )
             cls.increment_progressbar(queue, memmaps=1)
 
+            if pending:
+                write_fn(memwriter, pending, flush=True)
+
             while len(source_paths) > 0 or len(tokenizer_ring) > 0:
                 for i in range(local_shuffle):
                     if sample_ring_prop:
                         # you are sampling proportionally to the size of files in the ring
-                        j = np.random.choice(len(tokenizer_ring), p=tokenizer_probs)
+                        j = np_rng.choice(len(tokenizer_ring), p=tokenizer_probs)
                     else:
                         # you are going round robin
                         j = i % len(tokenizer_ring)
@@ -134,6 +277,7 @@ class MemMapParallelWriter(BaseParallelProcessor):
                     try:
                         # trying to read the next sequence of tokens (might fail if end of file)
                         content = next(tokenizer_ring[j])
+                        ring_locs[j] = content.loc
 
                         # added to the accumulator, we will shuffle this later
                         accumulator.append(content)
@@ -146,6 +290,8 @@ class MemMapParallelWriter(BaseParallelProcessor):
                         cls.increment_progressbar(queue, files=1)
                         tokenizer_ring.pop(j)
                         tokenizer_sizes.pop(j)
+                        ring_paths.pop(j)
+                        ring_locs.pop(j)
 
                         if len(tokenizer_ring) == 0:
                             # break if no more files to tokenize
@@ -157,10 +303,13 @@ class MemMapParallelWriter(BaseParallelProcessor):
                                     tokenizer_name_or_path=tokenizer_name_or_path,
                                     path=path,
                                     refresh_tokenizer_every=refresh_tokenizer,
+                                    cache=token_cache,
                                     **tokenizer_kwargs,
                                 )
                             )
                             tokenizer_sizes.append(get_size(path))
+                            ring_paths.append(path)
+                            ring_locs.append(0)
 
                         # wether a file is added or not to the ring, we must re-balance probabilities
                         tokenizer_probs = sizes_to_probs(tokenizer_sizes)
@@ -175,15 +324,40 @@ class MemMapParallelWriter(BaseParallelProcessor):
                             update_interval *= 2
 
                 # shuffle sequence order to ensure that the sequences are well mixed
-                random.shuffle(accumulator)
+                rng.shuffle(accumulator)
+
+                # when packing, we write instances made of one or more documents rather than documents
+                to_write = accumulator if packer is None else packer.add_many(accumulator)
+                if packer is not None and len(source_paths) == 0 and len(tokenizer_ring) == 0:
+                    # no more documents to read, so we emit all instances that are still open
+                    to_write.extend(packer.flush())
 
                 # try to write all the sequences, collect the ones that don't fit in remaining
-                remaining = memwriter.write_many(outputs=accumulator, flush=documents_cnt == 0)
+                remaining = write_fn(memwriter, to_write, flush=documents_cnt == 0)
 
                 if remaining:
                     # if we have remaining sequences, we need to close the current memwriter and open a new one
                     mm_cnt += 1
                     stack.pop_all().close()
+
+                    if checkpoint_path:
+                        # the memmap we just closed is complete, so we can resume from the next one
+                        cls._save_checkpoint(
+                            checkpoint_path,
+                            WriterCheckpoint(
+                                fingerprint=fingerprint,
+                                memmap_index=mm_cnt,
+                                source_paths=source_paths,
+                                ring_paths=ring_paths,
+                                ring_locs=ring_locs,
+                                ring_sizes=tokenizer_sizes,
+                                random_state=rng.getstate(),
+                                numpy_random_state=np_rng.bit_generator.state,
+                                packer=packer,
+                                pending=remaining,
+                            ),
+                        )
+
                     memwriter = stack.enter_context(
                         MemmapWriter(
                             path=destination_path + f"-{mm_cnt:05d}",
@@ -194,20 +368,29 @@ class MemMapParallelWriter(BaseParallelProcessor):
                     cls.increment_progressbar(queue, memmaps=1)
 
                     # finally, write the remaining sequences
-                    memwriter.write_many(outputs=remaining, flush=True)
+                    write_fn(memwriter, remaining, flush=True)
 
                 accumulator = []
 
                 memwriter.flush()
 
+        if token_cache is not None:
+            token_cache.flush()
+            logger.info("Token cache: %d hits, %d misses", token_cache.hits, token_cache.misses)
+
+        if checkpoint_path:
+            # all files in this group are done; the processor will mark the group as completed
+            delete_file(checkpoint_path, ignore_missing=True)
+
         cls.increment_progressbar(queue, documents=documents_cnt, tokens=tokens_cnt)
 
     def __call__(self, num_readers: Optional[int] = None, **process_single_kwargs: Any):
         """Run the processor."""
 
-        # get all source paths; shuffle them well
-        all_source_paths = [p for source in self.src_prefixes for p in glob_path(source)]
-        random.shuffle(all_source_paths)
+        # get all source paths; shuffle them well. Paths are sorted before shuffling with the processor seed,
+        # so that the same seed always results in the same groups of files.
+        all_source_paths = sorted(p for source in self.src_prefixes for p in glob_path(source))
+        random.Random(self.seed).shuffle(all_source_paths)
 
         # TRICKY BIT: Group source paths into buckets
         # First, check what the step size should be. The step is the minimum between the
@@ -267,19 +450,51 @@ class MemMapParallelWriter(BaseParallelProcessor):
         mkdir_p(metadata)
         all_metadata_path = [join_path(None, metadata, f"{i}.done") for i in range(len(all_destination_paths))]
 
+        # writers save checkpoints here as they complete memmaps, so that they can resume if interrupted
+        all_checkpoint_paths = [join_path(None, metadata, f"{i}.ckpt") for i in range(len(all_destination_paths))]
+
+        # groups that have been completed in a previous run are skipped, but only if that run used the same
+        # files, grouping, destination, and settings; the fingerprint of the last run is kept next to the
+        # done files.
+        settings_fingerprint = hashlib.sha256(
+            repr(
+                (grouped_source_prefixes, destination, sorted(process_single_kwargs.items()), self.seed)
+            ).encode("utf-8")
+        ).hexdigest()
+        settings_path = join_path(None, metadata, "settings.sha256")
+        ignore_existing = self.ignore_existing
+        if not ignore_existing and any(exists(path) for path in all_metadata_path):
+            previous_fingerprint = None
+            if exists(settings_path):
+                with smart_open.open(settings_path, "rt") as f:
+                    previous_fingerprint = f.read().strip()
+            if previous_fingerprint != settings_fingerprint:
+                print(f"Settings differ from the previous run in {metadata}; not skipping completed groups.")
+                ignore_existing = True
+        with smart_open.open(settings_path, "wt") as f:
+            f.write(settings_fingerprint)
+
+        to_process = [i for i, path in enumerate(all_metadata_path) if ignore_existing or not exists(path)]
+        if len(to_process) < len(grouped_source_prefixes):
+            print(
+                f"Skipping {len(grouped_source_prefixes) - len(to_process):,} groups completed in a previous run."
+            )
+
         # give the user some feedback
         print(
-            f"Tokenizing {sum(len(e) for e in grouped_source_prefixes):,} source files "
-            f"into {len(grouped_source_prefixes):,} numpy destinations."
+            f"Tokenizing {sum(len(grouped_source_prefixes[i]) for i in to_process):,} source files "
+            f"into {len(to_process):,} numpy destinations."
         )
 
         # finally run the processors
         fn = self._debug_run_all if self.debug else self._multiprocessing_run_all
         fn(
-            all_source_paths=source_indices,
-            all_destination_paths=all_destination_paths,
-            all_metadata_paths=all_metadata_path,
+            all_source_paths=[source_indices[i] for i in to_process],
+            all_destination_paths=[all_destination_paths[i] for i in to_process],
+            all_metadata_paths=[all_metadata_path[i] for i in to_process],
             grouped_source_prefixes=grouped_source_prefixes,
+            checkpoint_paths=all_checkpoint_paths,
+            seed=self.seed,
             **process_single_kwargs,
         )
 
@@ -305,6 +520,12 @@ def tokenize_in_parallel(
     sample_ring_prop: bool = False,
     refresh_tokenizer: int = 0,
     use_fast_tokenizer: bool = True,
+    seq_len: Optional[int] = None,
+    packing_algorithm: str = "best_fit",
+    packing_max_open_bins: Optional[int] = None,
+    token_cache_path: Optional[str] = None,
+    token_cache_max_size: Optional[int] = None,
+    ignore_existing: bool = False,
 ):
     """
     Tokenizes the input sources in parallel using multiple writers and readers.
@@ -325,7 +546,11 @@ def tokenize_in_parallel(
         segment_before_tokenization (bool, optional): Whether to segment the input before tokenization.
             Defaults to False.
         seed (int, optional): Seed value for randomization. Defaults to 3920.
-        metadata_dir (str, optional): Directory to store metadata files. Defaults to None.
+        metadata_dir (str, optional): Directory to store metadata files. Writers save a checkpoint here every
+            time a memmap file is completed; if a run is interrupted, running again with the same arguments
+            resumes from the last completed memmap of each writer, and skips writers that had already
+            finished, as long as its settings are unchanged. Defaults to None, which uses a temporary
+            directory derived from sources, tokenizer, and destination.
         max_size (int, optional): Maximum size of each tokenized file. Defaults to 1024 * 1024 * 1024.
         dtype (str, optional): Data type for tokenized files. Defaults to "uint16".
         debug (bool, optional): Whether to enable debug mode. Defaults to False.
@@ -334,10 +559,27 @@ def tokenize_in_parallel(
         refresh_tokenizer (int, optional): Number of batches after which to refresh the tokenizer.
             Defaults to 0, which means the tokenizer will not be refreshed.
         use_fast_tokenizer (bool, optional): Whether to use the fast tokenizer. Defaults to True.
+        seq_len (int, optional): If provided, documents are packed into instances of exactly `seq_len` tokens;
+            documents that are longer than `seq_len` are split, and instances are padded with `pad_token_id`.
+            Defaults to None, which means documents are written one after the other without packing.
+        packing_algorithm (str, optional): Algorithm to use to pack documents into instances; either
+            "best_fit" or "first_fit". Defaults to "best_fit".
+        packing_max_open_bins (int, optional): Maximum number of partially filled instances to keep while
+            packing. Defaults to None, which uses the default of `SequencePacker`.
+        token_cache_path (str, optional): Local or S3 location of a cache of tokenized documents, keyed on the
+            hash of their text and on the tokenizer fingerprint. Documents found in the cache are not tokenized
+            again. Defaults to None, which means no cache is used.
+        token_cache_max_size (int, optional): Maximum size in bytes of a local token cache; least recently used
+            entries are evicted once the limit is exceeded. Defaults to None, which means no limit.
+        ignore_existing (bool, optional): Whether to tokenize all files again, even if a previous run with the
+            same `metadata_dir` and settings completed some of them. Defaults to False.
     """
     # variables to avoid issues with parallelism
     os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
+    if seq_len is not None and seq_len > max_size:
+        raise ValueError(f"seq_len ({seq_len:,}) cannot be larger than max_size ({max_size:,}).")
+
     # do it once so it gets cached (unless it's local path, so no need)
     if not os.path.exists(tokenizer_name_or_path):
         Tokenizer.from_pretrained(
@@ -349,7 +591,9 @@ def tokenize_in_parallel(
         )
 
     # get a run hash
-    run_hash = hashlib.sha256(("".join(sources) + tokenizer_name_or_path).encode("utf-8")).hexdigest()[:8]
+    run_hash = hashlib.sha256(
+        ("".join(sources) + tokenizer_name_or_path + destination).encode("utf-8")
+    ).hexdigest()[:8]
     metadata_dir = metadata_dir or join_path(None, tempfile.gettempdir(), f"dolma-{run_hash}")
 
     parallel_writer = MemMapParallelWriter(
@@ -364,6 +608,7 @@ def tokenize_in_parallel(
         num_processes=num_writers,
         seed=seed,
         debug=debug,
+        ignore_existing=ignore_existing,
     )
     parallel_writer(
         num_readers=num_readers,
@@ -380,4 +625,9 @@ def tokenize_in_parallel(
         sample_ring_prop=sample_ring_prop,
         use_fast_tokenizer=use_fast_tokenizer,
         refresh_tokenizer=refresh_tokenizer,
+        seq_len=seq_len,
+        packing_algorithm=packing_algorithm,
+        packing_max_open_bins=packing_max_open_bins,
+        token_cache_path=token_cache_path,
+        token_cache_max_size=token_cache_max_size,
     )
@@ -1,11 +1,13 @@
 import functools
+import json
 import os
 import re
 from contextlib import ExitStack
 from csv import writer
+from io import BytesIO
 from pathlib import Path
 from tempfile import NamedTemporaryFile
-from typing import List, Optional, TextIO
+from typing import Dict, List, Optional, TextIO, Tuple
 
 import numpy as np
 import smart_open
@@ -22,6 +24,8 @@ class MemmapWriter:
     DEFAULT_MAX_TOKENS = 512 * 1024 * 1024  # 500M tokens / 1GB
     MEMMAP_EXTENSION = ".npy"
     METADATA_EXTENSION = ".csv.gz"
+    STATS_EXTENSION = ".stats.json"
+    INDEX_EXTENSION = ".idx.npz"
 
     def __init__(
         self,
@@ -40,6 +44,8 @@ class MemmapWriter:
         base_path = re.sub(r"(\.npy?)?(\.[a-zA-Z]+)*$", "", path)
         self.memmap_path = f"{base_path}{self.MEMMAP_EXTENSION}"
         self.metadata_path = f"{base_path}{self.METADATA_EXTENSION}"
+        self.stats_path = f"{base_path}{self.STATS_EXTENSION}"
+        self.index_path = f"{base_path}{self.INDEX_EXTENSION}"
         self.dtype = dtype
         self.max_tokens = max_tokens
 
@@ -49,6 +55,15 @@ class MemmapWriter:
         self._memmap_file: Optional[np.memmap] = None
         self._metadata_file: Optional[TextIO] = None
 
+        # per-source count of documents and tokens written to this file; saved alongside the memmap on close
+        self._source_stats: Dict[str, Dict[str, int]] = {}
+        self._padding_tokens = 0
+
+        # binary index of (start, end, source code, loc) for each document; sources are dictionary-encoded
+        self._index_rows: List[Tuple[int, int, int, int]] = []
+        self._index_ids: List[str] = []
+        self._source_table: Dict[str, int] = {}
+
     @functools.cached_property
     def metadata_writer(self):
         if self._metadata_file is None:
@@ -74,28 +89,137 @@ class MemmapWriter:
         if self._metadata_file is None:
             raise RuntimeError("Metadata file is not open")
 
-        if (len(output.tokens) + self._written_tokens) >= self.max_tokens:
+        length = output.end - output.start
+        if (length + self._written_tokens) >= self.max_tokens:
             # return false if the memmap file is full
             return False
 
+        self._write_output(output)
+
+        if flush:
+            self.flush()
+
+        return True
+
+    def _write_output(self, output: TokenizerOutput):
+        assert self._memmap_file is not None, "MemmapFile is not open"
+
+        length = output.end - output.start
         metadata = MemmapMetadata(
             id=output.id,
             src=output.src,
             loc=output.loc,
             start=self._written_tokens,
-            end=self._written_tokens + output.end,
+            end=self._written_tokens + length,
         )
-        self._memmap_file[self._written_tokens : self._written_tokens + output.end] = output.tokens
-        self._written_tokens += output.end
+        if output.start == 0 and output.end == len(output.tokens):
+            tokens = output.tokens
+        else:
+            # this output is a chunk of a longer document (e.g., when packing sequences)
+            tokens = output.tokens[output.start : output.end]
+        self._memmap_file[self._written_tokens : self._written_tokens + length] = tokens
+        self._written_tokens += length
 
         # self._metadata_file.write(msgspec.json.encode(metadata) + b"\n")
         self.metadata_writer.writerow(metadata)
 
+        src_code = self._source_table.setdefault(output.src, len(self._source_table))
+        self._index_rows.append((metadata.start, metadata.end, src_code, output.loc))
+        self._index_ids.append(output.id)
+
+        stats = self._source_stats.setdefault(output.src, {"documents": 0, "tokens": 0})
+        # chunks of a document after the first one should not be counted as new documents
+        stats["documents"] += int(output.start == 0)
+        stats["tokens"] += length
+
+    def write_instance(
+        self, outputs: List[TokenizerOutput], length: int, pad_token_id: int, flush: bool = False
+    ) -> bool:
+        """Write a packed instance of exactly `length` tokens; if the outputs are shorter than `length`, the
+        instance is right-padded with `pad_token_id`. Returns false if the instance does not fit in the file.
+
+        Args:
+            outputs (List[TokenizerOutput]): Documents (or chunks of documents) that make up the instance.
+            length (int): Length of the instance in tokens.
+            pad_token_id (int): Token ID to use for padding.
+            flush (bool, optional): Whether to flush the memmap file after writing. Defaults to False.
+        """
+        if self._memmap_file is None:
+            raise RuntimeError("MemmapFile is not open")
+
+        if self._metadata_file is None:
+            raise RuntimeError("Metadata file is not open")
+
+        if sum(o.end - o.start for o in outputs) > length:
+            raise ValueError(f"Instance is longer than {length} tokens")
+
+        if (length + self._written_tokens) > self.max_tokens:
+            # return false if the memmap file is full
+            return False
+
+        instance_end = self._written_tokens + length
+        for output in outputs:
+            self._write_output(output)
+
+        if (padding := instance_end - self._written_tokens) > 0:
+            self._memmap_file[self._written_tokens : instance_end] = pad_token_id
+            self._written_tokens = instance_end
+            self._padding_tokens += padding
+
         if flush:
             self.flush()
 
         return True
 
+    def write_many_instances(
+        self, instances: List[List[TokenizerOutput]], length: int, pad_token_id: int, flush: bool = False
+    ) -> List[List[TokenizerOutput]]:
+        remaining: List[List[TokenizerOutput]] = []
+
+        for i, instance in enumerate(instances):
+            if not self.write_instance(outputs=instance, length=length, pad_token_id=pad_token_id):
+                remaining = instances[i:]
+                break
+
+        if flush:
+            self.flush()
+
+        return remaining
+
+    @property
+    def stats(self) -> dict:
+        """Summary of documents and tokens written to this file, overall and for each source."""
+        return {
+            "documents": sum(s["documents"] for s in self._source_stats.values()),
+            "tokens": sum(s["tokens"] for s in self._source_stats.values()),
+            "padding_tokens": self._padding_tokens,
+            "sources": {src: dict(s) for src, s in self._source_stats.items()},
+        }
+
+    def _write_index(self):
+        """Save the index of documents as a numpy archive; unlike the metadata file, it can be loaded without
+        parsing, and it is used by `TokenizedDataset` to access documents."""
+        index = np.array(self._index_rows, dtype=np.int64).reshape(-1, 4)
+
+        # ids are stored as a single utf-8 buffer plus the offset of each id in the buffer
+        encoded_ids = [id_.encode("utf-8") for id_ in self._index_ids]
+        id_offsets = np.zeros(len(encoded_ids) + 1, dtype=np.int64)
+        np.cumsum([len(e) for e in encoded_ids], out=id_offsets[1:])
+
+        buffer = BytesIO()
+        np.savez(
+            buffer,
+            offsets=index[:, :2],
+            sources=index[:, 2].astype(np.int32),
+            locs=index[:, 3],
+            ids=np.frombuffer(b"".join(encoded_ids), dtype=np.uint8),
+            id_offsets=id_offsets,
+            source_table=np.array(list(self._source_table), dtype=str),
+            dtype=np.array(np.dtype(self.dtype).str),
+        )
+        with smart_open.open(self.index_path, mode="wb") as f:
+            f.write(buffer.getvalue())
+
     def write_many(self, outputs: List[TokenizerOutput], flush: bool = False) -> List[TokenizerOutput]:
         remaining: List[TokenizerOutput] = []
 
@@ -199,6 +323,11 @@ class MemmapWriter:
                     g.write(f.read())
 
                 log.info(f"Written memmap file to {self.memmap_path}")
+
+            with smart_open.open(self.stats_path, mode="wt") as f:
+                json.dump(self.stats, f)
+
+            self._write_index()
         finally:
             if self.is_remote_path:
                 # delete the temporary file under any circumstances
@@ -207,6 +336,11 @@ class MemmapWriter:
         # reset to none, clear cache
         self._local_memmap_path = self._memmap_file = None
         self._local_metadata_path = self._metadata_file = None
+        self._source_stats = {}
+        self._padding_tokens = 0
+        self._index_rows = []
+        self._index_ids = []
+        self._source_table = {}
 
         try:
             del self.metadata_writer
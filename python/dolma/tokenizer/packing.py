@@ -0,0 +1,109 @@
+from typing import List, Optional, Union
+
+from .data_types import TokenizerOutput
+from .tokenizer import StrEnum
+
+__all__ = ["PackingAlgorithm", "SequencePacker"]
+
+
+class PackingAlgorithm(StrEnum):
+    first_fit = "first_fit"
+    best_fit = "best_fit"
+
+
+class _Bin:
+    __slots__ = ("outputs", "remaining")
+
+    def __init__(self, capacity: int):
+        self.outputs: List[TokenizerOutput] = []
+        self.remaining = capacity
+
+    def add(self, output: TokenizerOutput):
+        self.outputs.append(output)
+        self.remaining -= output.end - output.start
+
+
+class SequencePacker:
+    """Packs tokenized documents into instances of exactly `seq_len` tokens.
+
+    Documents longer than `seq_len` are split into full-length chunks, which are emitted as their own
+    instances; the remainder of the document (or the whole document, if shorter than `seq_len`) is placed
+    into one of at most `max_open_bins` partially filled instances using first-fit or best-fit bin packing.
+    When no open instance can fit a document and all bins are in use, the fullest instance is emitted
+    to make room. Emitted instances might be shorter than `seq_len`; they should be padded when written.
+    """
+
+    DEFAULT_MAX_OPEN_BINS = 32
+
+    def __init__(
+        self,
+        seq_len: int,
+        algorithm: Union[str, PackingAlgorithm] = PackingAlgorithm.best_fit,
+        max_open_bins: Optional[int] = None,
+    ):
+        if seq_len <= 0:
+            raise ValueError(f"seq_len must be a positive integer, got {seq_len}")
+
+        self.seq_len = seq_len
+        self.algorithm = PackingAlgorithm(algorithm)
+        self.max_open_bins = max_open_bins or self.DEFAULT_MAX_OPEN_BINS
+        self._bins: List[_Bin] = []
+
+    def _find_bin(self, length: int) -> Optional[_Bin]:
+        if self.algorithm == PackingAlgorithm.first_fit:
+            return next((b for b in self._bins if b.remaining >= length), None)
+
+        best: Optional[_Bin] = None
+        for b in self._bins:
+            if b.remaining >= length and (best is None or b.remaining < best.remaining):
+                best = b
+        return best
+
+    def _add_to_bin(self, output: TokenizerOutput) -> List[List[TokenizerOutput]]:
+        length = output.end - output.start
+        packed: List[List[TokenizerOutput]] = []
+
+        if (bin_ := self._find_bin(length)) is None:
+            if len(self._bins) >= self.max_open_bins:
+                # no room for a new bin: we emit the one with the least space left
+                fullest = min(self._bins, key=lambda b: b.remaining)
+                self._bins.remove(fullest)
+                packed.append(fullest.outputs)
+            bin_ = _Bin(self.seq_len)
+            self._bins.append(bin_)
+
+        bin_.add(output)
+        if bin_.remaining == 0:
+            # instance is complete; no need to keep it around
+            self._bins.remove(bin_)
+            packed.append(bin_.outputs)
+
+        return packed
+
+    def add(self, output: TokenizerOutput) -> List[List[TokenizerOutput]]:
+        """Add a document to the packer; returns any instance that has been completed as a result."""
+        packed: List[List[TokenizerOutput]] = []
+
+        start = output.start
+        while output.end - start >= self.seq_len:
+            # chunks as long as the sequence length are emitted directly as their own instance
+            packed.append([TokenizerOutput.from_output_spec(output, start=start, end=start + self.seq_len)])
+            start += self.seq_len
+
+        if start < output.end:
+            packed.extend(self._add_to_bin(TokenizerOutput.from_output_spec(output, start=start)))
+
+        return packed
+
+    def add_many(self, outputs: List[TokenizerOutput]) -> List[List[TokenizerOutput]]:
+        return [instance for output in outputs for instance in self.add(output)]
+
+    def flush(self) -> List[List[TokenizerOutput]]:
+        """Emit all instances that are still open, from fullest to emptiest."""
+        packed = [b.outputs for b in sorted(self._bins, key=lambda b: b.remaining)]
+        self._bins = []
+        return packed
+
+    def __len__(self) -> int:
+        """Number of instances that are currently open."""
+        return len(self._bins)
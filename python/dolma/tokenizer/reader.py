@@ -0,0 +1,133 @@
+import re
+from typing import Dict, Iterator, List, Union, overload
+
+import numpy as np
+
+from ..core.paths import glob_path, is_local
+from .data_types import TokenizerOutput
+from .memmap_writer import MemmapWriter
+
+__all__ = ["TokenizedDataset"]
+
+
+class TokenizedDataset:
+    """Random access to documents written by the tokenizer.
+
+    Token files are memory-mapped lazily; document boundaries, locations, ids, and sources are loaded from the
+    `.idx.npz` index written next to each token file, so the metadata CSVs never need to be decompressed.
+    Documents are numbered in the order of (sorted) token files, and then in the order they were written.
+    """
+
+    def __init__(self, paths: Union[str, List[str]]):
+        """Open a tokenized dataset.
+
+        Args:
+            paths (Union[str, List[str]]): One or more local paths to token files, directories containing
+                token files, or globs. Only files with a `.npy` extension are considered.
+        """
+        paths = [paths] if isinstance(paths, str) else paths
+        if remote := [p for p in paths if not is_local(p)]:
+            raise ValueError(f"Only local paths can be memory-mapped, got {remote}")
+
+        self.paths = sorted(
+            set(
+                p
+                for path in paths
+                for p in glob_path(path, yield_dirs=False)
+                if p.endswith(MemmapWriter.MEMMAP_EXTENSION)
+            )
+        )
+        if not self.paths:
+            raise FileNotFoundError(f"No token files found in {paths}")
+
+        source_table: Dict[str, int] = {}
+        offsets, sources, locs, file_ids = [], [], [], []
+        self._dtypes: List[np.dtype] = []
+        self._ids: List[np.ndarray] = []
+        self._id_offsets: List[np.ndarray] = []
+        self._first_doc: List[int] = []
+
+        total_docs = 0
+        for file_id, path in enumerate(self.paths):
+            index_path = re.sub(
+                rf"{re.escape(MemmapWriter.MEMMAP_EXTENSION)}$", MemmapWriter.INDEX_EXTENSION, path
+            )
+            with np.load(index_path) as index:
+                # remap the source codes of this file to codes that are shared by all files
+                remap = np.array(
+                    [source_table.setdefault(src, len(source_table)) for src in index["source_table"].tolist()],
+                    dtype=np.int32,
+                )
+                offsets.append(index["offsets"])
+                sources.append(remap[index["sources"]] if len(remap) else index["sources"])
+                locs.append(index["locs"])
+                file_ids.append(np.full(len(index["offsets"]), file_id, dtype=np.int32))
+                self._ids.append(index["ids"])
+                self._id_offsets.append(index["id_offsets"])
+                self._dtypes.append(np.dtype(str(index["dtype"])))
+            self._first_doc.append(total_docs)
+            total_docs += len(offsets[-1])
+
+        self.sources: List[str] = list(source_table)
+        self._offsets = np.concatenate(offsets)
+        self._sources = np.concatenate(sources)
+        self._locs = np.concatenate(locs)
+        self._file_ids = np.concatenate(file_ids)
+        self._memmaps: Dict[int, np.memmap] = {}
+
+    def _memmap(self, file_id: int) -> np.memmap:
+        if (memmap := self._memmaps.get(file_id)) is None:
+            memmap = self._memmaps[file_id] = np.memmap(self.paths[file_id], dtype=self._dtypes[file_id], mode="r")
+        return memmap
+
+    def _check_index(self, i: int) -> int:
+        if i < -len(self) or i >= len(self):
+            raise IndexError(f"Document index {i} out of range for dataset with {len(self):,} documents")
+        return i % len(self)
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    @property
+    def num_tokens(self) -> int:
+        return int((self._offsets[:, 1] - self._offsets[:, 0]).sum())
+
+    @overload
+    def __getitem__(self, i: int) -> np.ndarray:
+        pass
+
+    @overload
+    def __getitem__(self, i: slice) -> List[np.ndarray]:
+        pass
+
+    def __getitem__(self, i: Union[int, slice]) -> Union[np.ndarray, List[np.ndarray]]:
+        """Get the tokens of the i-th document, or a list of tokens for a slice of documents."""
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+
+        i = self._check_index(i)
+        start, end = self._offsets[i]
+        return self._memmap(int(self._file_ids[i]))[start:end]
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def get(self, i: int) -> TokenizerOutput:
+        """Get the tokens of the i-th document together with its id, source, and location in the source."""
+        i = self._check_index(i)
+        file_id = int(self._file_ids[i])
+        local_i = i - self._first_doc[file_id]
+        id_start, id_end = self._id_offsets[file_id][local_i : local_i + 2]
+        return TokenizerOutput.from_tokens(
+            id=self._ids[file_id][id_start:id_end].tobytes().decode("utf-8"),
+            src=self.sources[self._sources[i]],
+            loc=int(self._locs[i]),
+            tokens=self[i],  # pyright: ignore
+        )
+
+    def filter_by_source(self, *sources: str) -> np.ndarray:
+        """Return the indices of all documents that come from any of the given sources."""
+        selected = set(sources)
+        codes = [code for code, src in enumerate(self.sources) if src in selected]
+        return np.flatnonzero(np.isin(self._sources, codes))
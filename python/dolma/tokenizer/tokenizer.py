@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import gc
+import hashlib
 import json
 import os
 import re
@@ -28,6 +29,9 @@ with necessary("transformers", soft=True) as TRANSFORMERS_AVAILABLE:
     if TYPE_CHECKING or TRANSFORMERS_AVAILABLE:
         from transformers import AutoTokenizer  # pylint: disable=import-error
 
+if TYPE_CHECKING:
+    from .cache import TokenCache
+
 PathOrStr = Union[str, PathLike]
 
 logger = get_logger(__name__)
@@ -35,6 +39,10 @@ logger = get_logger(__name__)
 
 __all__ = ["Tokenizer"]
 
+# paragraphs start with a run of newlines, except for the first paragraph in a document, which keeps any
+# leading newlines; the first paragraph of an empty document is an empty string.
+PARAGRAPH_RE = re.compile(r"(?:^\n*|\n+)[^\n]*")
+
 
 class StrEnum(str, Enum):
     """
@@ -135,6 +143,21 @@ class Tokenizer:
         # all checks above failed, so we return False
         return False
 
+    @cached_property
+    def fingerprint(self) -> str:
+        """Hash of the tokenizer configuration and of all the settings that affect the output of `encode`."""
+        settings = [
+            self.config,
+            self.is_fast,
+            self.bos_token_id,
+            self.eos_token_id,
+            self.truncate_to,
+            str(self.truncate_direction),
+            self.segment_before_tokenization,
+            self.encode_special_tokens,
+        ]
+        return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
     def get_base_tokenizer_config(self) -> dict:
         # Rust HuggingFace tokenizers don't have a way to get the full configuration through Python bindings,
         # so we hack around it by saving the tokenizer to a temporary file and reading the config.
@@ -265,36 +288,36 @@ class Tokenizer:
         return self.encode_batch([input], add_special_tokens=add_special_tokens)[0]
 
     def split_into_paragraphs(self, inputs: List[str]) -> Tuple[List[str], List[Tuple[int, int]]]:
+        """Split each input into paragraphs; returns the paragraphs of all inputs, and for each input, the
+        range of its paragraphs in the returned list."""
         slices = []
-        batch = []
-        curr = 0
+        batch: List[str] = []
         for input_ in inputs:
-            paragraphs = [
+            start = len(batch)
+            paragraphs = PARAGRAPH_RE.findall(input_)
+            if self.tokenizer_has_prefix:
                 # if a tokenizer adds a prefix in front of sequences, then the tokenization of the first
                 # symbol in each paragraph will be different depending on whether paragraphs are split
                 # before tokenization or not. To counter this, we add a space in front of each paragraph
                 # except the first one. We will remove the space from the tokenized symbols later.
-                (" " if self.tokenizer_has_prefix and i > 0 else "") + match.group()
-                # this regular expression keeps newlines at the beginning of paragraphs unless
-                # the paragraph is the first one in the document
-                for i, match in enumerate(re.finditer(r"(^\n*|\n+)[^\n]*", input_))
-            ]
-            slices.append((curr, curr + len(paragraphs)))
-            batch.extend(paragraphs)
-            curr += len(paragraphs)
+                batch.append(paragraphs[0])
+                batch.extend([" " + paragraph for paragraph in paragraphs[1:]])
+            else:
+                batch.extend(paragraphs)
+            slices.append((start, len(batch)))
         return batch, slices
 
     def merge_paragraphs(self, encoded: List[List[int]], slices: List[Tuple[int, int]]) -> List[List[int]]:
-        merged = []
-        for start, end in slices:
-            encoded_slice_iter = (
-                # the slicing operation is required if we have added a space in front of each paragraph
-                # during the `split_into_paragraphs` method.
-                encoded[pos][1:] if (self.tokenizer_has_prefix and pos > 0) else encoded[pos]
-                for pos in range(start, end)
-            )
-            merged.append(list(chain.from_iterable(encoded_slice_iter)))
-        return merged
+        """Merge the token IDs of paragraphs back into one sequence per input."""
+        if not self.tokenizer_has_prefix:
+            return [list(chain.from_iterable(encoded[start:end])) for start, end in slices]
+
+        # the slicing operation is required because we have added a space in front of each paragraph (except
+        # the first one of each input) during the `split_into_paragraphs` method.
+        return [
+            list(chain(encoded[start], *[paragraph[1:] for paragraph in encoded[start + 1 : end]]))
+            for start, end in slices
+        ]
 
     def encode_batch(
         self,
@@ -359,31 +382,81 @@ def tokenize_file(
     tokenizer_name_or_path: str,
     path: str,
     refresh_tokenizer_every: int = 0,
+    skip_lines: int = 0,
+    cache: Optional[TokenCache] = None,
+    batch_size: int = 64,
     **tokenizer_kwargs,
 ) -> Generator[TokenizerOutput, None, None]:
     """Tokenize a file of documents using the provided tokenizer; file is expected to be a gzipped JSON lines
-    file, each containing a field named `text`.
+    file, each containing a field named `text`. The first `skip_lines` lines of the file are read but not
+    tokenized; this is used to resume tokenization of a partially processed file. If a token cache is provided,
+    documents found in the cache are not tokenized again, and newly tokenized documents are added to it.
+    Documents are encoded `batch_size` at a time, so that a single call to the tokenizer handles all of them
+    (and, if documents are segmented before tokenization, all of their paragraphs).
     """
     tokenizer = make_tokenizer(tokenizer_name_or_path, **tokenizer_kwargs)
+    if cache is not None and cache.fingerprint != tokenizer.fingerprint:
+        raise ValueError(f"Token cache is for tokenizer {cache.fingerprint}, not {tokenizer.fingerprint}")
     dtype = deepcopy(tokenizer.dtype)
     decoder = msgspec.json.Decoder(InputSpec)
+
+    def encode_rows(rows: List[Tuple[int, InputSpec, str]]) -> Generator[TokenizerOutput, None, None]:
+        all_tokens: List[Optional[List[int]]] = [None] * len(rows)
+        keys = [cache.key(text) for _, _, text in rows] if cache is not None else []
+        if cache is not None:
+            all_tokens = [cache.get(key) for key in keys]
+
+        if missing := [j for j, tokens in enumerate(all_tokens) if tokens is None]:
+            encoded: List[Optional[List[int]]]
+            try:
+                encoded = list(tokenizer.encode_batch([rows[j][2] for j in missing], add_special_tokens=True))
+            except Exception as ex:
+                # encode rows one at a time, so that only the ones that fail are skipped
+                logger.warning("Error encoding %s:%d-%d as a batch", path, rows[0][0], rows[-1][0], exc_info=ex)
+                encoded = []
+                for j in missing:
+                    try:
+                        encoded.append(tokenizer.encode(rows[j][2], add_special_tokens=True))
+                    except Exception as ex:
+                        logger.error("Error processing %s:%d", path, rows[j][0], exc_info=ex)
+                        encoded.append(None)
+            for j, tokens in zip(missing, encoded):
+                all_tokens[j] = tokens
+                if cache is not None and tokens is not None:
+                    cache.put(keys[j], tokens)
+
+        for (i, row, _), tokens in zip(rows, all_tokens):
+            if tokens is None:
+                continue
+            # extra copy to prevent memory leaks
+            output_tokens = np.array(tokens, dtype=dtype) if refresh_tokenizer_every else tokens
+            yield TokenizerOutput.from_tokens(id=row.id, src=path, loc=i, tokens=output_tokens)  # pyright: ignore
+
+    rows: List[Tuple[int, InputSpec, str]] = []
     with smart_open.open(path, mode="rt") as input_stream:
         for i, line in enumerate(input_stream, start=1):
+            if i <= skip_lines:
+                continue
+
             try:
                 row = decoder.decode(line)
                 if text := row.text.strip():
                     # skip empty docs
-                    tokens = tokenizer.encode(text, add_special_tokens=True)
-                    if refresh_tokenizer_every:
-                        # extra copy to prevent memory leaks
-                        tokens = np.array(tokens, dtype=dtype)
-                    yield TokenizerOutput.from_tokens(id=row.id, src=path, loc=i, tokens=tokens)  # pyright: ignore
-
-                if refresh_tokenizer_every > 0 and i % refresh_tokenizer_every == 0:
-                    # to prevent memory leaks, we refresh the tokenizer every so often
-                    del tokenizer
-                    gc.collect()
-                    tokenizer = make_tokenizer(tokenizer_name_or_path, **tokenizer_kwargs)
-
+                    rows.append((i, row, text))
             except Exception as ex:
                 logger.error("Error processing %s:%d", path, i, exc_info=ex)
+
+            if refresh_tokenizer_every > 0 and i % refresh_tokenizer_every == 0:
+                yield from encode_rows(rows)
+                rows = []
+
+                # to prevent memory leaks, we refresh the tokenizer every so often
+                del tokenizer
+                gc.collect()
+                tokenizer = make_tokenizer(tokenizer_name_or_path, **tokenizer_kwargs)
+
+            elif len(rows) >= batch_size:
+                yield from encode_rows(rows)
+                rows = []
+
+    yield from encode_rows(rows)
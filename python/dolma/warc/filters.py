@@ -0,0 +1,112 @@
+import re
+from typing import TYPE_CHECKING, Iterable, Optional
+from urllib.parse import urlsplit
+
+from necessary import necessary
+
+with necessary("fastwarc", soft=True) as FASTWARC_AVAILABLE:
+    if FASTWARC_AVAILABLE or TYPE_CHECKING:
+        from fastwarc.warc import WarcRecord, WarcRecordType
+
+__all__ = ["WarcRecordPrefilter"]
+
+
+class WarcRecordPrefilter:
+    """Decide which response records of a WARC file to process by looking only at their WARC and HTTP headers.
+
+    An instance is passed to fastwarc's `ArchiveIterator` as `func_filter`, so the iterator skips over the
+    payload of a rejected record without ever reading, decoding, or linearizing it. Records that are not
+    responses (e.g. warcinfo) are always kept. All criteria are optional; with none, every record is kept.
+
+    Args:
+        content_types: HTTP content types to keep, e.g. `text/html`; a type ending in `/*` keeps all its
+            subtypes. Records without a content type are dropped when this is set.
+        status_codes: HTTP status codes to keep, e.g. `200`.
+        blocked_domains: hosts to drop, together with all their subdomains.
+        blocked_url_patterns: regular expressions; records whose target URI matches any of them are dropped.
+        min_content_length: drop records whose block (HTTP headers and payload) is shorter than this many bytes.
+        max_content_length: drop records whose block is longer than this many bytes.
+    """
+
+    def __init__(
+        self,
+        content_types: Optional[Iterable[str]] = None,
+        status_codes: Optional[Iterable[int]] = None,
+        blocked_domains: Optional[Iterable[str]] = None,
+        blocked_url_patterns: Optional[Iterable[str]] = None,
+        min_content_length: Optional[int] = None,
+        max_content_length: Optional[int] = None,
+    ):
+        content_types = [t.strip().lower() for t in content_types or [] if t.strip()]
+        self.content_types = frozenset(t for t in content_types if not t.endswith("/*"))
+        self.content_type_prefixes = tuple(t[:-1] for t in content_types if t.endswith("/*"))
+        self.check_content_type = bool(content_types)
+
+        self.status_codes = frozenset(int(code) for code in status_codes or [])
+        self.blocked_domains = frozenset(d.strip().strip(".").lower() for d in blocked_domains or [] if d.strip())
+
+        patterns = [p for p in blocked_url_patterns or [] if p]
+        self.blocked_url_regex = re.compile("|".join(f"(?:{p})" for p in patterns)) if patterns else None
+
+        self.min_content_length = min_content_length or 0
+        self.max_content_length = max_content_length
+
+    @property
+    def is_empty(self) -> bool:
+        """True if the prefilter keeps every record."""
+        return not (
+            self.check_content_type
+            or self.status_codes
+            or self.blocked_domains
+            or self.blocked_url_regex
+            or self.min_content_length
+            or self.max_content_length is not None
+        )
+
+    def is_blocked_host(self, host: str) -> bool:
+        # check the host and each of its parent domains, e.g. a.b.com, b.com, com
+        host = host.lower()
+        while True:
+            if host in self.blocked_domains:
+                return True
+            if "." not in host:
+                return False
+            host = host.split(".", 1)[1]
+
+    def __call__(self, record: "WarcRecord") -> bool:
+        """Return True if the record should be read and processed, False if it should be skipped."""
+        if record.record_type != WarcRecordType.response:
+            return True
+
+        content_length = record.content_length
+        if content_length < self.min_content_length:
+            return False
+        if self.max_content_length is not None and content_length > self.max_content_length:
+            return False
+
+        if self.status_codes and (
+            record.http_headers is None or record.http_headers.status_code not in self.status_codes
+        ):
+            return False
+
+        if self.check_content_type:
+            content_type = (record.http_content_type or "").lower()
+            if content_type not in self.content_types and not (
+                self.content_type_prefixes and content_type.startswith(self.content_type_prefixes)
+            ):
+                return False
+
+        if self.blocked_domains or self.blocked_url_regex:
+            # some crawlers wrap the target URI in angle brackets
+            target_uri = (record.headers.get("WARC-Target-URI") or "").strip("<>")
+            if self.blocked_url_regex is not None and self.blocked_url_regex.search(target_uri):
+                return False
+            if self.blocked_domains:
+                try:
+                    host = urlsplit(target_uri).hostname or ""
+                except ValueError:
+                    host = ""
+                if host and self.is_blocked_host(host):
+                    return False
+
+        return True
@@ -1,13 +1,24 @@
 import datetime
 import multiprocessing
 import tempfile
+from collections import deque
 from contextlib import ExitStack
 from itertools import chain
-from typing import TYPE_CHECKING, Dict, List, Optional, Union
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Deque,
+    Dict,
+    Generator,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Union,
+)
 
 import msgspec
 import smart_open
-from charset_normalizer import detect
 from necessary import necessary
 
 from ..core.data_types import InputSpecWithMetadataAndAttributes
@@ -18,38 +29,96 @@ from ..core.runtime import _make_paths_from_prefix
 from ..core.utils import make_variable_name
 
 # from .documents import WarcDocument, WarcDocumentMetadata
-# from .filters import FilterInputType, partition_extractors
+from .filters import WarcRecordPrefilter
 from .linearizers import LinearizerRegistry
-from .utils import UrlNormalizer, raise_warc_dependency_error
+from .utils import (
+    CharsetResolver,
+    UrlNormalizer,
+    parse_http_date,
+    raise_warc_dependency_error,
+)
 
 with necessary("fastwarc", soft=True) as FASTWARC_AVAILABLE:
     if FASTWARC_AVAILABLE or TYPE_CHECKING:
-        from fastwarc.warc import ArchiveIterator, WarcRecordType
+        from fastwarc.warc import ArchiveIterator, WarcRecord, WarcRecordType
 
 with necessary("dateparser", soft=True) as DATEPARSER_AVAILABLE:
     if DATEPARSER_AVAILABLE or TYPE_CHECKING:
         import dateparser
 
+if TYPE_CHECKING:
+    from multiprocessing.pool import AsyncResult, Pool
+
 
 DATE_FORMATS = ["%a, %d %b %Y %H:%M:%S %Z", "%Y-%m-%dT%H:%M:%SZ"]
 
 
+class WarcRawRecord(NamedTuple):
+    """The parts of a WARC response record needed to extract a document from it; unlike fastwarc records,
+    these can be sent to other processes."""
+
+    content: bytes
+    http_charset: Optional[str]
+    target_uri: str
+    content_type: str
+    http_date: Optional[str]
+    payload_digest: str
+    stream_pos: int
+    warc_date: Optional[datetime.datetime]
+    warc_filename: Optional[str]
+
+    @classmethod
+    def from_record(
+        cls,
+        record: "WarcRecord",
+        warc_date: Optional[datetime.datetime] = None,
+        warc_filename: Optional[str] = None,
+    ) -> "WarcRawRecord":
+        return cls(
+            content=record.reader.read(),
+            http_charset=record.http_charset,
+            target_uri=record.headers.get("WARC-Target-URI"),
+            content_type=record.http_headers.get("Content-Type") or "",
+            http_date=record.http_headers.get("Date"),
+            payload_digest=record.headers.get("WARC-Payload-Digest"),
+            stream_pos=record.stream_pos,
+            warc_date=warc_date,
+            warc_filename=warc_filename,
+        )
+
+
 class WarcProcessor(BaseParallelProcessor):
-    """Processes WARC files, like the ones used by Common Crawl, in parallel."""
+    """Processes WARC files, like the ones used by Common Crawl, in parallel.
+
+    By default, each process works on a different WARC file. With `parallel_records=True`, files are instead
+    read one at a time by the main process, which sends batches of records to `num_processes` workers that
+    decode, tag, and linearize them; this keeps all processes busy when there are fewer files than processes.
+    Documents are written in the order of their records in both cases.
+    """
+
+    # number of records sent to an extraction worker at once when records are processed in parallel
+    RECORDS_BATCH_SIZE = 64
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, parallel_records: bool = False, **kwargs):
         super().__init__(*args, **kwargs)
         if not FASTWARC_AVAILABLE:
             raise_warc_dependency_error("fastwarc")
         if not DATEPARSER_AVAILABLE:
             raise_warc_dependency_error("dateparser")
+        self.parallel_records = parallel_records
 
     @staticmethod
     def _format_to_dolma_timestamp(timestamp: Optional[datetime.datetime] = None) -> str:
         """Format a timestamp as a string using near ISO-8601 format."""
         if timestamp is None:
             timestamp = datetime.datetime.now()
-        return timestamp.strftime("%Y-%m-%dT%H:%M:%S.%f")[:23] + "Z"
+        if timestamp.year < 1000:
+            # strftime does not pad years to four digits on all platforms
+            return timestamp.strftime("%Y-%m-%dT%H:%M:%S.%f")[:23] + "Z"
+        return (
+            f"{timestamp.year:04d}-{timestamp.month:02d}-{timestamp.day:02d}T"
+            f"{timestamp.hour:02d}:{timestamp.minute:02d}:{timestamp.second:02d}.{timestamp.microsecond // 1000:03d}Z"
+        )
 
     @staticmethod
     def _parse_warc_timestamp(timestamp_str: Optional[str]) -> datetime.datetime:
@@ -57,7 +126,12 @@ class WarcProcessor(BaseParallelProcessor):
         if not timestamp_str:
             return datetime.datetime.now()
 
-        return dateparser.parse(date_string=timestamp_str, date_formats=DATE_FORMATS) or datetime.datetime.now()
+        # common formats are parsed directly; only others go through dateparser, which is much slower
+        return (
+            parse_http_date(timestamp_str)
+            or dateparser.parse(date_string=timestamp_str, date_formats=DATE_FORMATS)
+            or datetime.datetime.now()
+        )
 
     @classmethod
     def increment_progressbar(  # type: ignore
@@ -73,6 +147,17 @@ class WarcProcessor(BaseParallelProcessor):
         # we call the super method to increment the progress bar
         return super().increment_progressbar(queue, files=files, records=records, extracted=extracted)
 
+    def _multiprocessing_run_all(self, *args, **kwargs):
+        if not self.parallel_records or self.num_processes < 2:
+            return super()._multiprocessing_run_all(*args, **kwargs)
+
+        # processes in a pool cannot start processes of their own, so files are processed by the main
+        # process, which sends their records to a pool of workers shared by all files.
+        try:
+            return self._debug_run_all(*args, record_processes=self.num_processes, **kwargs)
+        finally:
+            _close_extraction_pool()
+
     @classmethod
     def process_single(
         cls,
@@ -85,7 +170,7 @@ class WarcProcessor(BaseParallelProcessor):
 
         warc_date: Optional[datetime.datetime] = None
         warc_filename: Optional[str] = None
-        date_now = datetime.datetime.now()
+        date_added = cls._format_to_dolma_timestamp(datetime.datetime.now())
 
         # interval at which to update the progress bar; will double if it gets too full
         update_interval = 1
@@ -94,38 +179,31 @@ class WarcProcessor(BaseParallelProcessor):
         records_cnt = 0
         extracted_cnt = 0
 
-        # encoder
-        encoder = msgspec.json.Encoder()
-
-        # get the name and version of this source
-        source_name = kwargs.get("source_name", None)
-        source_version = kwargs.get("source_version", "v0")
-        if not isinstance(source_name, str):
+        # how many processes extract documents from the records of this file; if more than one, the
+        # extractor is created in each of them instead of here.
+        record_processes: int = kwargs.get("record_processes") or 1
+        extractor_kwargs = dict(
+            source_name=kwargs.get("source_name", None),
+            source_version=kwargs.get("source_version", "v0"),
+            pre_taggers=kwargs.get("pre_taggers"),
+            linearizer_name=kwargs.get("linearizer_name"),
+            post_taggers=kwargs.get("post_taggers"),
+            store_html_in_metadata=kwargs.get("store_html_in_metadata"),
+            skip_no_pre_taggers=kwargs.get("skip_no_pre_taggers"),
+            skip_no_post_taggers=kwargs.get("skip_no_post_taggers"),
+        )
+        if not isinstance(source_name := extractor_kwargs["source_name"], str):
             raise ValueError(f"source_name must be a string, not {source_name} ({type(source_name)})")
 
-        # create any tagger that runs before html extraction
-        pre_taggers_names: List[str] = kwargs.get("pre_taggers") or []
-        pre_taggers = {make_variable_name(name): TaggerRegistry.get(name)() for name in pre_taggers_names}
-
-        # create the html extractor
-        linearizer_name: str = kwargs.get("linearizer_name") or "resiliparse"
-        linearizer = LinearizerRegistry.get(linearizer_name)()
-
-        # url normalizer
-        url_normalizer = UrlNormalizer()
-
-        # create any tagger that runs after html extraction
-        post_taggers_names: List[str] = kwargs.get("post_taggers") or []
-        post_taggers = {make_variable_name(name): TaggerRegistry.get(name)() for name in post_taggers_names}
-
-        # whether to store html in metadata after extraction
-        store_html_in_metadata: bool = kwargs.get("store_html_in_metadata") or False
-
-        # whether to skip this document if pre-taggers find nothing
-        skip_no_pre_taggers: bool = kwargs.get("skip_no_pre_taggers") or False
-
-        # whether to skip this document if post-taggers find nothing
-        skip_no_post_taggers: bool = kwargs.get("skip_no_post_taggers") or False
+        # drop records by looking at their headers only, before their payload is read and decoded
+        prefilter = WarcRecordPrefilter(
+            content_types=kwargs.get("allowed_content_types"),
+            status_codes=kwargs.get("allowed_status_codes"),
+            blocked_domains=kwargs.get("blocked_domains"),
+            blocked_url_patterns=kwargs.get("blocked_url_patterns"),
+            min_content_length=kwargs.get("min_content_length"),
+            max_content_length=kwargs.get("max_content_length"),
+        )
 
         # derive the destination path if it is not provided by splitting out all the
         # extensions, removing gz and warc, and adding jsonl.gz
@@ -134,85 +212,44 @@ class WarcProcessor(BaseParallelProcessor):
             extension = extension.replace(".gz", "").replace(".warc", "") + ".jsonl.gz"
             destination_path = join_path(prot, *base_dst[:-1], base_dst[-1] + extension)
 
-        with (
-            smart_open.open(source_path, "rb") as warc_file,
-            smart_open.open(destination_path, "wb") as output_file,
-        ):
-            it = ArchiveIterator(warc_file, record_types=WarcRecordType.response | WarcRecordType.warcinfo)
-            for record in it:
-                if record.record_type == WarcRecordType.warcinfo:
-                    warc_date = record.record_date or None
-                    warc_filename = record.record_id or None
-                    continue
-
-                # content is in bytes here
-                content = record.reader.read()
-
-                # keep track of the number of records processed
-                records_cnt += 1
-
-                # handling decoding here; we try to decode the content using the charset (fast),
-                # and only if that fails, we use the chardet library to detect the encoding (slow)
-                decoded_content = ""
-                if record.http_charset:
-                    try:
-                        decoded_content = content.decode(record.http_charset).strip()
-                    except UnicodeDecodeError:
-                        decoded_content = ""
-                if not decoded_content and (encoding := detect(content)["encoding"]):
-                    decoded_content = content.decode(str(encoding)).strip()
-                if not decoded_content:
-                    continue
+        with ExitStack() as stack:
+            warc_file = stack.enter_context(smart_open.open(source_path, "rb"))
+            output_file = stack.enter_context(smart_open.open(destination_path, "wb"))
 
-                # metadata
-                ctype, *_ = (record.http_headers.get("Content-Type") or "").split(";")
-                date = cls._parse_warc_timestamp(record.http_headers.get("Date"))
-                target_uri = record.headers.get("WARC-Target-URI")
-                payload_id = record.headers.get("WARC-Payload-Digest").split(":")[1].lower()
-                metadata = dict(
-                    warc_url=target_uri,
-                    url=url_normalizer(target_uri),
-                    html=decoded_content,
-                    warc_date=cls._format_to_dolma_timestamp(warc_date),
-                    warc_filename=warc_filename or "",
-                    content_type=ctype,
-                    uncompressed_offset=record.stream_pos,
+            def read_records() -> Generator[WarcRawRecord, None, None]:
+                nonlocal warc_date, warc_filename, records_cnt
+                it = ArchiveIterator(
+                    warc_file,
+                    record_types=WarcRecordType.response | WarcRecordType.warcinfo,
+                    func_filter=(None if prefilter.is_empty else prefilter),
                 )
-                doc = InputSpecWithMetadataAndAttributes(
-                    source=source_name,
-                    version=source_version,
-                    id=payload_id,
-                    text="",  # this will come later
-                    metadata=metadata,
+                for record in it:
+                    if record.record_type == WarcRecordType.warcinfo:
+                        warc_date = record.record_date or None
+                        warc_filename = record.record_id or None
+                        continue
+
+                    # keep track of the number of records processed
+                    records_cnt += 1
+                    yield WarcRawRecord.from_record(record, warc_date=warc_date, warc_filename=warc_filename)
+
+            if record_processes > 1:
+                outputs = cls._extract_in_parallel(
+                    records=read_records(),
+                    date_added=date_added,
+                    file_key=source_path,
+                    num_processes=record_processes,
+                    extractor_kwargs=extractor_kwargs,
                 )
+            else:
+                extractor = WarcRecordExtractor(**extractor_kwargs)
+                outputs = (extractor(raw_record, date_added=date_added) for raw_record in read_records())
 
-                # these are the properties extracted from
-                pre_attributes = {name: tagger.tag(doc) for name, tagger in pre_taggers.items()}
-                if skip_no_pre_taggers and not sum(map(len, pre_attributes.values())):
-                    continue
-
-                # extract text
-                doc.text = linearizer.linearize(content=decoded_content)
-
-                # these are the properties extracted from the HTML content
-                post_attributes = {name: tagger.tag(doc) for name, tagger in post_taggers.items()}
-                if skip_no_post_taggers and not sum(map(len, post_attributes.values())):
+            for output in outputs:
+                if output is None:
                     continue
 
-                doc.attributes = {
-                    f"{t_name}__{t_name}__{make_variable_name(a_name)}": attr_values
-                    for t_name, attributes in chain(pre_attributes.items(), post_attributes.items())
-                    for a_name, attr_values in attributes.items()
-                }
-
-                doc.created = cls._format_to_dolma_timestamp(date)
-                doc.added = cls._format_to_dolma_timestamp(date_now)
-
-                if not store_html_in_metadata:
-                    doc.metadata.pop("html", None)  # type: ignore
-
-                output_file.write(encoder.encode(doc) + b"\n")  # pyright: ignore
-
+                output_file.write(output)
                 extracted_cnt += 1
 
                 if extracted_cnt % update_interval == 0:
@@ -229,6 +266,194 @@ class WarcProcessor(BaseParallelProcessor):
 
         cls.increment_progressbar(queue, files=1, records=records_cnt, extracted=extracted_cnt)
 
+    @classmethod
+    def _extract_in_parallel(
+        cls,
+        records: Iterable[WarcRawRecord],
+        date_added: str,
+        file_key: str,
+        num_processes: int,
+        extractor_kwargs: Dict[str, Any],
+    ) -> Generator[Optional[bytes], None, None]:
+        """Extract documents from records using a pool of processes, yielding them in the order of records.
+
+        The pool is reused across files; file_key tells workers when records start coming from another file."""
+
+        def batches() -> Generator[List[WarcRawRecord], None, None]:
+            batch: List[WarcRawRecord] = []
+            for record in records:
+                batch.append(record)
+                if len(batch) == cls.RECORDS_BATCH_SIZE:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+        pool = _get_extraction_pool(num_processes=num_processes, extractor_kwargs=extractor_kwargs)
+
+        # at most two batches per process are read ahead, so that we never hold the whole file in memory
+        pending: Deque["AsyncResult"] = deque()
+        for batch in batches():
+            pending.append(pool.apply_async(_extract_batch, (batch, date_added, file_key)))
+            if len(pending) >= 2 * num_processes:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
+
+
+class WarcRecordExtractor:
+    """Extracts a document from a WARC record: decodes the payload, runs the taggers that need the HTML, turns
+    the HTML into text, runs the taggers that need the text, and serializes the document to a JSON line."""
+
+    def __init__(
+        self,
+        source_name: str,
+        source_version: str = "v0",
+        pre_taggers: Optional[List[str]] = None,
+        linearizer_name: Optional[str] = None,
+        post_taggers: Optional[List[str]] = None,
+        store_html_in_metadata: Optional[bool] = False,
+        skip_no_pre_taggers: Optional[bool] = False,
+        skip_no_post_taggers: Optional[bool] = False,
+    ):
+        self.source_name = source_name
+        self.source_version = source_version
+
+        # create any tagger that runs before html extraction
+        self.pre_taggers = {make_variable_name(name): TaggerRegistry.get(name)() for name in pre_taggers or []}
+
+        # create the html extractor
+        self.linearizer = LinearizerRegistry.get(linearizer_name or "resiliparse")()
+
+        # create any tagger that runs after html extraction
+        self.post_taggers = {make_variable_name(name): TaggerRegistry.get(name)() for name in post_taggers or []}
+
+        # whether to store html in metadata after extraction
+        self.store_html_in_metadata = bool(store_html_in_metadata)
+
+        # whether to skip this document if pre-taggers or post-taggers find nothing
+        self.skip_no_pre_taggers = bool(skip_no_pre_taggers)
+        self.skip_no_post_taggers = bool(skip_no_post_taggers)
+
+        # url normalizer
+        self.url_normalizer = UrlNormalizer()
+
+        # decodes payloads; caches the charset of each host, so it is reset by start_file
+        self.charset_resolver = CharsetResolver()
+
+        # encoder
+        self.encoder = msgspec.json.Encoder()
+
+    def start_file(self):
+        """Forget the charsets of hosts seen so far; call before extracting records from another WARC file."""
+        self.charset_resolver = CharsetResolver()
+
+    def __call__(self, record: WarcRawRecord, date_added: str) -> Optional[bytes]:
+        """Return the document extracted from record as a JSON line, or None if the record is skipped."""
+
+        # handling decoding here; we try cheap ways of finding the charset (http headers, meta
+        # tags, utf-8, other pages of the same host), and only if they fail, we use the
+        # charset_normalizer library to detect the encoding (slow)
+        decoded_content = self.charset_resolver(
+            record.content, http_charset=record.http_charset, url=record.target_uri
+        ).strip()
+        if not decoded_content:
+            return None
+
+        # metadata
+        ctype, *_ = record.content_type.split(";")
+        date = WarcProcessor._parse_warc_timestamp(record.http_date)
+        payload_id = record.payload_digest.split(":")[1].lower()
+        metadata = dict(
+            warc_url=record.target_uri,
+            url=self.url_normalizer(record.target_uri),
+            html=decoded_content,
+            warc_date=WarcProcessor._format_to_dolma_timestamp(record.warc_date),
+            warc_filename=record.warc_filename or "",
+            content_type=ctype,
+            uncompressed_offset=record.stream_pos,
+        )
+        doc = InputSpecWithMetadataAndAttributes(
+            source=self.source_name,
+            version=self.source_version,
+            id=payload_id,
+            text="",  # this will come later
+            metadata=metadata,
+        )
+
+        # these are the properties extracted from
+        pre_attributes = {name: tagger.tag(doc) for name, tagger in self.pre_taggers.items()}
+        if self.skip_no_pre_taggers and not sum(map(len, pre_attributes.values())):
+            return None
+
+        # extract text
+        doc.text = self.linearizer.linearize(content=decoded_content)
+
+        # these are the properties extracted from the HTML content
+        post_attributes = {name: tagger.tag(doc) for name, tagger in self.post_taggers.items()}
+        if self.skip_no_post_taggers and not sum(map(len, post_attributes.values())):
+            return None
+
+        doc.attributes = {
+            f"{t_name}__{t_name}__{make_variable_name(a_name)}": attr_values
+            for t_name, attributes in chain(pre_attributes.items(), post_attributes.items())
+            for a_name, attr_values in attributes.items()
+        }
+
+        doc.created = WarcProcessor._format_to_dolma_timestamp(date)
+        doc.added = date_added
+
+        if not self.store_html_in_metadata:
+            doc.metadata.pop("html", None)  # type: ignore
+
+        return self.encoder.encode(doc) + b"\n"  # pyright: ignore
+
+
+# the pool of extraction workers used when records are processed in parallel, and the arguments its
+# extractors were created with; the pool is created by the first file and shared by all the others
+_EXTRACTION_POOL: Optional["Pool"] = None
+_EXTRACTION_POOL_ARGS: Optional[Dict[str, Any]] = None
+
+
+def _get_extraction_pool(num_processes: int, extractor_kwargs: Dict[str, Any]) -> "Pool":
+    global _EXTRACTION_POOL, _EXTRACTION_POOL_ARGS
+    pool_args = {"num_processes": num_processes, **extractor_kwargs}
+    if _EXTRACTION_POOL is None or _EXTRACTION_POOL_ARGS != pool_args:
+        _close_extraction_pool()
+        _EXTRACTION_POOL = multiprocessing.get_context("spawn").Pool(
+            processes=num_processes, initializer=_init_extraction_worker, initargs=(extractor_kwargs,)
+        )
+        _EXTRACTION_POOL_ARGS = pool_args
+    return _EXTRACTION_POOL
+
+
+def _close_extraction_pool():
+    global _EXTRACTION_POOL, _EXTRACTION_POOL_ARGS
+    if _EXTRACTION_POOL is not None:
+        _EXTRACTION_POOL.terminate()
+        _EXTRACTION_POOL.join()
+    _EXTRACTION_POOL = _EXTRACTION_POOL_ARGS = None
+
+
+# the extractor of each worker process when records are processed in parallel, and the file its last
+# records came from
+_WORKER_EXTRACTOR: Optional[WarcRecordExtractor] = None
+_WORKER_FILE_KEY: Optional[str] = None
+
+
+def _init_extraction_worker(extractor_kwargs: Dict[str, Any]):
+    global _WORKER_EXTRACTOR
+    _WORKER_EXTRACTOR = WarcRecordExtractor(**extractor_kwargs)
+
+
+def _extract_batch(records: List[WarcRawRecord], date_added: str, file_key: str) -> List[Optional[bytes]]:
+    global _WORKER_FILE_KEY
+    assert _WORKER_EXTRACTOR is not None, "worker was not initialized"
+    if file_key != _WORKER_FILE_KEY:
+        _WORKER_EXTRACTOR.start_file()
+        _WORKER_FILE_KEY = file_key
+    return [_WORKER_EXTRACTOR(record, date_added=date_added) for record in records]
+
 
 def create_and_run_warc_pipeline(
     documents: Union[str, List[str]],
@@ -241,12 +466,19 @@ def create_and_run_warc_pipeline(
     skip_on_failure: bool = False,
     retries_on_error: int = 0,
     num_processes: int = 1,
+    parallel_records: bool = False,
     pre_taggers: Optional[List[str]] = None,
     linearizer_name: str = "resiliparse",
     post_taggers: Optional[List[str]] = None,
     store_html_in_metadata: bool = False,
     skip_no_pre_taggers: bool = False,
     skip_no_post_taggers: bool = False,
+    allowed_content_types: Optional[List[str]] = None,
+    allowed_status_codes: Optional[List[int]] = None,
+    blocked_domains: Optional[List[str]] = None,
+    blocked_url_patterns: Optional[List[str]] = None,
+    min_content_length: Optional[int] = None,
+    max_content_length: Optional[int] = None,
 ):
     with ExitStack() as stack:
         if metadata is None:
@@ -292,6 +524,7 @@ def create_and_run_warc_pipeline(
             ignore_existing=ignore_existing,
             retries_on_error=retries_on_error,
             num_processes=num_processes,
+            parallel_records=parallel_records,
         )
         processor(
             skip_on_failure=skip_on_failure,
@@ -301,5 +534,11 @@ def create_and_run_warc_pipeline(
             post_taggers=post_taggers,
             skip_no_pre_taggers=skip_no_pre_taggers,
             skip_no_post_taggers=skip_no_post_taggers,
+            allowed_content_types=allowed_content_types,
+            allowed_status_codes=allowed_status_codes,
+            blocked_domains=blocked_domains,
+            blocked_url_patterns=blocked_url_patterns,
+            min_content_length=min_content_length,
+            max_content_length=max_content_length,
             source_name=source_name,
         )
@@ -1,6 +1,11 @@
+import codecs
+import datetime
 import re
-from typing import TYPE_CHECKING
+from functools import lru_cache
+from typing import TYPE_CHECKING, Dict, Iterator, Optional, Tuple
+from urllib.parse import urlsplit
 
+from charset_normalizer import detect
 from necessary import necessary
 
 from ..core.errors import DolmaFatalError
@@ -14,6 +19,88 @@ with necessary("url_normalize", soft=True) as URL_NORMALIZE_AVAILABLE:
         from url_normalize import url_normalize  # noqa: F401
 
 
+MONTHS = {
+    name: number
+    for number, names in enumerate(
+        [
+            ("jan", "january"),
+            ("feb", "february"),
+            ("mar", "march"),
+            ("apr", "april"),
+            ("may", "may"),
+            ("jun", "june"),
+            ("jul", "july"),
+            ("aug", "august"),
+            ("sep", "september"),
+            ("oct", "october"),
+            ("nov", "november"),
+            ("dec", "december"),
+        ],
+        start=1,
+    )
+    for name in names
+}
+
+# a common time zone name or a numeric offset; dates are kept in the time zone they are written in
+_TZ = r"(?:\s*(?:gmt|utc|ut|z|[ecmp][sd]t|[+-]\d{2}:?\d{2}))?"
+_TIME = r"(?P<hour>\d{1,2}):(?P<minute>\d{2})(?::(?P<second>\d{2}))?"
+
+# RFC 7231 (Sun, 06 Nov 1994 08:49:37 GMT) and RFC 850 (Sunday, 06-Nov-94 08:49:37 GMT) dates
+RFC_DATE_REGEX = re.compile(
+    rf"(?:[a-z]+,?\s+)?(?P<day>\d{{1,2}})[\s-]+(?P<month>[a-z]+)[\s-]+(?P<year>\d{{4}}|\d{{2}})\s+{_TIME}{_TZ}",
+    re.IGNORECASE,
+)
+# asctime dates, e.g. Sun Nov  6 08:49:37 1994
+ASCTIME_DATE_REGEX = re.compile(
+    rf"[a-z]+\s+(?P<month>[a-z]+)\s+(?P<day>\d{{1,2}})\s+{_TIME}\s+(?P<year>\d{{4}}){_TZ}",
+    re.IGNORECASE,
+)
+# ISO-8601 dates, e.g. 1994-11-06T08:49:37Z or 1994-11-06 08:49:37.123+01:00
+ISO_DATE_REGEX = re.compile(
+    rf"(?P<year>\d{{4}})-(?P<month>\d{{2}})-(?P<day>\d{{2}})[t ]{_TIME}(?:[.,](?P<fraction>\d+))?(?:z|{_TZ})",
+    re.IGNORECASE,
+)
+
+
+@lru_cache(maxsize=1 << 12)
+def parse_http_date(date_str: str) -> Optional[datetime.datetime]:
+    """Parse the dates found in HTTP and WARC headers (RFC 7231, RFC 850, asctime, and ISO-8601 formats)
+    into naive datetimes with the date and time as written, ignoring the time zone.
+
+    Returns None if the string is in none of these formats or is not a valid date. Results are cached, as
+    records fetched around the same time share the same date header."""
+    date_str = date_str.strip()
+    for regex in (RFC_DATE_REGEX, ISO_DATE_REGEX, ASCTIME_DATE_REGEX):
+        if match := regex.fullmatch(date_str):
+            break
+    else:
+        return None
+
+    month = match.group("month")
+    month_number = int(month) if month.isdigit() else MONTHS.get(month.lower())
+    if month_number is None:
+        return None
+
+    year = int(match.group("year"))
+    if len(match.group("year")) == 2:
+        # same as strptime's %y: 69-99 are in the 1900s, 00-68 in the 2000s
+        year += 1900 if year >= 69 else 2000
+
+    fraction = match.groupdict().get("fraction") or ""
+    try:
+        return datetime.datetime(
+            year=year,
+            month=month_number,
+            day=int(match.group("day")),
+            hour=int(match.group("hour")),
+            minute=int(match.group("minute")),
+            second=int(match.group("second") or 0),
+            microsecond=int(fraction[:6].ljust(6, "0")) if fraction else 0,
+        )
+    except ValueError:
+        return None
+
+
 def raise_warc_dependency_error(package: str):
     """Raise an error indicating that a package is required to run this processor."""
     raise DolmaFatalError(
@@ -44,3 +131,83 @@ class UrlNormalizer:
         normalized = self.www_subdomain_regex.sub("", normalized)
 
         return normalized
+
+
+class CharsetResolver:
+    """Decode the payload of WARC response records, finding their charset as cheaply as possible.
+
+    The charset declared in the HTTP headers is tried first; if it is missing or wrong, the resolver tries,
+    in order, the charset declared in a <meta> tag near the start of the document, UTF-8, the last charset
+    other than UTF-8 that worked for the same host, and finally the charset charset_normalizer detects on a
+    prefix of the payload (or, if that does not decode the whole payload, on all of it). A candidate is only
+    accepted if it decodes the payload without errors.
+
+    A resolver keeps a cache of host to charset, so it should be created once per WARC file.
+    """
+
+    META_SNIFF_BYTES = 4096
+    DETECT_PREFIX_BYTES = 1 << 16
+    META_CHARSET_REGEX = re.compile(rb"<meta[^>]*?charset\s*=\s*[\"']?\s*([a-zA-Z0-9_.:-]+)", re.IGNORECASE)
+
+    def __init__(self):
+        self.host_charsets: Dict[str, str] = {}
+
+    @staticmethod
+    def _decode(content: bytes, charset: Optional[str]) -> Optional[str]:
+        if not charset:
+            return None
+        try:
+            return content.decode(charset)
+        except (UnicodeDecodeError, LookupError):
+            return None
+
+    @staticmethod
+    def _canonical_name(charset: str) -> str:
+        try:
+            return codecs.lookup(charset).name
+        except LookupError:
+            return charset
+
+    def sniff_meta_charset(self, content: bytes) -> Optional[str]:
+        """Return the charset declared in a <meta charset> or <meta http-equiv> tag, if any."""
+        if not (match := self.META_CHARSET_REGEX.search(content, 0, self.META_SNIFF_BYTES)):
+            return None
+        charset = match.group(1).decode("ascii")
+        # a document whose <meta> tag can be read as ASCII is not UTF-16, whatever it claims (see the WHATWG
+        # encoding sniffing algorithm); UTF-8 is what browsers use instead
+        return "utf-8" if charset.lower().startswith("utf-16") else charset
+
+    def _detect(self, content: bytes) -> Tuple[Optional[str], Optional[str]]:
+        if len(content) > self.DETECT_PREFIX_BYTES:
+            charset = detect(content[: self.DETECT_PREFIX_BYTES])["encoding"]
+            if (decoded := self._decode(content, charset)) is not None:
+                return decoded, charset
+        charset = detect(content)["encoding"]
+        return self._decode(content, charset), charset
+
+    def _candidates(self, content: bytes, http_charset: Optional[str], host: str) -> Iterator[Optional[str]]:
+        yield http_charset
+        yield self.sniff_meta_charset(content)
+        yield "utf-8"
+        yield self.host_charsets.get(host)
+
+    def __call__(self, content: bytes, http_charset: Optional[str] = None, url: Optional[str] = None) -> str:
+        """Decode content, returning an empty string if no charset decodes it."""
+        try:
+            host = (urlsplit(url.strip("<>")).hostname or "") if url else ""
+        except ValueError:
+            host = ""
+
+        for charset in self._candidates(content, http_charset, host):
+            if (decoded := self._decode(content, charset)) is not None:
+                break
+        else:
+            decoded, charset = self._detect(content)
+
+        if decoded is None or charset is None:
+            return ""
+
+        # UTF-8 is always tried before the cache, so caching it would only evict a more useful charset
+        if host and (charset := self._canonical_name(charset)) != "utf-8":
+            self.host_charsets[host] = charset
+        return decoded
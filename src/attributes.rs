@@ -0,0 +1,494 @@
+// Joining attribute files with the document files they were computed for.
+//
+// Taggers write one attribute row for each document, in the same order as the documents, so the
+// default is to read attribute files in lockstep with the documents, and fail if ids don't match.
+// When rows might be missing or out of order (e.g. because attributes came from a different tool),
+// attributes can instead be joined on document id:
+// - `sorted`: documents and attribute rows are both sorted by id; the two are stream-merged, and
+//   documents without a match are skipped. Rows without a match are kept in the hash join buffer
+//   described below, so that if either turns out to be out of order, the reader falls back to the
+//   hash join for the remaining documents without losing any row. Documents the stream merge has
+//   already found no row for are not joined again, so `hash` should be used if rows are not
+//   expected to be sorted.
+// - `hash`: no order is assumed. As long as rows line up with documents, they are read in lockstep;
+//   otherwise, rows are read ahead and buffered in a hash table until the row for the current
+//   document is found. Once more than `max_buffered_rows` rows are buffered, further rows are
+//   spilled to a file on disk, and only their offsets are kept in memory.
+
+use std::cmp::Ordering;
+use std::collections::HashMap;
+use std::fs::{File, OpenOptions};
+use std::io::{BufWriter, Error as IoError, ErrorKind as IoErrorKind, Read, Seek, SeekFrom, Write};
+use std::path::{Path, PathBuf};
+
+use serde::Deserialize;
+use serde_json::{Map, Value};
+
+pub const DEFAULT_MAX_BUFFERED_ROWS: usize = 100_000;
+
+#[derive(Clone, Copy, Debug, PartialEq)]
+pub enum JoinStrategy {
+    Lockstep,
+    Sorted,
+    Hash,
+}
+
+impl JoinStrategy {
+    pub fn new(strategy: Option<&str>) -> Result<JoinStrategy, IoError> {
+        match strategy {
+            None | Some("lockstep") => Ok(JoinStrategy::Lockstep),
+            Some("sorted") => Ok(JoinStrategy::Sorted),
+            Some("hash") => Ok(JoinStrategy::Hash),
+            Some(s) => Err(IoError::new(
+                IoErrorKind::Other,
+                format!(
+                    "Invalid join strategy: {}; expected lockstep, sorted, or hash.",
+                    s
+                ),
+            )),
+        }
+    }
+}
+
+// Only the id and attributes of a row are parsed; other fields (e.g. source) are skipped.
+#[derive(Deserialize)]
+struct AttributeRow {
+    #[serde(default)]
+    id: Value,
+    #[serde(default)]
+    attributes: Value,
+}
+
+// Order of ids for the sorted join: strings and numbers are compared by value, anything else
+// by its JSON representation.
+fn compare_ids(a: &Value, b: &Value) -> Ordering {
+    match (a, b) {
+        (Value::String(a), Value::String(b)) => a.cmp(b),
+        (Value::Number(a), Value::Number(b)) => match (a.as_u64(), b.as_u64()) {
+            (Some(a), Some(b)) => a.cmp(&b),
+            _ => a
+                .as_f64()
+                .partial_cmp(&b.as_f64())
+                .unwrap_or(Ordering::Equal),
+        },
+        _ => a.to_string().cmp(&b.to_string()),
+    }
+}
+
+struct Spill {
+    path: PathBuf,
+    writer: BufWriter<File>,
+    reader: File,
+    offset: u64,
+    index: HashMap<String, (u64, usize)>,
+}
+
+impl Spill {
+    fn new(path: &Path) -> Result<Spill, IoError> {
+        if let Some(parent) = path.parent() {
+            std::fs::create_dir_all(parent)?;
+        }
+        let file = OpenOptions::new()
+            .read(true)
+            .write(true)
+            .create(true)
+            .truncate(true)
+            .open(path)?;
+        Ok(Spill {
+            path: path.to_path_buf(),
+            reader: file.try_clone()?,
+            writer: BufWriter::new(file),
+            offset: 0,
+            index: HashMap::new(),
+        })
+    }
+
+    fn put(&mut self, key: String, attributes: &Map<String, Value>) -> Result<(), IoError> {
+        let encoded = serde_json::to_vec(attributes)?;
+        self.writer.write_all(&encoded)?;
+        self.index.insert(key, (self.offset, encoded.len()));
+        self.offset += encoded.len() as u64;
+        Ok(())
+    }
+
+    fn take(&mut self, key: &str) -> Result<Option<Map<String, Value>>, IoError> {
+        match self.index.remove(key) {
+            Some((offset, len)) => {
+                self.writer.flush()?;
+                self.reader.seek(SeekFrom::Start(offset))?;
+                let mut encoded = vec![0; len];
+                self.reader.read_exact(&mut encoded)?;
+                // reader and writer share the file cursor; move it back to the end for later puts
+                self.reader.seek(SeekFrom::Start(self.offset))?;
+                Ok(Some(serde_json::from_slice(&encoded)?))
+            }
+            None => Ok(None),
+        }
+    }
+}
+
+impl Drop for Spill {
+    fn drop(&mut self) {
+        let _ = std::fs::remove_file(&self.path);
+    }
+}
+
+pub struct AttributeReader<I: Iterator<Item = Result<String, IoError>>> {
+    name: String,
+    lines: I,
+    strategy: JoinStrategy,
+    exhausted: bool,
+    // sorted join: next row, which is past the current document, and the last ids seen
+    pending: Option<(Value, Map<String, Value>)>,
+    last_row_id: Option<Value>,
+    last_doc_id: Option<Value>,
+    // hash join: rows read ahead of the documents they belong to
+    buffered: HashMap<String, Map<String, Value>>,
+    max_buffered_rows: usize,
+    spill: Option<Spill>,
+    spill_path: PathBuf,
+    pub rows_read: usize,
+    pub rows_joined: usize,
+}
+
+impl<I: Iterator<Item = Result<String, IoError>>> AttributeReader<I> {
+    // `name` is used in log and error messages; `spill_path` is only created if the hash join
+    // needs to buffer more than `max_buffered_rows` rows.
+    pub fn new(
+        name: &str,
+        lines: I,
+        strategy: JoinStrategy,
+        max_buffered_rows: Option<usize>,
+        spill_path: PathBuf,
+    ) -> AttributeReader<I> {
+        AttributeReader {
+            name: name.to_string(),
+            lines,
+            strategy,
+            exhausted: false,
+            pending: None,
+            last_row_id: None,
+            last_doc_id: None,
+            buffered: HashMap::new(),
+            max_buffered_rows: max_buffered_rows.unwrap_or(DEFAULT_MAX_BUFFERED_ROWS),
+            spill: None,
+            spill_path,
+            rows_read: 0,
+            rows_joined: 0,
+        }
+    }
+
+    // Rows that have been read, but have not been joined with any document.
+    pub fn rows_unmatched(&self) -> usize {
+        self.rows_read - self.rows_joined
+    }
+
+    fn next_row(&mut self) -> Result<Option<(Value, Map<String, Value>)>, IoError> {
+        if self.exhausted {
+            return Ok(None);
+        }
+        match self.lines.next() {
+            Some(Ok(line)) => {
+                self.rows_read += 1;
+                let row: AttributeRow = serde_json::from_str(&line)?;
+                match row.attributes {
+                    Value::Object(attributes) => Ok(Some((row.id, attributes))),
+                    _ => Err(IoError::new(
+                        IoErrorKind::Other,
+                        format!("Missing attributes for id {} in {}", row.id, self.name),
+                    )),
+                }
+            }
+            Some(Err(e)) => {
+                log::warn!("Error reading attributes from {}: {}", self.name, e);
+                self.exhausted = true;
+                Ok(None)
+            }
+            None => {
+                self.exhausted = true;
+                Ok(None)
+            }
+        }
+    }
+
+    // Return the attributes for the document with the given id, or None if there are none.
+    pub fn attributes_for(&mut self, id: &Value) -> Result<Option<Map<String, Value>>, IoError> {
+        let attributes = match self.strategy {
+            JoinStrategy::Lockstep => self.lockstep(id)?,
+            JoinStrategy::Sorted => self.sorted(id)?,
+            JoinStrategy::Hash => self.hash(id)?,
+        };
+        if attributes.is_some() {
+            self.rows_joined += 1;
+        }
+        Ok(attributes)
+    }
+
+    fn lockstep(&mut self, id: &Value) -> Result<Option<Map<String, Value>>, IoError> {
+        match self.next_row()? {
+            Some((row_id, attributes)) if &row_id == id => Ok(Some(attributes)),
+            Some((row_id, _)) => Err(IoError::new(
+                IoErrorKind::Other,
+                format!("Mismatched ids in {}: {} != {}", self.name, row_id, id),
+            )),
+            None => Ok(None),
+        }
+    }
+
+    fn sorted(&mut self, id: &Value) -> Result<Option<Map<String, Value>>, IoError> {
+        if let Some(last_doc_id) = self.last_doc_id.as_ref() {
+            if compare_ids(last_doc_id, id) == Ordering::Greater {
+                let reason = format!(
+                    "documents are not sorted by id ({} after {})",
+                    id, last_doc_id
+                );
+                return self.fall_back_to_hash(id, &reason);
+            }
+        }
+        self.last_doc_id = Some(id.clone());
+
+        loop {
+            let (row_id, attributes) = match self.pending.take() {
+                Some(row) => row,
+                None => match self.next_row()? {
+                    Some(row) => {
+                        if let Some(last_row_id) = self.last_row_id.as_ref() {
+                            if compare_ids(last_row_id, &row.0) != Ordering::Less {
+                                let reason = format!(
+                                    "rows are not sorted by id ({} after {})",
+                                    row.0, last_row_id
+                                );
+                                self.pending = Some(row);
+                                return self.fall_back_to_hash(id, &reason);
+                            }
+                        }
+                        self.last_row_id = Some(row.0.clone());
+                        row
+                    }
+                    None => return Ok(None),
+                },
+            };
+            match compare_ids(&row_id, id) {
+                Ordering::Equal => return Ok(Some(attributes)),
+                // no document for this row so far; it is kept in case documents are not sorted
+                Ordering::Less => self.buffer_row(row_id, attributes)?,
+                // no row for this document; the row might be for the next one
+                Ordering::Greater => {
+                    self.pending = Some((row_id, attributes));
+                    return Ok(None);
+                }
+            }
+        }
+    }
+
+    // Switch from the sorted join to the hash join, starting with the document with the given id.
+    // Rows the sorted join skipped are already buffered; the row it was holding is added to them.
+    fn fall_back_to_hash(
+        &mut self,
+        id: &Value,
+        reason: &str,
+    ) -> Result<Option<Map<String, Value>>, IoError> {
+        log::info!("Joining {} with the hash join: {}", self.name, reason);
+        self.strategy = JoinStrategy::Hash;
+        if let Some((row_id, attributes)) = self.pending.take() {
+            self.buffer_row(row_id, attributes)?;
+        }
+        self.hash(id)
+    }
+
+    fn hash(&mut self, id: &Value) -> Result<Option<Map<String, Value>>, IoError> {
+        // rows might have been read ahead for this document
+        if !self.buffered.is_empty() || self.spill.is_some() {
+            let key = id.to_string();
+            if let Some(attributes) = self.buffered.remove(&key) {
+                return Ok(Some(attributes));
+            }
+            if let Some(attributes) = self.spill.as_mut().map(|s| s.take(&key)).transpose()? {
+                if attributes.is_some() {
+                    return Ok(attributes);
+                }
+            }
+        }
+
+        while let Some((row_id, attributes)) = self.next_row()? {
+            if &row_id == id {
+                return Ok(Some(attributes));
+            }
+            self.buffer_row(row_id, attributes)?;
+        }
+        Ok(None)
+    }
+
+    // Keep a row for a later document, in memory or, past `max_buffered_rows` rows, on disk.
+    fn buffer_row(&mut self, row_id: Value, attributes: Map<String, Value>) -> Result<(), IoError> {
+        if self.buffered.len() < self.max_buffered_rows {
+            self.buffered.insert(row_id.to_string(), attributes);
+            return Ok(());
+        }
+        if self.spill.is_none() {
+            log::info!(
+                "Buffered {} rows of {}; spilling to {}",
+                self.buffered.len(),
+                self.name,
+                self.spill_path.display()
+            );
+            self.spill = Some(Spill::new(&self.spill_path)?);
+        }
+        self.spill
+            .as_mut()
+            .unwrap()
+            .put(row_id.to_string(), &attributes)
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use serde_json::json;
+
+    fn rows(ids: &[&str]) -> std::vec::IntoIter<Result<String, IoError>> {
+        ids.iter()
+            .map(|id| Ok(json!({"id": id, "attributes": {"attr": [[0, 1, id]]}}).to_string()))
+            .collect::<Vec<_>>()
+            .into_iter()
+    }
+
+    fn reader(
+        ids: &[&str],
+        strategy: JoinStrategy,
+        max_buffered_rows: Option<usize>,
+    ) -> AttributeReader<std::vec::IntoIter<Result<String, IoError>>> {
+        let spill_path = std::env::temp_dir().join(format!(
+            "attributes-test-{}-{:?}-{}.spill",
+            std::process::id(),
+            strategy,
+            ids.join("")
+        ));
+        AttributeReader::new("test", rows(ids), strategy, max_buffered_rows, spill_path)
+    }
+
+    fn join(
+        reader: &mut AttributeReader<std::vec::IntoIter<Result<String, IoError>>>,
+        ids: &[&str],
+    ) -> Result<Vec<Option<String>>, IoError> {
+        ids.iter()
+            .map(|id| {
+                reader.attributes_for(&json!(id)).map(|attributes| {
+                    attributes.map(|a| a["attr"][0][2].as_str().unwrap().to_string())
+                })
+            })
+            .collect()
+    }
+
+    fn expected(ids: &[Option<&str>]) -> Vec<Option<String>> {
+        ids.iter().map(|id| id.map(|s| s.to_string())).collect()
+    }
+
+    #[test]
+    fn test_lockstep() {
+        let mut r = reader(&["a", "b", "c"], JoinStrategy::Lockstep, None);
+        assert_eq!(
+            join(&mut r, &["a", "b"]).unwrap(),
+            expected(&[Some("a"), Some("b")])
+        );
+        assert!(join(&mut r, &["d"]).is_err());
+
+        let mut r = reader(&["a"], JoinStrategy::Lockstep, None);
+        assert_eq!(
+            join(&mut r, &["a", "b"]).unwrap(),
+            expected(&[Some("a"), None])
+        );
+    }
+
+    #[test]
+    fn test_sorted() {
+        let mut r = reader(&["a", "c", "d", "f"], JoinStrategy::Sorted, None);
+        assert_eq!(
+            join(&mut r, &["a", "b", "c", "e", "f", "g"]).unwrap(),
+            expected(&[Some("a"), None, Some("c"), None, Some("f"), None])
+        );
+        assert_eq!(r.rows_unmatched(), 1);
+
+        // documents out of order: rows skipped so far are still joined
+        let mut r = reader(&["a", "b", "c"], JoinStrategy::Sorted, None);
+        assert_eq!(
+            join(&mut r, &["b", "a", "c"]).unwrap(),
+            expected(&[Some("b"), Some("a"), Some("c")])
+        );
+        assert_eq!(r.strategy, JoinStrategy::Hash);
+
+        // rows out of order; "a" comes after "b", so it is only found after "a" was already joined
+        let mut r = reader(&["b", "a", "d", "c"], JoinStrategy::Sorted, None);
+        assert_eq!(
+            join(&mut r, &["a", "b", "c", "d", "e"]).unwrap(),
+            expected(&[None, Some("b"), Some("c"), Some("d"), None])
+        );
+        assert_eq!(r.strategy, JoinStrategy::Hash);
+        assert_eq!(r.rows_unmatched(), 1);
+
+        // skipped rows are spilled to disk past max_buffered_rows, and read back after falling back
+        let mut r = reader(&["a", "b", "c", "d", "e"], JoinStrategy::Sorted, Some(1));
+        assert_eq!(
+            join(&mut r, &["e", "c", "a", "d", "f"]).unwrap(),
+            expected(&[Some("e"), Some("c"), Some("a"), Some("d"), None])
+        );
+        assert!(r.spill.is_some());
+        assert_eq!(r.rows_unmatched(), 1);
+    }
+
+    // the joins of the mixer tests in test_mixer.py, on documents "0" to "4"
+    #[test]
+    fn test_mixer_joins() {
+        let docs = ["0", "1", "2", "3", "4"];
+        let all = expected(&[Some("0"), Some("1"), None, Some("3"), Some("4")]);
+        for max_buffered_rows in [None, Some(1)] {
+            let mut r = reader(
+                &["3", "0", "9", "4", "1"],
+                JoinStrategy::Hash,
+                max_buffered_rows,
+            );
+            assert_eq!(join(&mut r, &docs).unwrap(), all);
+        }
+
+        let mut r = reader(&["0", "1", "3", "4", "9"], JoinStrategy::Sorted, None);
+        assert_eq!(join(&mut r, &docs).unwrap(), all);
+        let mut r = reader(&["3", "0", "4"], JoinStrategy::Sorted, None);
+        assert_eq!(
+            join(&mut r, &docs).unwrap(),
+            expected(&[None, None, None, Some("3"), Some("4")])
+        );
+
+        let mut r = reader(&["3", "0", "9", "4", "1"], JoinStrategy::Lockstep, None);
+        assert!(join(&mut r, &docs).is_err());
+    }
+
+    #[test]
+    fn test_hash() {
+        let docs = ["a", "b", "c", "d", "e", "f"];
+        let attrs = ["a", "c", "b", "f", "e", "x", "a2"];
+        let want = expected(&[Some("a"), Some("b"), Some("c"), None, Some("e"), Some("f")]);
+
+        // everything buffered in memory
+        let mut r = reader(&attrs, JoinStrategy::Hash, None);
+        assert_eq!(join(&mut r, &docs).unwrap(), want);
+        assert!(r.spill.is_none());
+
+        // most rows spilled to disk
+        let mut r = reader(&attrs, JoinStrategy::Hash, Some(1));
+        assert_eq!(join(&mut r, &docs).unwrap(), want);
+        let spill_path = r.spill.as_ref().unwrap().path.clone();
+        assert!(spill_path.exists());
+        assert_eq!(r.rows_unmatched(), 2);
+        drop(r);
+        assert!(!spill_path.exists());
+
+        // rows are spilled after others have been read back from the spill file
+        let docs = ["a", "b", "c", "x", "d", "e"];
+        let attrs = ["b", "c", "d", "a", "y", "z", "e"];
+        let mut r = reader(&attrs, JoinStrategy::Hash, Some(1));
+        assert_eq!(
+            join(&mut r, &docs).unwrap(),
+            expected(&[Some("a"), Some("b"), Some("c"), None, Some("d"), Some("e")])
+        );
+    }
+}
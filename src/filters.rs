@@ -1,5 +1,7 @@
+use std::cell::RefCell;
 use std::io;
 
+use crate::native_filter::NativeFilter;
 use crate::shard::shard_config::{FilterConfig, SpanReplacementConfig};
 use jaq_interpret::{Ctx, Filter, FilterT, ParseCtx, RcIter, Val};
 use jaq_std;
@@ -83,35 +85,37 @@ impl JqSelector {
 
 pub struct JsonPathSelector {
     pub path: String,
+    // the path is parsed once; each document is swapped into the finder before it is searched
+    finder: RefCell<JsonPathFinder>,
 }
 
 impl JsonPathSelector {
     pub fn new(path: &str) -> Result<JsonPathSelector, io::Error> {
+        let finder = JsonPathFinder::from_str("{}", path).map_err(|e| {
+            io::Error::new(
+                io::ErrorKind::Other,
+                format!("Error making selector {} into path: {:?}", path, e),
+            )
+        })?;
         Ok(JsonPathSelector {
             path: path.to_string(),
+            finder: RefCell::new(finder),
         })
     }
 
     pub fn select(&self, json: &Value) -> Result<Value, io::Error> {
-        match JsonPathFinder::from_str("{}", &self.path) {
-            Ok(mut finder) => {
-                finder.set_json(Box::new(json.clone()));
-                match finder.find() {
-                    Value::Array(arr) => match arr.len() {
-                        0 => Ok(Value::Null),
-                        1 => Ok(arr[0].clone()),
-                        _ => Ok(Value::from(arr)),
-                    },
-                    Value::Null => Ok(Value::Null),
-                    _ => Err(io::Error::new(
-                        io::ErrorKind::Other,
-                        format!("Error evaluating filter: {:?}", self.path),
-                    )),
-                }
-            }
-            Err(e) => Err(io::Error::new(
+        let mut finder = self.finder.borrow_mut();
+        finder.set_json(Box::new(json.clone()));
+        match finder.find() {
+            Value::Array(arr) => match arr.len() {
+                0 => Ok(Value::Null),
+                1 => Ok(arr[0].clone()),
+                _ => Ok(Value::from(arr)),
+            },
+            Value::Null => Ok(Value::Null),
+            _ => Err(io::Error::new(
                 io::ErrorKind::Other,
-                format!("Error evaluating filter: {:?}", e),
+                format!("Error evaluating filter: {:?}", self.path),
             )),
         }
     }
@@ -120,14 +124,19 @@ impl JsonPathSelector {
 pub enum Selector {
     JqSelector(JqSelector),
     JsonPathSelector(JsonPathSelector),
+    NativeSelector(NativeFilter),
 }
 
 impl Selector {
     pub fn new(selector_config: &SpanReplacementConfig) -> Result<Selector, io::Error> {
         match selector_config.syntax.as_deref() {
-            Some("jq") => Ok(Selector::JqSelector(JqSelector::new(
-                &selector_config.span,
-            )?)),
+            // simple jq selectors are evaluated natively, without cloning the document
+            Some("jq") => match NativeFilter::compile(&selector_config.span) {
+                Some(selector) => Ok(Selector::NativeSelector(selector)),
+                None => Ok(Selector::JqSelector(JqSelector::new(
+                    &selector_config.span,
+                )?)),
+            },
             Some("jsonpath") | None => Ok(Selector::JsonPathSelector(JsonPathSelector::new(
                 &selector_config.span,
             )?)),
@@ -142,6 +151,14 @@ impl Selector {
         match self {
             Selector::JqSelector(selector) => selector.select(json),
             Selector::JsonPathSelector(selector) => selector.select(json),
+            Selector::NativeSelector(selector) => match selector.evaluate(json) {
+                Ok(Some(val)) => Ok(val.to_value()),
+                Ok(None) => Ok(Value::Null),
+                Err(e) => Err(io::Error::new(
+                    io::ErrorKind::Other,
+                    format!("Error evaluating filter: {}", e),
+                )),
+            },
         }
     }
 }
@@ -247,25 +264,43 @@ pub mod selector_tests {
     }
 }
 
+// A jq filter expression; expressions in the subset supported by `NativeFilter` are
+// evaluated natively, all others with jaq.
+pub enum JqFilter {
+    Native(NativeFilter),
+    Jaq(Filter),
+}
+
 pub struct JqDocFilter {
-    pub include: Vec<Filter>,
-    pub exclude: Vec<Filter>,
+    pub include: Vec<JqFilter>,
+    pub exclude: Vec<JqFilter>,
 }
 
 pub struct JsonPathFilter {
     pub include: Vec<String>,
     pub exclude: Vec<String>,
+    // patterns are parsed once, in the same order as `include` and `exclude`
+    include_finders: Vec<RefCell<JsonPathFinder>>,
+    exclude_finders: Vec<RefCell<JsonPathFinder>>,
 }
 
 impl JqDocFilter {
-    fn parse_filters(filter_strs: Vec<String>) -> Result<Vec<Filter>, io::Error> {
+    // Parse filter expressions; if `native` is false, all expressions are compiled with jaq.
+    fn parse_filters(filter_strs: Vec<String>, native: bool) -> Result<Vec<JqFilter>, io::Error> {
         let mut defs = ParseCtx::new(Vec::new());
         defs.insert_natives(jaq_core::core());
         defs.insert_defs(jaq_std::std());
         assert!(defs.errs.is_empty());
 
-        let mut filters: Vec<Filter> = Vec::new();
+        let mut filters: Vec<JqFilter> = Vec::new();
         for filter_str in filter_strs {
+            if native {
+                if let Some(filter) = NativeFilter::compile(&filter_str) {
+                    filters.push(JqFilter::Native(filter));
+                    continue;
+                }
+            }
+
             let (filter, errs) = jaq_parse::parse(&filter_str, jaq_parse::main());
             if !errs.is_empty() {
                 return Err(io::Error::new(
@@ -283,7 +318,7 @@ impl JqDocFilter {
                         ));
                     }
 
-                    filters.push(filter);
+                    filters.push(JqFilter::Jaq(filter));
                 }
                 None => {
                     return Err(io::Error::new(
@@ -317,43 +352,59 @@ impl JqDocFilter {
     }
 
     pub fn new(filter_config: &FilterConfig) -> Result<JqDocFilter, io::Error> {
-        let include_filters = JqDocFilter::parse_filters(filter_config.include.clone())?;
-        let exclude_filters = JqDocFilter::parse_filters(filter_config.exclude.clone())?;
+        let include_filters = JqDocFilter::parse_filters(filter_config.include.clone(), true)?;
+        let exclude_filters = JqDocFilter::parse_filters(filter_config.exclude.clone(), true)?;
         Ok(JqDocFilter {
             include: include_filters,
             exclude: exclude_filters,
         })
     }
+
+    // Evaluate a filter against a document, returning whether each of its outputs is a match.
+    // The document is converted to a jaq value at most once, and only if a jaq filter needs it.
+    fn evaluate(
+        &self,
+        filter: &JqFilter,
+        json: &Value,
+        jaq_input: &mut Option<Val>,
+    ) -> Result<Vec<bool>, io::Error> {
+        match filter {
+            JqFilter::Native(filter) => match filter.evaluate(json) {
+                Ok(Some(val)) => Ok(vec![val.is_match()]),
+                Ok(None) => Ok(Vec::new()),
+                Err(e) => Err(io::Error::new(
+                    io::ErrorKind::Other,
+                    format!("Error evaluating filter: {}", e),
+                )),
+            },
+            JqFilter::Jaq(filter) => {
+                let input = jaq_input
+                    .get_or_insert_with(|| Val::from(json.clone()))
+                    .clone();
+                let inputs: RcIter<std::iter::Empty<_>> = RcIter::new(core::iter::empty());
+                let matches = filter
+                    .run((Ctx::new(Vec::new(), &inputs), input))
+                    .map(|result| self.evaluate_match(&result))
+                    .collect::<Result<Vec<bool>, io::Error>>();
+                matches
+            }
+        }
+    }
+
     pub fn should_keep(&self, json: &Value) -> Result<bool, io::Error> {
         let mut keep = self.include.is_empty();
+        let mut jaq_input: Option<Val> = None;
 
-        let inputs: RcIter<std::iter::Empty<_>> = RcIter::new(core::iter::empty());
         for filter in self.include.iter() {
             // exit early if keep is already true
             if keep {
                 break;
             }
 
-            let out: Vec<Result<jaq_interpret::Val, jaq_interpret::Error>> = filter
-                .run((Ctx::new(Vec::new(), &inputs), Val::from(json.clone())))
-                .collect();
-
-            // if the filter returns something, evaluate each result and update keep;
-            // keep will be true at the end of the loop if all results are true and the filter is not empty
+            // if the filter returns something, keep will be true if all results are true;
             // if an any point an error is encountered, immediately return the error
-            keep = match out.is_empty() {
-                true => false,
-                false => {
-                    let mut partial_keep = true;
-                    for result in out.iter() {
-                        match self.evaluate_match(result) {
-                            Ok(val) => partial_keep = partial_keep && val,
-                            Err(e) => return Err(e),
-                        }
-                    }
-                    partial_keep
-                }
-            };
+            let matches = self.evaluate(filter, json, &mut jaq_input)?;
+            keep = !matches.is_empty() && matches.iter().all(|m| *m);
         }
 
         for filter in self.exclude.iter() {
@@ -361,25 +412,11 @@ impl JqDocFilter {
             if !keep {
                 break;
             }
-            let out: Vec<_> = filter
-                .run((Ctx::new(Vec::new(), &inputs), Val::from(json.clone())))
-                .collect();
-
-            // if the filter returns nothing, we keep the document; otherwise, evaluate each result
-            // and check if they all evaluate to false; if any result is true, we remove the document
-            keep = match out.is_empty() {
-                true => true,
-                false => {
-                    let mut partial_keep = true;
-                    for result in out.iter() {
-                        match self.evaluate_match(result) {
-                            Ok(val) => partial_keep = partial_keep && !val,
-                            Err(e) => return Err(e),
-                        }
-                    }
-                    partial_keep
-                }
-            };
+
+            // if the filter returns nothing, we keep the document; otherwise, we check if all
+            // results are false; if any result is true, we remove the document
+            let matches = self.evaluate(filter, json, &mut jaq_input)?;
+            keep = matches.iter().all(|m| !*m);
         }
         Ok(keep)
     }
@@ -390,23 +427,34 @@ impl JsonPathFilter {
         Ok(JsonPathFilter {
             include: filter_config.include.clone(),
             exclude: filter_config.exclude.clone(),
+            include_finders: JsonPathFilter::parse_patterns(&filter_config.include, "include")?,
+            exclude_finders: JsonPathFilter::parse_patterns(&filter_config.exclude, "exclude")?,
         })
     }
+
+    fn parse_patterns(
+        patterns: &[String],
+        kind: &str,
+    ) -> Result<Vec<RefCell<JsonPathFinder>>, io::Error> {
+        patterns
+            .iter()
+            .map(|pattern| match JsonPathFinder::from_str("{}", pattern) {
+                Ok(finder) => Ok(RefCell::new(finder)),
+                Err(e) => Err(io::Error::new(
+                    io::ErrorKind::Other,
+                    format!(
+                        "Error making {} pattern {} into filter: {:?}",
+                        kind, pattern, e
+                    ),
+                )),
+            })
+            .collect()
+    }
+
     pub fn should_keep(&self, json: &Value) -> Result<bool, io::Error> {
-        let mut keep = self.include.is_empty();
-        for pattern in self.include.iter() {
-            let mut finder = match JsonPathFinder::from_str("{}", pattern) {
-                Ok(finder) => finder,
-                Err(e) => {
-                    return Err(io::Error::new(
-                        io::ErrorKind::Other,
-                        format!(
-                            "Error making include pattern {} into filter: {:?}",
-                            pattern, e
-                        ),
-                    ))
-                }
-            };
+        let mut keep = self.include_finders.is_empty();
+        for finder in self.include_finders.iter() {
+            let mut finder = finder.borrow_mut();
             finder.set_json(Box::new(json.clone()));
             keep = finder.find() != Value::Null;
             if keep {
@@ -414,19 +462,8 @@ impl JsonPathFilter {
             }
         }
         if keep {
-            for pattern in self.exclude.iter() {
-                let mut finder = match JsonPathFinder::from_str("{}", pattern) {
-                    Ok(finder) => finder,
-                    Err(e) => {
-                        return Err(io::Error::new(
-                            io::ErrorKind::Other,
-                            format!(
-                                "Error making exclude pattern {} into filter: {:?}",
-                                pattern, e
-                            ),
-                        ))
-                    }
-                };
+            for finder in self.exclude_finders.iter() {
+                let mut finder = finder.borrow_mut();
                 finder.set_json(Box::new(json.clone()));
                 keep = finder.find() == Value::Null;
                 if !keep {
@@ -471,6 +508,33 @@ impl DocFilter {
             None => Ok(DocFilter::AllowAll(AllowAllFilter::new()?)),
         }
     }
+    // Whether the filter only needs the `attributes` of a document to decide whether to keep it;
+    // jaq expressions and JSONPath patterns that can't be analyzed are assumed to need more.
+    pub fn only_reads_attributes(&self) -> bool {
+        match self {
+            DocFilter::Jq(f) => {
+                f.include
+                    .iter()
+                    .chain(f.exclude.iter())
+                    .all(|filter| match filter {
+                        JqFilter::Native(filter) => filter.only_reads("attributes"),
+                        JqFilter::Jaq(_) => false,
+                    })
+            }
+            DocFilter::JsonPath(f) => f.include.iter().chain(f.exclude.iter()).all(|pattern| {
+                match pattern.strip_prefix("$.attributes") {
+                    // `$` inside a pattern refers to the document root again
+                    Some(rest) => {
+                        (rest.is_empty() || rest.starts_with('.') || rest.starts_with('['))
+                            && !rest.contains('$')
+                    }
+                    None => false,
+                }
+            }),
+            DocFilter::AllowAll(_) => true,
+        }
+    }
+
     pub fn should_keep(&self, json: &Value) -> Result<bool, io::Error> {
         match self {
             DocFilter::Jq(f) => f.should_keep(json),
@@ -483,7 +547,10 @@ impl DocFilter {
 #[cfg(test)]
 mod filter_tests {
     use super::*;
+    use flate2::read::MultiGzDecoder;
     use serde_json::json;
+    use std::fs::File;
+    use std::io::{BufRead, BufReader};
 
     #[test]
     fn test_should_keep() {
@@ -662,6 +729,172 @@ mod filter_tests {
         assert_eq!(filters.should_keep(&doc).unwrap(), false);
     }
 
+    #[test]
+    fn test_native_and_jaq_filters() {
+        let filter_config = FilterConfig {
+            include: vec![
+                ".attributes.foo | length >= 3".to_string(),
+                ".attributes.foo | add >= 6".to_string(),
+            ],
+            exclude: vec![
+                ".attributes.baz | any(. > 4.5)".to_string(),
+                ".attributes.missing?.x?".to_string(),
+            ],
+            syntax: Some("jq".to_string()),
+        };
+        let filters = JqDocFilter::new(&filter_config).unwrap();
+        assert!(matches!(filters.include[0], JqFilter::Native(_)));
+        assert!(matches!(filters.include[1], JqFilter::Jaq(_)));
+        assert!(matches!(filters.exclude[0], JqFilter::Native(_)));
+
+        let doc = json!({
+            "attributes": {
+                "foo": [1.0, 2.0],
+                "baz": [4.0, 4.5]
+            }
+        });
+        assert_eq!(filters.should_keep(&doc).unwrap(), false);
+
+        let doc = json!({
+            "attributes": {
+                "foo": [1.0, 2.0, 3.0],
+                "baz": [4.0, 4.5]
+            }
+        });
+        assert_eq!(filters.should_keep(&doc).unwrap(), true);
+
+        let doc = json!({
+            "attributes": {
+                "foo": [1.0, 2.0, 3.0],
+                "baz": [4.0, 5.0]
+            }
+        });
+        assert_eq!(filters.should_keep(&doc).unwrap(), false);
+    }
+
+    // documents in tests/data/provided, with the attributes the mixer tests join to them
+    fn provided_docs() -> Vec<Value> {
+        let read_lines = |path: &str| -> Vec<Value> {
+            BufReader::new(MultiGzDecoder::new(File::open(path).unwrap()))
+                .lines()
+                .map(|line| serde_json::from_str(&line.unwrap()).unwrap())
+                .collect()
+        };
+        let mut docs = read_lines("tests/data/provided/documents/000.json.gz");
+        for name in ["pii", "sample", "toxicity", "duplicate_paragraphs"] {
+            let path = format!("tests/data/provided/attributes/{}/000.json.gz", name);
+            for (doc, attrs) in docs.iter_mut().zip(read_lines(&path)) {
+                assert_eq!(doc["id"], attrs["id"]);
+                let doc_attrs = doc
+                    .as_object_mut()
+                    .unwrap()
+                    .entry("attributes")
+                    .or_insert(json!({}));
+                for (key, value) in attrs["attributes"].as_object().unwrap() {
+                    doc_attrs[key] = value.clone();
+                }
+            }
+        }
+        docs
+    }
+
+    #[test]
+    fn test_native_same_as_jaq() {
+        // jq versions of the filters and spans used in test_mixer
+        let exprs = [
+            ".attributes.b.b != null",
+            ".attributes?.pii?.email?",
+            ".attributes?.pii?.company_name?",
+            ".attributes.sample__random_number_v1__random[0][2] < 0.5",
+            ".attributes.dummy and .attributes.dummy[0] and .attributes.dummy[0][2] > 0.5",
+            ".metadata.length < 10000",
+            ".metadata.length < 500",
+            ".attributes.pii.too_much_pii == true",
+            ".attributes.pii?.too_much_pii? == true",
+            ".attributes.toxicity > 0.8",
+            ".attributes.bff_duplicate_paragraph_spans | length > 10",
+            ".attributes.bff_duplicate_paragraph_spans | any(.[1] - .[0] > 100)",
+            ".attributes.bff_duplicate_paragraph_spans | any(.[2] >= 1)",
+            ".attributes.bff_duplicate_paragraph_spans | all(.[2] >= 1) and (.text | length > 0)",
+        ];
+        let docs = provided_docs();
+
+        for expr in exprs {
+            let native = JqDocFilter::parse_filters(vec![expr.to_string()], true).unwrap();
+            let jaq = JqDocFilter::parse_filters(vec![expr.to_string()], false).unwrap();
+            // `a - b` is not supported natively
+            assert_eq!(
+                matches!(native[0], JqFilter::Native(_)),
+                !expr.contains(" - "),
+                "{}",
+                expr
+            );
+            let (native, jaq) = (
+                JqDocFilter {
+                    include: native,
+                    exclude: Vec::new(),
+                },
+                JqDocFilter {
+                    include: jaq,
+                    exclude: Vec::new(),
+                },
+            );
+
+            let selector_config = SpanReplacementConfig {
+                span: expr.to_string(),
+                min_score: None,
+                max_score: None,
+                replacement: "".to_string(),
+                syntax: Some("jq".to_string()),
+            };
+            let native_selector = Selector::new(&selector_config).unwrap();
+            let jaq_selector = JqSelector::new(expr).unwrap();
+
+            for doc in docs.iter() {
+                match (native.should_keep(doc), jaq.should_keep(doc)) {
+                    (Ok(a), Ok(b)) => assert_eq!(a, b, "{} on {}", expr, doc["id"]),
+                    (a, b) => assert!(a.is_err() && b.is_err(), "{} on {}", expr, doc["id"]),
+                }
+                match (native_selector.select(doc), jaq_selector.select(doc)) {
+                    (Ok(a), Ok(b)) => assert_eq!(a, b, "{} on {}", expr, doc["id"]),
+                    (a, b) => assert!(a.is_err() && b.is_err(), "{} on {}", expr, doc["id"]),
+                }
+            }
+        }
+    }
+
+    #[test]
+    fn test_only_reads_attributes() {
+        let make_filter = |include: Vec<&str>, exclude: Vec<&str>, syntax: &str| {
+            DocFilter::new(Some(&FilterConfig {
+                include: include.into_iter().map(String::from).collect(),
+                exclude: exclude.into_iter().map(String::from).collect(),
+                syntax: Some(syntax.to_string()),
+            }))
+            .unwrap()
+        };
+
+        assert!(DocFilter::new(None).unwrap().only_reads_attributes());
+        assert!(make_filter(
+            vec![".attributes.foo | length >= 3"],
+            vec![".attributes.bar[0][-1] > 0.5"],
+            "jq"
+        )
+        .only_reads_attributes());
+        assert!(!make_filter(vec![".text | length > 100"], vec![], "jq").only_reads_attributes());
+        // jaq expressions are not analyzed
+        assert!(
+            !make_filter(vec![".attributes.foo | add > 1"], vec![], "jq").only_reads_attributes()
+        );
+        assert!(make_filter(
+            vec![],
+            vec!["$.attributes[?(@.foo && @.foo[0][2] >= 1.0)]"],
+            "jsonpath"
+        )
+        .only_reads_attributes());
+        assert!(!make_filter(vec!["$..foo"], vec![], "jsonpath").only_reads_attributes());
+    }
+
     #[test]
     fn test_jq_missing_attr() {
         let filter_config = FilterConfig {
@@ -1,15 +1,19 @@
 use pyo3::exceptions;
 use pyo3::prelude::*;
+use pyo3::types::PyBytes;
 
 use adblock::lists::ParseOptions;
 use adblock::request::Request;
 use adblock::Engine;
 
+pub mod attributes;
 pub mod bloom_filter;
 pub mod deduper;
 pub mod filters;
 pub mod io;
 pub mod mixer;
+pub mod native_filter;
+pub mod planner;
 pub mod s3_util;
 pub mod shard;
 pub mod wimbd;
@@ -44,6 +48,22 @@ fn mixer_entrypoint(config_str: &str) -> PyResult<()> {
     Ok(())
 }
 
+#[pyfunction]
+fn mixer_plan_entrypoint(
+    config_str: &str,
+    sample_size: usize,
+    max_files: usize,
+) -> PyResult<String> {
+    let config: MixerConfig = MixerConfig::parse_from_string(config_str).unwrap();
+    match planner::plan(&config, sample_size, max_files) {
+        Ok(plans) => Ok(serde_json::to_string(&plans).unwrap()),
+        Err(e) => Err(exceptions::PyRuntimeError::new_err(format!(
+            "Failed to plan mix: {}",
+            e
+        ))),
+    }
+}
+
 /// Adblocker class
 /// Hold the adblocker engine loaded with the rules
 ///
@@ -70,6 +90,36 @@ impl UrlBlocker {
             engine: Engine::from_rules(&rules, ParseOptions::default()),
         }
     }
+
+    /// Serialize the engine, so that it can be loaded later without parsing the rules again
+    ///
+    /// returns:
+    ///     bytes -> The engine in adblock's own binary format; only valid for the same adblock version
+    fn serialize<'py>(&self, py: Python<'py>) -> PyResult<&'py PyBytes> {
+        match self.engine.serialize_raw() {
+            Ok(data) => Ok(PyBytes::new(py, &data)),
+            Err(e) => Err(exceptions::PyValueError::new_err(format!(
+                "Failed to serialize engine: {:?}",
+                e
+            ))),
+        }
+    }
+
+    /// Create an adblocker from an engine serialized with `serialize`
+    ///
+    /// input:
+    ///     data: bytes -> The serialized engine
+    #[staticmethod]
+    fn deserialize(data: &[u8]) -> PyResult<Self> {
+        let mut engine = Engine::new(true);
+        match engine.deserialize(data) {
+            Ok(_) => Ok(UrlBlocker { engine }),
+            Err(e) => Err(exceptions::PyValueError::new_err(format!(
+                "Failed to deserialize engine: {:?}",
+                e
+            ))),
+        }
+    }
     /// The function that should tell whether a specific request should be blocked according to the loaded rules
     ///
     /// input:
@@ -106,6 +156,25 @@ impl UrlBlocker {
             }
         }
     }
+
+    /// Same as check_network_urls, but for many urls at once, all with the same source url and request type
+    ///
+    /// returns:
+    ///     List[Optional[bool]] -> Whether each request should be blocked, or None if its url is invalid
+    fn check_network_urls_batch(
+        &mut self,
+        urls: Vec<String>,
+        source_url: &str,
+        request_type: &str,
+    ) -> Vec<Option<bool>> {
+        urls.iter()
+            .map(|url| {
+                Request::new(url, source_url, request_type)
+                    .ok()
+                    .map(|request| self.engine.check_network_request(&request).matched)
+            })
+            .collect()
+    }
 }
 
 // A Python module implemented in Rust. The name of this function must match
@@ -115,6 +184,7 @@ impl UrlBlocker {
 fn dolma(_py: Python, m: &PyModule) -> PyResult<()> {
     m.add_function(wrap_pyfunction!(deduper_entrypoint, m)?)?;
     m.add_function(wrap_pyfunction!(mixer_entrypoint, m)?)?;
+    m.add_function(wrap_pyfunction!(mixer_plan_entrypoint, m)?)?;
     m.add_class::<UrlBlocker>()?;
 
     if env::var("RUST_LOG").is_err() {
@@ -0,0 +1,817 @@
+// A native evaluator for the subset of jq expressions that mixer filters use most:
+// attribute lookups (`.attributes.foo[0][-1]`), comparisons against literals or other
+// lookups, `length`, `not`, `any`/`all` (with or without a condition), `and`/`or`, pipes,
+// parentheses and `?`. Expressions are parsed once and evaluated directly against a borrowed
+// `serde_json::Value`; nothing is cloned unless a selector result has to be returned.
+//
+// Semantics follow jaq (which is what the mixer would otherwise use): indexing `null` is an
+// error, out of range array indices return `null`, numbers compare by value regardless of
+// their JSON representation, and values of different types are ordered
+// null < false < true < numbers < strings < arrays < objects.
+//
+// Anything outside of this subset (arithmetic, `map`, `select`, `.[]`, string interpolation,
+// object or array construction, ...) is not compiled; callers fall back to jaq.
+
+use std::cmp::Ordering;
+
+use serde_json::Value;
+
+#[derive(Debug, Clone, Copy, PartialEq)]
+enum CmpOp {
+    Eq,
+    Ne,
+    Lt,
+    Le,
+    Gt,
+    Ge,
+}
+
+#[derive(Debug, Clone, PartialEq)]
+enum Token {
+    Dot,
+    Field(String),
+    Ident(String),
+    Str(String),
+    Num(f64),
+    LBracket,
+    RBracket,
+    LParen,
+    RParen,
+    Pipe,
+    Question,
+    Cmp(CmpOp),
+}
+
+#[derive(Debug)]
+enum Expr {
+    Identity,
+    Literal(Value),
+    Field(Box<Expr>, String),
+    Index(Box<Expr>, i64),
+    Try(Box<Expr>),
+    Pipe(Box<Expr>, Box<Expr>),
+    And(Box<Expr>, Box<Expr>),
+    Or(Box<Expr>, Box<Expr>),
+    Compare(Box<Expr>, CmpOp, Box<Expr>),
+    Length,
+    Not,
+    Any(Option<Box<Expr>>),
+    All(Option<Box<Expr>>),
+}
+
+// Values produced while evaluating an expression; JSON values are borrowed from the document
+// (or from literals in the expression), and only scalars computed by the filter are owned.
+#[derive(Debug, Clone, Copy)]
+pub enum NativeVal<'a> {
+    Null,
+    Bool(bool),
+    Number(f64),
+    Json(&'a Value),
+}
+
+impl<'a> NativeVal<'a> {
+    fn from_json(value: &'a Value) -> NativeVal<'a> {
+        match value {
+            Value::Null => NativeVal::Null,
+            Value::Bool(b) => NativeVal::Bool(*b),
+            Value::Number(n) => NativeVal::Number(n.as_f64().unwrap_or(f64::NAN)),
+            _ => NativeVal::Json(value),
+        }
+    }
+
+    // jq truthiness: everything but null and false is true
+    pub fn is_truthy(&self) -> bool {
+        !matches!(self, NativeVal::Null | NativeVal::Bool(false))
+    }
+
+    // truthiness used by the mixer to decide whether a filter matched; empty strings,
+    // arrays, objects and zero are also considered false
+    pub fn is_match(&self) -> bool {
+        match self {
+            NativeVal::Null => false,
+            NativeVal::Bool(b) => *b,
+            NativeVal::Number(n) => *n != 0.0,
+            NativeVal::Json(Value::String(s)) => !s.is_empty(),
+            NativeVal::Json(Value::Array(a)) => !a.is_empty(),
+            NativeVal::Json(Value::Object(o)) => !o.is_empty(),
+            NativeVal::Json(_) => true,
+        }
+    }
+
+    pub fn to_value(&self) -> Value {
+        match self {
+            NativeVal::Null => Value::Null,
+            NativeVal::Bool(b) => Value::Bool(*b),
+            NativeVal::Number(n) => number_to_value(*n),
+            NativeVal::Json(value) => (*value).clone(),
+        }
+    }
+
+    fn type_name(&self) -> &'static str {
+        match self {
+            NativeVal::Null => "null",
+            NativeVal::Bool(_) => "boolean",
+            NativeVal::Number(_) => "number",
+            NativeVal::Json(Value::String(_)) => "string",
+            NativeVal::Json(Value::Array(_)) => "array",
+            NativeVal::Json(Value::Object(_)) => "object",
+            NativeVal::Json(value) => NativeVal::from_json(value).type_name(),
+        }
+    }
+
+    fn rank(&self) -> u8 {
+        match self {
+            NativeVal::Null => 0,
+            NativeVal::Bool(false) => 1,
+            NativeVal::Bool(true) => 2,
+            NativeVal::Number(_) => 3,
+            NativeVal::Json(Value::String(_)) => 4,
+            NativeVal::Json(Value::Array(_)) => 5,
+            NativeVal::Json(Value::Object(_)) => 6,
+            NativeVal::Json(value) => NativeVal::from_json(value).rank(),
+        }
+    }
+
+    // values are ordered as in jq; numbers compare by value, arrays lexicographically,
+    // and objects first by their sorted keys, then by their values in key order.
+    fn compare(&self, other: &NativeVal) -> Ordering {
+        let (rank, other_rank) = (self.rank(), other.rank());
+        if rank != other_rank {
+            return rank.cmp(&other_rank);
+        }
+        match (self.normalize(), other.normalize()) {
+            (NativeVal::Number(a), NativeVal::Number(b)) => {
+                a.partial_cmp(&b).unwrap_or(Ordering::Equal)
+            }
+            (NativeVal::Json(Value::String(a)), NativeVal::Json(Value::String(b))) => a.cmp(b),
+            (NativeVal::Json(Value::Array(a)), NativeVal::Json(Value::Array(b))) => {
+                for (x, y) in a.iter().zip(b.iter()) {
+                    let ord = NativeVal::from_json(x).compare(&NativeVal::from_json(y));
+                    if ord != Ordering::Equal {
+                        return ord;
+                    }
+                }
+                a.len().cmp(&b.len())
+            }
+            (NativeVal::Json(Value::Object(a)), NativeVal::Json(Value::Object(b))) => {
+                let mut keys_a: Vec<&String> = a.keys().collect();
+                let mut keys_b: Vec<&String> = b.keys().collect();
+                keys_a.sort();
+                keys_b.sort();
+                let ord = keys_a.cmp(&keys_b);
+                if ord != Ordering::Equal {
+                    return ord;
+                }
+                for key in keys_a {
+                    let ord = NativeVal::from_json(&a[key]).compare(&NativeVal::from_json(&b[key]));
+                    if ord != Ordering::Equal {
+                        return ord;
+                    }
+                }
+                Ordering::Equal
+            }
+            // same rank and not a container: null, false, or true
+            _ => Ordering::Equal,
+        }
+    }
+
+    fn normalize(&self) -> NativeVal<'a> {
+        match self {
+            NativeVal::Json(value) => NativeVal::from_json(value),
+            other => *other,
+        }
+    }
+}
+
+fn number_to_value(n: f64) -> Value {
+    if n.fract() == 0.0 && n.abs() < (i64::MAX as f64) {
+        Value::from(n as i64)
+    } else {
+        serde_json::Number::from_f64(n)
+            .map(Value::Number)
+            .unwrap_or(Value::Null)
+    }
+}
+
+fn tokenize(source: &str) -> Option<Vec<Token>> {
+    let chars: Vec<char> = source.chars().collect();
+    let mut tokens = Vec::new();
+    let mut i = 0;
+
+    let is_ident_start = |c: char| c.is_ascii_alphabetic() || c == '_';
+    let is_ident_char = |c: char| c.is_ascii_alphanumeric() || c == '_';
+
+    while i < chars.len() {
+        let c = chars[i];
+        match c {
+            _ if c.is_whitespace() => i += 1,
+            '.' => {
+                if i + 1 < chars.len() && is_ident_start(chars[i + 1]) {
+                    let start = i + 1;
+                    i += 1;
+                    while i < chars.len() && is_ident_char(chars[i]) {
+                        i += 1;
+                    }
+                    tokens.push(Token::Field(chars[start..i].iter().collect()));
+                } else if i + 1 < chars.len() && chars[i + 1] == '"' {
+                    let (s, next) = read_string(&chars, i + 1)?;
+                    tokens.push(Token::Field(s));
+                    i = next;
+                } else {
+                    tokens.push(Token::Dot);
+                    i += 1;
+                }
+            }
+            '"' => {
+                let (s, next) = read_string(&chars, i)?;
+                tokens.push(Token::Str(s));
+                i = next;
+            }
+            '[' => {
+                tokens.push(Token::LBracket);
+                i += 1;
+            }
+            ']' => {
+                tokens.push(Token::RBracket);
+                i += 1;
+            }
+            '(' => {
+                tokens.push(Token::LParen);
+                i += 1;
+            }
+            ')' => {
+                tokens.push(Token::RParen);
+                i += 1;
+            }
+            '|' => {
+                tokens.push(Token::Pipe);
+                i += 1;
+            }
+            '?' => {
+                tokens.push(Token::Question);
+                i += 1;
+            }
+            '=' | '!' | '<' | '>' => {
+                let next_is_eq = i + 1 < chars.len() && chars[i + 1] == '=';
+                let op = match (c, next_is_eq) {
+                    ('=', true) => CmpOp::Eq,
+                    ('!', true) => CmpOp::Ne,
+                    ('<', true) => CmpOp::Le,
+                    ('>', true) => CmpOp::Ge,
+                    ('<', false) => CmpOp::Lt,
+                    ('>', false) => CmpOp::Gt,
+                    // assignment and other operators are not supported
+                    _ => return None,
+                };
+                tokens.push(Token::Cmp(op));
+                i += if next_is_eq { 2 } else { 1 };
+            }
+            '-' | '0'..='9' => {
+                // a leading minus is only supported as part of a numeric literal
+                let start = i;
+                i += 1;
+                while i < chars.len()
+                    && (chars[i].is_ascii_digit()
+                        || chars[i] == '.'
+                        || chars[i] == 'e'
+                        || chars[i] == 'E'
+                        || ((chars[i] == '+' || chars[i] == '-')
+                            && (chars[i - 1] == 'e' || chars[i - 1] == 'E')))
+                {
+                    i += 1;
+                }
+                let literal: String = chars[start..i].iter().collect();
+                tokens.push(Token::Num(literal.parse::<f64>().ok()?));
+            }
+            _ if is_ident_start(c) => {
+                let start = i;
+                while i < chars.len() && is_ident_char(chars[i]) {
+                    i += 1;
+                }
+                tokens.push(Token::Ident(chars[start..i].iter().collect()));
+            }
+            _ => return None,
+        }
+    }
+    Some(tokens)
+}
+
+// Read a double-quoted string starting at `start`; returns the unescaped string and the
+// position after the closing quote. String interpolation is not supported.
+fn read_string(chars: &[char], start: usize) -> Option<(String, usize)> {
+    let mut i = start + 1;
+    while i < chars.len() {
+        match chars[i] {
+            '\\' if i + 1 < chars.len() && chars[i + 1] == '(' => return None,
+            '\\' => i += 2,
+            '"' => {
+                let literal: String = chars[start..=i].iter().collect();
+                let value: String = serde_json::from_str(&literal).ok()?;
+                return Some((value, i + 1));
+            }
+            _ => i += 1,
+        }
+    }
+    None
+}
+
+struct Parser {
+    tokens: Vec<Token>,
+    pos: usize,
+}
+
+impl Parser {
+    fn peek(&self) -> Option<&Token> {
+        self.tokens.get(self.pos)
+    }
+
+    fn next(&mut self) -> Option<Token> {
+        let token = self.tokens.get(self.pos).cloned();
+        self.pos += 1;
+        token
+    }
+
+    fn expect(&mut self, expected: Token) -> Option<()> {
+        if self.next()? == expected {
+            Some(())
+        } else {
+            None
+        }
+    }
+
+    fn is_keyword(&self, keyword: &str) -> bool {
+        matches!(self.peek(), Some(Token::Ident(ident)) if ident == keyword)
+    }
+
+    // pipe := or ('|' or)*
+    fn parse_pipe(&mut self) -> Option<Expr> {
+        let mut lhs = self.parse_or()?;
+        while self.peek() == Some(&Token::Pipe) {
+            self.pos += 1;
+            let rhs = self.parse_or()?;
+            lhs = Expr::Pipe(Box::new(lhs), Box::new(rhs));
+        }
+        Some(lhs)
+    }
+
+    // or := and ('or' and)*
+    fn parse_or(&mut self) -> Option<Expr> {
+        let mut lhs = self.parse_and()?;
+        while self.is_keyword("or") {
+            self.pos += 1;
+            let rhs = self.parse_and()?;
+            lhs = Expr::Or(Box::new(lhs), Box::new(rhs));
+        }
+        Some(lhs)
+    }
+
+    // and := compare ('and' compare)*
+    fn parse_and(&mut self) -> Option<Expr> {
+        let mut lhs = self.parse_compare()?;
+        while self.is_keyword("and") {
+            self.pos += 1;
+            let rhs = self.parse_compare()?;
+            lhs = Expr::And(Box::new(lhs), Box::new(rhs));
+        }
+        Some(lhs)
+    }
+
+    // compare := postfix (op postfix)?; chained comparisons are left to jaq
+    fn parse_compare(&mut self) -> Option<Expr> {
+        let lhs = self.parse_postfix()?;
+        if let Some(Token::Cmp(op)) = self.peek().cloned() {
+            self.pos += 1;
+            let rhs = self.parse_postfix()?;
+            if matches!(self.peek(), Some(Token::Cmp(_))) {
+                return None;
+            }
+            return Some(Expr::Compare(Box::new(lhs), op, Box::new(rhs)));
+        }
+        Some(lhs)
+    }
+
+    // postfix := primary (field | '[' index ']' | '?')*
+    fn parse_postfix(&mut self) -> Option<Expr> {
+        let mut expr = self.parse_primary()?;
+        loop {
+            match self.peek() {
+                Some(Token::Field(_)) => {
+                    if let Some(Token::Field(name)) = self.next() {
+                        expr = Expr::Field(Box::new(expr), name);
+                    }
+                }
+                Some(Token::LBracket) => {
+                    self.pos += 1;
+                    expr = self.parse_bracket(expr)?;
+                }
+                Some(Token::Dot) if self.tokens.get(self.pos + 1) == Some(&Token::LBracket) => {
+                    // `.foo.[0]` is the same as `.foo[0]`
+                    self.pos += 2;
+                    expr = self.parse_bracket(expr)?;
+                }
+                Some(Token::Question) => {
+                    self.pos += 1;
+                    expr = Expr::Try(Box::new(expr));
+                }
+                _ => return Some(expr),
+            }
+        }
+    }
+
+    // the opening bracket has already been consumed
+    fn parse_bracket(&mut self, expr: Expr) -> Option<Expr> {
+        let indexed = match self.next()? {
+            Token::Num(n) if n.fract() == 0.0 => Expr::Index(Box::new(expr), n as i64),
+            Token::Str(name) => Expr::Field(Box::new(expr), name),
+            // iteration, slices, and computed indices are left to jaq
+            _ => return None,
+        };
+        self.expect(Token::RBracket)?;
+        Some(indexed)
+    }
+
+    fn parse_primary(&mut self) -> Option<Expr> {
+        match self.next()? {
+            Token::Dot => match self.peek() {
+                Some(Token::LBracket) => {
+                    self.pos += 1;
+                    self.parse_bracket(Expr::Identity)
+                }
+                _ => Some(Expr::Identity),
+            },
+            Token::Field(name) => Some(Expr::Field(Box::new(Expr::Identity), name)),
+            Token::Num(n) => Some(Expr::Literal(number_to_value(n))),
+            Token::Str(s) => Some(Expr::Literal(Value::String(s))),
+            Token::LParen => {
+                let expr = self.parse_pipe()?;
+                self.expect(Token::RParen)?;
+                Some(expr)
+            }
+            Token::Ident(ident) => match ident.as_str() {
+                "true" => Some(Expr::Literal(Value::Bool(true))),
+                "false" => Some(Expr::Literal(Value::Bool(false))),
+                "null" => Some(Expr::Literal(Value::Null)),
+                "length" => Some(Expr::Length),
+                "not" => Some(Expr::Not),
+                "any" | "all" => {
+                    let condition = if self.peek() == Some(&Token::LParen) {
+                        self.pos += 1;
+                        let condition = self.parse_pipe()?;
+                        // two-argument forms (`any(generator; condition)`) are left to jaq
+                        self.expect(Token::RParen)?;
+                        Some(Box::new(condition))
+                    } else {
+                        None
+                    };
+                    Some(if ident == "any" {
+                        Expr::Any(condition)
+                    } else {
+                        Expr::All(condition)
+                    })
+                }
+                _ => None,
+            },
+            _ => None,
+        }
+    }
+}
+
+type EvalResult<'a> = Result<Option<NativeVal<'a>>, String>;
+
+impl Expr {
+    // Evaluate the expression; `Ok(None)` means the expression produced no output,
+    // e.g. because an error was suppressed with `?`.
+    fn eval<'a>(&'a self, input: NativeVal<'a>) -> EvalResult<'a> {
+        match self {
+            Expr::Identity => Ok(Some(input)),
+            Expr::Literal(value) => Ok(Some(NativeVal::from_json(value))),
+            Expr::Field(base, name) => match base.eval(input)? {
+                None => Ok(None),
+                Some(NativeVal::Json(Value::Object(map))) => Ok(Some(
+                    map.get(name)
+                        .map(NativeVal::from_json)
+                        .unwrap_or(NativeVal::Null),
+                )),
+                Some(other) => Err(format!(
+                    "cannot index {} with \"{}\"",
+                    other.type_name(),
+                    name
+                )),
+            },
+            Expr::Index(base, index) => match base.eval(input)? {
+                None => Ok(None),
+                Some(NativeVal::Json(Value::Array(array))) => {
+                    let index = if *index < 0 {
+                        array.len() as i64 + index
+                    } else {
+                        *index
+                    };
+                    Ok(Some(if index < 0 {
+                        NativeVal::Null
+                    } else {
+                        array
+                            .get(index as usize)
+                            .map(NativeVal::from_json)
+                            .unwrap_or(NativeVal::Null)
+                    }))
+                }
+                Some(other) => Err(format!("cannot index {} with number", other.type_name())),
+            },
+            Expr::Try(inner) => Ok(inner.eval(input).unwrap_or(None)),
+            Expr::Pipe(lhs, rhs) => match lhs.eval(input)? {
+                None => Ok(None),
+                Some(value) => rhs.eval(value),
+            },
+            Expr::And(lhs, rhs) => match lhs.eval(input)? {
+                None => Ok(None),
+                Some(value) if !value.is_truthy() => Ok(Some(NativeVal::Bool(false))),
+                Some(_) => Ok(rhs
+                    .eval(input)?
+                    .map(|value| NativeVal::Bool(value.is_truthy()))),
+            },
+            Expr::Or(lhs, rhs) => match lhs.eval(input)? {
+                None => Ok(None),
+                Some(value) if value.is_truthy() => Ok(Some(NativeVal::Bool(true))),
+                Some(_) => Ok(rhs
+                    .eval(input)?
+                    .map(|value| NativeVal::Bool(value.is_truthy()))),
+            },
+            Expr::Compare(lhs, op, rhs) => {
+                // like jaq, the right side is only evaluated for outputs of the left side
+                let lhs = match lhs.eval(input)? {
+                    Some(lhs) => lhs,
+                    None => return Ok(None),
+                };
+                let rhs = match rhs.eval(input)? {
+                    Some(rhs) => rhs,
+                    None => return Ok(None),
+                };
+                let ord = lhs.compare(&rhs);
+                Ok(Some(NativeVal::Bool(match op {
+                    CmpOp::Eq => ord == Ordering::Equal,
+                    CmpOp::Ne => ord != Ordering::Equal,
+                    CmpOp::Lt => ord == Ordering::Less,
+                    CmpOp::Le => ord != Ordering::Greater,
+                    CmpOp::Gt => ord == Ordering::Greater,
+                    CmpOp::Ge => ord != Ordering::Less,
+                })))
+            }
+            Expr::Length => match input.normalize() {
+                NativeVal::Null => Ok(Some(NativeVal::Number(0.0))),
+                NativeVal::Number(n) => Ok(Some(NativeVal::Number(n.abs()))),
+                NativeVal::Json(Value::String(s)) => {
+                    Ok(Some(NativeVal::Number(s.chars().count() as f64)))
+                }
+                NativeVal::Json(Value::Array(a)) => Ok(Some(NativeVal::Number(a.len() as f64))),
+                NativeVal::Json(Value::Object(o)) => Ok(Some(NativeVal::Number(o.len() as f64))),
+                other => Err(format!("{} has no length", other.type_name())),
+            },
+            Expr::Not => Ok(Some(NativeVal::Bool(!input.is_truthy()))),
+            Expr::Any(condition) => Expr::eval_quantifier(input, condition.as_deref(), true),
+            Expr::All(condition) => Expr::eval_quantifier(input, condition.as_deref(), false),
+        }
+    }
+
+    // Whether the expression, evaluated on a document, only reads values under `.key`.
+    fn only_reads(&self, key: &str) -> bool {
+        match self {
+            Expr::Literal(_) => true,
+            Expr::Field(base, name) => match base.as_ref() {
+                Expr::Identity => name == key,
+                base => base.only_reads(key),
+            },
+            Expr::Index(base, _) | Expr::Try(base) => base.only_reads(key),
+            // the right side of a pipe only sees the output of the left side
+            Expr::Pipe(lhs, _) => lhs.only_reads(key),
+            Expr::And(lhs, rhs) | Expr::Or(lhs, rhs) | Expr::Compare(lhs, _, rhs) => {
+                lhs.only_reads(key) && rhs.only_reads(key)
+            }
+            // these operate on the whole document
+            Expr::Identity | Expr::Length | Expr::Not | Expr::Any(_) | Expr::All(_) => false,
+        }
+    }
+
+    // `any` stops at the first truthy element, `all` at the first falsy one; elements for
+    // which the condition produces no output are skipped.
+    fn eval_quantifier<'a>(
+        input: NativeVal<'a>,
+        condition: Option<&'a Expr>,
+        any: bool,
+    ) -> EvalResult<'a> {
+        let elements: Box<dyn Iterator<Item = &'a Value> + 'a> = match input.normalize() {
+            NativeVal::Json(Value::Array(a)) => Box::new(a.iter()),
+            NativeVal::Json(Value::Object(o)) => Box::new(o.values()),
+            other => return Err(format!("cannot iterate over {}", other.type_name())),
+        };
+        for element in elements {
+            let element = NativeVal::from_json(element);
+            let value = match condition {
+                Some(condition) => condition.eval(element)?,
+                None => Some(element),
+            };
+            if let Some(value) = value {
+                if value.is_truthy() == any {
+                    return Ok(Some(NativeVal::Bool(any)));
+                }
+            }
+        }
+        Ok(Some(NativeVal::Bool(!any)))
+    }
+}
+
+// A jq expression compiled to a native evaluator.
+#[derive(Debug)]
+pub struct NativeFilter {
+    expr: Expr,
+}
+
+impl NativeFilter {
+    // Compile a jq expression; returns None if the expression is not in the supported subset.
+    pub fn compile(source: &str) -> Option<NativeFilter> {
+        let mut parser = Parser {
+            tokens: tokenize(source)?,
+            pos: 0,
+        };
+        let expr = parser.parse_pipe()?;
+        if parser.pos != parser.tokens.len() {
+            return None;
+        }
+        Some(NativeFilter { expr })
+    }
+
+    // Whether the filter only reads values under the top-level field `key` of a document.
+    pub fn only_reads(&self, key: &str) -> bool {
+        self.expr.only_reads(key)
+    }
+
+    // Evaluate the filter against a document; returns Ok(None) if the filter has no output.
+    pub fn evaluate<'a>(&'a self, json: &'a Value) -> Result<Option<NativeVal<'a>>, String> {
+        self.expr.eval(NativeVal::from_json(json))
+    }
+}
+
+#[cfg(test)]
+mod native_filter_tests {
+    use super::*;
+    use serde_json::json;
+
+    fn eval(expr: &str, doc: &Value) -> Result<Option<Value>, String> {
+        let filter =
+            NativeFilter::compile(expr).unwrap_or_else(|| panic!("{} should compile", expr));
+        filter.evaluate(doc).map(|v| v.map(|v| v.to_value()))
+    }
+
+    fn doc() -> Value {
+        json!({
+            "text": "abc",
+            "attributes": {
+                "a": [[0, 3, 1]],
+                "n": 0,
+                "s": "xy",
+                "t": true,
+                "o": {"k": 1},
+                "z": [0],
+                "empty": []
+            }
+        })
+    }
+
+    #[test]
+    fn test_lookups() {
+        let doc = doc();
+        assert_eq!(eval(".attributes.s", &doc), Ok(Some(json!("xy"))));
+        assert_eq!(eval(".attributes[\"s\"]", &doc), Ok(Some(json!("xy"))));
+        assert_eq!(eval(".attributes.\"s\"", &doc), Ok(Some(json!("xy"))));
+        assert_eq!(eval(".attributes.a[0][-1]", &doc), Ok(Some(json!(1))));
+        assert_eq!(eval(".attributes.a[5]", &doc), Ok(Some(json!(null))));
+        assert_eq!(eval(".attributes.a[-5]", &doc), Ok(Some(json!(null))));
+        assert_eq!(eval(".attributes.missing", &doc), Ok(Some(json!(null))));
+        assert_eq!(eval(". | .attributes | .o.k", &doc), Ok(Some(json!(1))));
+    }
+
+    #[test]
+    fn test_errors_and_try() {
+        let doc = doc();
+        // indexing null is an error in jaq
+        assert!(eval(".attributes.b.b != null", &doc).is_err());
+        assert!(eval(".attributes.b[0]", &doc).is_err());
+        assert!(eval(".attributes.a.foo", &doc).is_err());
+        assert!(eval(".attributes.t | length", &doc).is_err());
+        assert!(eval(".attributes.s | any", &doc).is_err());
+        assert!(eval(".attributes.a | any(.foo)", &doc).is_err());
+        assert_eq!(eval(".attributes.a.foo?", &doc), Ok(None));
+        assert_eq!(eval(".attributes?.b?.c?", &doc), Ok(None));
+        assert!(eval(".attributes.b?.c", &doc).is_err());
+        // the right side of a comparison is not evaluated if the left side has no output
+        assert_eq!(eval(".attributes.a.foo? > .attributes.b.c", &doc), Ok(None));
+        assert!(eval(".attributes.n > .attributes.b.c", &doc).is_err());
+    }
+
+    #[test]
+    fn test_comparisons() {
+        let doc = doc();
+        assert_eq!(
+            eval(".attributes.a[0][2] == 1.0", &doc),
+            Ok(Some(json!(true)))
+        );
+        assert_eq!(
+            eval(".attributes.a[0] == .attributes.a[-1]", &doc),
+            Ok(Some(json!(true)))
+        );
+        assert_eq!(
+            eval(".attributes.n < .attributes.s", &doc),
+            Ok(Some(json!(true)))
+        );
+        assert_eq!(eval("null < false", &doc), Ok(Some(json!(true))));
+        assert_eq!(eval("false < 0", &doc), Ok(Some(json!(true))));
+        assert_eq!(eval("\"a\" < 1", &doc), Ok(Some(json!(false))));
+        assert_eq!(eval("\"B\" < \"a\"", &doc), Ok(Some(json!(true))));
+        assert_eq!(
+            eval(".attributes.a < .attributes.o", &doc),
+            Ok(Some(json!(true)))
+        );
+        assert_eq!(eval("-1 < 0", &doc), Ok(Some(json!(true))));
+        assert_eq!(eval(".attributes.b == null", &doc), Ok(Some(json!(true))));
+        assert_eq!(eval(".attributes.o.k >= 1e0", &doc), Ok(Some(json!(true))));
+    }
+
+    #[test]
+    fn test_builtins() {
+        let doc = doc();
+        assert_eq!(eval(".text | length > 0", &doc), Ok(Some(json!(true))));
+        assert_eq!(eval(".attributes.b | length", &doc), Ok(Some(json!(0))));
+        assert_eq!(
+            eval("(.attributes.a | length) > 0", &doc),
+            Ok(Some(json!(true)))
+        );
+        assert_eq!(
+            eval(".attributes.a | length > 0 and true", &doc),
+            Ok(Some(json!(true)))
+        );
+        assert_eq!(
+            eval(".attributes.a | any(.[2] > 0.5)", &doc),
+            Ok(Some(json!(true)))
+        );
+        assert_eq!(
+            eval(".attributes.a | all(.[2] > 1)", &doc),
+            Ok(Some(json!(false)))
+        );
+        assert_eq!(eval(".attributes.z | any", &doc), Ok(Some(json!(true))));
+        assert_eq!(eval(".attributes.empty | all", &doc), Ok(Some(json!(true))));
+        assert_eq!(
+            eval(".attributes.o | all(. > 0)", &doc),
+            Ok(Some(json!(true)))
+        );
+        assert_eq!(eval(".attributes.n | not", &doc), Ok(Some(json!(false))));
+        assert_eq!(eval(".attributes.b | not", &doc), Ok(Some(json!(true))));
+        assert_eq!(eval(".attributes.n and true", &doc), Ok(Some(json!(true))));
+        assert_eq!(
+            eval("false and .attributes.b.b", &doc),
+            Ok(Some(json!(false)))
+        );
+        assert_eq!(eval("true or .attributes.b.b", &doc), Ok(Some(json!(true))));
+    }
+
+    #[test]
+    fn test_only_reads() {
+        for (expr, expected) in [
+            (".attributes.a[0][-1] > 0.5", true),
+            (".attributes.a | length > 0 and (.[0] | .[2] > 0)", true),
+            (
+                "(.attributes.a | any(.[2] > 0.5)) or .attributes.b? != null",
+                true,
+            ),
+            (".attributes?.a?", true),
+            (".text | length > 100", false),
+            (".attributes.a and (.text | length > 0)", false),
+            (". | .attributes.a", false),
+            ("length > 2", false),
+            (".attributesx.a", false),
+        ] {
+            let filter = NativeFilter::compile(expr).unwrap();
+            assert_eq!(filter.only_reads("attributes"), expected, "{}", expr);
+        }
+    }
+
+    #[test]
+    fn test_unsupported() {
+        for expr in [
+            ".attributes.a | map(.[2]) | add",
+            ".attributes.a[0][1] - .attributes.a[0][0] > 2",
+            ".attributes.a | .[] | .[2] > 0",
+            ".attributes.a[0][0:2]",
+            ".attributes.a | any(.[]; . > 1)",
+            "1 == 1 == true",
+            ".x | sum",
+            "\"\\(.text)\"",
+            "{\"a\": 1}",
+            ".a = 1",
+        ] {
+            assert!(
+                NativeFilter::compile(expr).is_none(),
+                "{} should not compile",
+                expr
+            );
+        }
+    }
+}
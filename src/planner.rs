@@ -0,0 +1,390 @@
+// Estimate what a mixer config would produce without running it.
+//
+// For each stream, a subset of input files is picked at random, and a uniform sample of lines is drawn
+// from each of them with reservoir sampling. Only sampled lines are parsed, joined with their attributes,
+// filtered, and cleaned up as the mixer would do. Counts and sizes are then extrapolated to the whole
+// stream: each sampled file is a stratum, and the sampled files stand for all input files in proportion
+// to their size. Confidence intervals only account for the sampling of lines within files.
+
+use std::io::{BufRead, Error as IoError};
+use std::path::Path;
+
+use rand::rngs::StdRng;
+use rand::seq::index::sample;
+use rand::{Rng, SeedableRng};
+use serde::Serialize;
+use serde_json::{Map, Value};
+
+use crate::attributes::{AttributeReader, JoinStrategy};
+use crate::filters::DocFilter;
+use crate::io::MultiStream;
+use crate::s3_util;
+use crate::shard::shard_config::{CompressionConfig, SpanReplacement, SpanReplacer, StreamConfig};
+use crate::shard::{find_objects_matching_patterns, get_object_sizes, FileCache, Shard};
+
+use crate::mixer::mixer_config::MixerConfig;
+
+// z-score of a two-sided 95% confidence interval
+const Z_95: f64 = 1.96;
+
+#[derive(Serialize, Clone, Debug, Default, PartialEq)]
+pub struct Estimate {
+    pub value: f64,
+    pub low: f64,
+    pub high: f64,
+}
+
+#[derive(Serialize, Debug)]
+pub struct StreamPlan {
+    pub name: String,
+    pub input_files: usize,
+    pub input_bytes: usize,
+    pub sampled_files: usize,
+    pub sampled_documents: usize,
+    pub documents: Estimate,
+    pub kept_documents: Estimate,
+    pub kept_bytes: Estimate,
+    pub shards: usize,
+}
+
+// Outcome of sampling lines from one input file: the number of lines in the file, and the size in
+// bytes of each sampled document in the output (0 if the document is dropped).
+#[derive(Debug, Default)]
+pub struct FileSample {
+    pub lines: usize,
+    pub kept_bytes: Vec<usize>,
+}
+
+// Stratified estimate of the total of a quantity over all lines of the sampled files, scaled by
+// `scale` to account for files that were not sampled. `values` maps a sampled document to the quantity.
+pub fn estimate_total(
+    samples: &[FileSample],
+    scale: f64,
+    values: impl Fn(usize) -> f64,
+) -> Estimate {
+    let mut total = 0.0;
+    let mut variance = 0.0;
+    for file in samples.iter() {
+        let n = file.kept_bytes.len() as f64;
+        if n == 0.0 {
+            continue;
+        }
+        let lines = file.lines as f64;
+        let mean = file.kept_bytes.iter().map(|b| values(*b)).sum::<f64>() / n;
+        total += lines * mean;
+        if n > 1.0 {
+            let sample_variance = file
+                .kept_bytes
+                .iter()
+                .map(|b| (values(*b) - mean).powi(2))
+                .sum::<f64>()
+                / (n - 1.0);
+            // finite population correction: a file that is sampled in full has no uncertainty
+            let correction = (1.0 - n / lines).max(0.0);
+            variance += lines * lines * sample_variance / n * correction;
+        }
+    }
+    let margin = Z_95 * variance.sqrt();
+    Estimate {
+        value: total * scale,
+        low: (total - margin).max(0.0) * scale,
+        high: (total + margin) * scale,
+    }
+}
+
+// Reservoir sample of `size` lines of a document file, together with their attributes.
+fn sample_file(
+    lines: impl Iterator<Item = Result<String, IoError>>,
+    attr_readers: &mut Vec<AttributeReader<std::io::Lines<Box<dyn BufRead>>>>,
+    size: usize,
+    rng: &mut StdRng,
+) -> Result<(usize, Vec<(String, Map<String, Value>)>), IoError> {
+    #[derive(serde::Deserialize)]
+    struct DocumentId {
+        #[serde(default)]
+        id: Value,
+    }
+
+    let mut reservoir: Vec<(String, Map<String, Value>)> = Vec::with_capacity(size);
+    let mut count = 0;
+    for line in lines {
+        let line = line?;
+        // attributes have to be read for every line to stay aligned with documents
+        let mut attrs = Map::new();
+        if !attr_readers.is_empty() {
+            let id = serde_json::from_str::<DocumentId>(&line)?.id;
+            for attr_reader in attr_readers.iter_mut() {
+                if let Some(attributes) = attr_reader.attributes_for(&id)? {
+                    attrs.extend(attributes);
+                }
+            }
+        }
+        if reservoir.len() < size {
+            reservoir.push((line, attrs));
+        } else {
+            let position = rng.gen_range(0..=count);
+            if position < size {
+                reservoir[position] = (line, attrs);
+            }
+        }
+        count += 1;
+    }
+    Ok((count, reservoir))
+}
+
+// Size of a sampled document once written by the mixer, or 0 if the mixer would drop it.
+fn output_size(
+    shard: &Shard,
+    doc_filter: &DocFilter,
+    span_replacers: &[SpanReplacer],
+    line: &str,
+    attrs: Map<String, Value>,
+    has_attributes: bool,
+) -> Result<usize, IoError> {
+    let mut data: Value = serde_json::from_str(line)?;
+    if has_attributes {
+        if let Value::Object(ref mut existing_attrs) = data["attributes"] {
+            existing_attrs.extend(attrs);
+        } else {
+            data["attributes"] = Value::Object(attrs);
+        }
+    }
+    let keep = doc_filter
+        .should_keep(&data)
+        .map_err(|s| IoError::new(std::io::ErrorKind::Other, s))?;
+    if !keep {
+        return Ok(0);
+    }
+    if shard.passthrough {
+        return Ok(line.len() + 1);
+    }
+
+    let replacements = span_replacers
+        .iter()
+        .map(|replacer| replacer.find_spans_to_replace(&data))
+        .collect::<Result<Vec<Vec<SpanReplacement>>, IoError>>()?
+        .into_iter()
+        .flatten()
+        .collect::<Vec<SpanReplacement>>();
+    if !replacements.is_empty() {
+        let new_text = SpanReplacement::apply(data["text"].as_str().unwrap(), replacements);
+        data["text"] = Value::String(new_text);
+    }
+    for f in shard.discard_fields.iter().flatten() {
+        data.as_object_mut().unwrap().remove(f);
+    }
+    if data["text"].as_str().unwrap_or("").trim().len() < shard.min_text_length.unwrap_or(0) {
+        return Ok(0);
+    }
+    // provenance added by the mixer is not accounted for
+    Ok(serde_json::to_string(&data)?.len() + 1)
+}
+
+fn plan_stream(
+    config: &MixerConfig,
+    stream: &StreamConfig,
+    sample_size: usize,
+    max_files: usize,
+    rng: &mut StdRng,
+) -> Result<StreamPlan, IoError> {
+    let streams = vec![stream.clone()];
+    let shards = if config.shuffle {
+        Shard::split_streams(&streams)?
+    } else {
+        Shard::split_streams_unshuffled(&streams)?
+    };
+
+    // all shards of a stream share the same settings, so we use the first one for all inputs
+    let inputs = shards
+        .iter()
+        .flat_map(|shard| shard.inputs.iter().cloned())
+        .collect::<Vec<_>>();
+    let doc_paths = inputs
+        .iter()
+        .map(|input| input.doc_path.clone())
+        .collect::<Vec<_>>();
+    let sizes = get_object_sizes(&doc_paths)?;
+    let input_bytes: usize = sizes.iter().sum();
+
+    let mut plan = StreamPlan {
+        name: stream.name.clone(),
+        input_files: inputs.len(),
+        input_bytes,
+        sampled_files: 0,
+        sampled_documents: 0,
+        documents: Estimate::default(),
+        kept_documents: Estimate::default(),
+        kept_bytes: Estimate::default(),
+        shards: shards.len(),
+    };
+    let shard = match shards.first() {
+        Some(shard) => shard,
+        None => return Ok(plan),
+    };
+
+    let cache = FileCache {
+        s3_client: Box::new(s3_util::new_client(None)?),
+        work: config.work_dir.clone(),
+    };
+    let compression = shard
+        .compression
+        .clone()
+        .unwrap_or(CompressionConfig::infer());
+    let doc_filter = DocFilter::new(shard.filter.as_ref())?;
+    let span_replacers = shard
+        .span_replacements
+        .iter()
+        .flatten()
+        .map(|cfg| SpanReplacer::new(cfg))
+        .collect::<Vec<SpanReplacer>>();
+    let join_strategy = JoinStrategy::new(shard.join.as_ref().and_then(|j| j.strategy.as_deref()))?;
+    let max_buffered_rows = shard.join.as_ref().and_then(|j| j.max_buffered_rows);
+
+    let mut selected = sample(rng, inputs.len(), max_files.min(inputs.len())).into_vec();
+    if selected.is_empty() {
+        return Ok(plan);
+    }
+    selected.sort();
+    let per_file = sample_size.div_ceil(selected.len());
+
+    let mut samples: Vec<FileSample> = Vec::new();
+    let mut sampled_bytes = 0;
+    for index in selected {
+        let input = &inputs[index];
+        log::info!("Sampling {} documents from {}", per_file, input.doc_path);
+        let open = |location: &str| -> Result<(std::path::PathBuf, Box<dyn BufRead>), IoError> {
+            let local = cache.prepare_input(location)?;
+            let file_compression = match compression.input {
+                Some(ref input) => input.clone(),
+                None => MultiStream::infer_compression_from_temp(local.clone()),
+            };
+            let reader = MultiStream::new(
+                local.clone(),
+                Some(file_compression),
+                Some(1024 * 1024),
+                None,
+                None,
+            )
+            .reader()?;
+            Ok((local, reader))
+        };
+
+        let attribute_paths = find_objects_matching_patterns(&input.attribute_paths)?;
+        let mut attr_readers = Vec::new();
+        for (i, attr) in attribute_paths.iter().enumerate() {
+            let (_, reader) = open(attr)?;
+            let spill_path = Path::new(&config.work_dir.input).join(format!(
+                "plan-{}-{}-{}.spill",
+                std::process::id(),
+                index,
+                i
+            ));
+            attr_readers.push(AttributeReader::new(
+                attr,
+                reader.lines(),
+                join_strategy,
+                max_buffered_rows,
+                spill_path,
+            ));
+        }
+
+        let (_, doc_reader) = open(&input.doc_path)?;
+        let (lines, sampled) = sample_file(doc_reader.lines(), &mut attr_readers, per_file, rng)?;
+
+        let mut file_sample = FileSample {
+            lines,
+            kept_bytes: Vec::with_capacity(sampled.len()),
+        };
+        for (line, attrs) in sampled {
+            file_sample.kept_bytes.push(output_size(
+                shard,
+                &doc_filter,
+                &span_replacers,
+                &line,
+                attrs,
+                !attribute_paths.is_empty(),
+            )?);
+        }
+        plan.sampled_documents += file_sample.kept_bytes.len();
+        samples.push(file_sample);
+        sampled_bytes += sizes[index];
+
+        cache.finalize_input(&input.doc_path)?;
+        for attr in attribute_paths.iter() {
+            cache.finalize_input(attr)?;
+        }
+    }
+
+    plan.sampled_files = samples.len();
+    let scale = if sampled_bytes > 0 {
+        input_bytes as f64 / sampled_bytes as f64
+    } else {
+        0.0
+    };
+    plan.documents = estimate_total(&samples, scale, |_| 1.0);
+    plan.kept_documents = estimate_total(&samples, scale, |b| if b > 0 { 1.0 } else { 0.0 });
+    plan.kept_bytes = estimate_total(&samples, scale, |b| b as f64);
+    Ok(plan)
+}
+
+// Estimate number of kept documents and bytes for each stream in the config, based on a sample
+// of about `sample_size` documents from at most `max_files` input files per stream.
+pub fn plan(
+    config: &MixerConfig,
+    sample_size: usize,
+    max_files: usize,
+) -> Result<Vec<StreamPlan>, IoError> {
+    // a fixed seed, so that plans for the same config are the same
+    let mut rng = StdRng::seed_from_u64(0);
+    config
+        .streams
+        .iter()
+        .map(|stream| plan_stream(config, stream, sample_size, max_files, &mut rng))
+        .collect()
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn test_estimate_total() {
+        // files sampled in full: estimates are exact
+        let samples = vec![
+            FileSample {
+                lines: 4,
+                kept_bytes: vec![0, 10, 20, 0],
+            },
+            FileSample {
+                lines: 2,
+                kept_bytes: vec![5, 5],
+            },
+        ];
+        let kept = estimate_total(&samples, 1.0, |b| if b > 0 { 1.0 } else { 0.0 });
+        assert_eq!(
+            kept,
+            Estimate {
+                value: 4.0,
+                low: 4.0,
+                high: 4.0
+            }
+        );
+        let bytes = estimate_total(&samples, 2.0, |b| b as f64);
+        assert_eq!(bytes.value, 80.0);
+        assert_eq!(bytes.low, bytes.high);
+
+        // a tenth of the lines are sampled: estimate is scaled up, with some uncertainty
+        let samples = vec![FileSample {
+            lines: 100,
+            kept_bytes: vec![0, 1, 0, 1, 1, 1, 0, 1, 1, 1],
+        }];
+        let kept = estimate_total(&samples, 1.0, |b| if b > 0 { 1.0 } else { 0.0 });
+        assert!((kept.value - 70.0).abs() < 1e-9);
+        assert!(kept.low < 70.0 && kept.low > 40.0);
+        assert!(kept.high > 70.0 && kept.high < 100.0);
+
+        let documents = estimate_total(&samples, 1.0, |_| 1.0);
+        assert_eq!(documents.value, 100.0);
+        assert_eq!(documents.low, documents.high);
+    }
+}
@@ -1,12 +1,15 @@
 use std::fs::OpenOptions;
 use std::io::{BufRead, Error as IoError, ErrorKind as IoErrorKind};
 use std::path::{Path, PathBuf};
+use std::sync::atomic::{AtomicUsize, Ordering};
 
 use aws_sdk_s3::Client as S3Client;
 use glob::glob;
 use rayon::prelude::*;
+use serde::Deserialize;
 use serde_json::Value;
 
+use crate::attributes::{AttributeReader, JoinStrategy};
 use crate::filters::DocFilter;
 use crate::io::MultiStream;
 use crate::s3_util;
@@ -23,6 +26,40 @@ pub struct Shard {
     pub discard_fields: Option<Vec<String>>,
     pub min_text_length: Option<usize>,
     pub compression: Option<CompressionConfig>,
+    pub passthrough: bool,
+    pub join: Option<AttributesJoinConfig>,
+}
+
+// The fields of a document needed to filter it on attributes alone; all other fields
+// (including the text) are skipped over without being allocated.
+#[derive(Deserialize)]
+struct DocumentHead {
+    #[serde(default)]
+    id: Value,
+    #[serde(default)]
+    attributes: Value,
+}
+
+impl DocumentHead {
+    fn into_value(self) -> Value {
+        let mut data = serde_json::Map::new();
+        data.insert("id".to_string(), self.id);
+        if !self.attributes.is_null() {
+            data.insert("attributes".to_string(), self.attributes);
+        }
+        Value::Object(data)
+    }
+}
+
+// Used to give a unique name to the files attribute joins spill to.
+static SPILL_COUNTER: AtomicUsize = AtomicUsize::new(0);
+
+// Strip the `\n` or `\r\n` a line read with `read_until` ends with, as `BufRead::lines` does.
+fn trim_line_ending(line: &[u8]) -> &[u8] {
+    match line.strip_suffix(b"\n") {
+        Some(line) => line.strip_suffix(b"\r").unwrap_or(line),
+        None => line,
+    }
 }
 
 // A collection of paths to a document file and corresponding attribute files.
@@ -93,6 +130,8 @@ impl Shard {
                         discard_fields: stream_config.output.discard_fields.clone(),
                         min_text_length: stream_config.output.min_text_length.clone(),
                         compression: stream_config.compression.clone(),
+                        passthrough: stream_config.output.passthrough.unwrap_or(false),
+                        join: stream_config.join.clone(),
                     };
                     shards.push(shard);
                     stream_shard_count += 1;
@@ -114,6 +153,8 @@ impl Shard {
                     discard_fields: stream_config.output.discard_fields.clone(),
                     min_text_length: stream_config.output.min_text_length.clone(),
                     compression: stream_config.compression.clone(),
+                    passthrough: stream_config.output.passthrough.unwrap_or(false),
+                    join: stream_config.join.clone(),
                 };
                 shards.push(shard);
                 stream_shard_count += 1;
@@ -167,6 +208,8 @@ impl Shard {
                     discard_fields: stream_config.output.discard_fields.clone(),
                     min_text_length: stream_config.output.min_text_length.clone(),
                     compression: stream_config.compression.clone(),
+                    passthrough: stream_config.output.passthrough.unwrap_or(false),
+                    join: stream_config.join.clone(),
                 };
                 shards.push(shard);
             }
@@ -185,7 +228,20 @@ impl Shard {
     // Apply filters
     // Apply span replacements
     // Upload the output file to S3.
+    // In passthrough mode, kept documents are instead copied from the input as they are; if filters
+    // only read attributes, documents are not fully parsed either.
     pub fn process(&self, work_dirs: WorkDirConfig) -> Result<(), IoError> {
+        if self.passthrough
+            && (self.span_replacements.iter().flatten().next().is_some()
+                || self.discard_fields.iter().flatten().next().is_some()
+                || self.min_text_length.unwrap_or(0) > 0)
+        {
+            return Err(IoError::new(
+                IoErrorKind::Other,
+                "Passthrough output is incompatible with span_replacement, discard_fields, and min_text_length",
+            ));
+        }
+
         let cache: FileCache = FileCache {
             s3_client: Box::new(s3_util::new_client(None)?),
             work: work_dirs.clone(),
@@ -215,6 +271,32 @@ impl Shard {
             );
             let mut writer = output_stream.writer()?;
 
+            // using the doc filters later to determine if we should keep the document;
+            // filters are compiled once and shared by all inputs of the shard
+            let doc_filters = DocFilter::new(self.filter.as_ref())?;
+
+            // we have to create list of span replaces, potentially dealing with the fact
+            // there might not be any span replacements
+            let span_replacers = self
+                .span_replacements
+                .as_ref()
+                .unwrap_or(&Vec::new())
+                .iter()
+                .map(|cfg| SpanReplacer::new(cfg))
+                .collect::<Vec<SpanReplacer>>();
+
+            // when documents are copied as they are, and filters don't need anything but attributes,
+            // we only parse the id and attributes of each document.
+            let attributes_only = self.passthrough && doc_filters.only_reads_attributes();
+            if attributes_only {
+                log::info!("Filtering {} on attributes only", self.output);
+            }
+
+            // attribute files are read in lockstep with documents, unless they should be joined on id
+            let join_strategy =
+                JoinStrategy::new(self.join.as_ref().and_then(|j| j.strategy.as_deref()))?;
+            let max_buffered_rows = self.join.as_ref().and_then(|j| j.max_buffered_rows);
+
             for input_path in self.inputs.iter() {
                 log::info!("Merging {} into {}", input_path.doc_path, self.output);
                 let local_docs_file = cache.prepare_input(&input_path.doc_path)?;
@@ -236,7 +318,18 @@ impl Shard {
                     )
                     .reader()?;
 
-                    local_attr_readers.push((local_attr_file, attr_reader.lines()));
+                    let spill_path = Path::new(&work_dirs.input).join(format!(
+                        "attributes-{}-{}.spill",
+                        std::process::id(),
+                        SPILL_COUNTER.fetch_add(1, Ordering::Relaxed)
+                    ));
+                    local_attr_readers.push(AttributeReader::new(
+                        &attr,
+                        attr_reader.lines(),
+                        join_strategy,
+                        max_buffered_rows,
+                        spill_path,
+                    ));
                     attr_reader_failure_counts.push(0);
                 }
 
@@ -244,7 +337,7 @@ impl Shard {
                     Some(ref input) => input.clone(),
                     None => MultiStream::infer_compression_from_temp(local_docs_file.clone()),
                 };
-                let doc_reader = MultiStream::new(
+                let mut doc_reader = MultiStream::new(
                     local_docs_file.clone(),
                     Some(doc_compression),
                     Some(1024 * 1024),
@@ -256,20 +349,16 @@ impl Shard {
                 let mut line_number = 0;
                 let mut lines_written = 0;
 
-                // using the doc filters later to determine if we should keep the document
-                let doc_filters = DocFilter::new(self.filter.as_ref())?;
-
-                // we have to create list of span replaces, potentially dealing with the fact
-                // there might not be any span replacements
-                let span_replacers = self
-                    .span_replacements
-                    .as_ref()
-                    .unwrap_or(&Vec::new())
-                    .iter()
-                    .map(|cfg| SpanReplacer::new(cfg))
-                    .collect::<Vec<SpanReplacer>>();
-
-                for line in doc_reader.lines() {
+                // lines are read as raw bytes, so that passthrough output keeps their line endings
+                let mut raw_line: Vec<u8> = Vec::new();
+                loop {
+                    raw_line.clear();
+                    let line = match doc_reader.read_until(b'\n', &mut raw_line) {
+                        Ok(0) => break,
+                        Ok(_) => std::str::from_utf8(trim_line_ending(&raw_line))
+                            .map_err(|e| IoError::new(IoErrorKind::InvalidData, e)),
+                        Err(e) => Err(e),
+                    };
                     match line {
                         Ok(_) => {}
                         Err(e) => {
@@ -284,57 +373,30 @@ impl Shard {
                     }
                     line_number += 1;
                     let line = line?;
-                    let mut data: Value = serde_json::from_str(&line)?;
+                    let mut data: Value = if attributes_only {
+                        serde_json::from_str::<DocumentHead>(&line)?.into_value()
+                    } else {
+                        serde_json::from_str(&line)?
+                    };
                     let mut attrs: serde_json::Map<String, Value> = serde_json::Map::new();
-                    for (attr_reader_index, (_, attr_reader)) in
+                    for (attr_reader_index, attr_reader) in
                         local_attr_readers.iter_mut().enumerate()
                     {
-                        match attr_reader.next() {
-                            Some(Ok(line)) => {
-                                let attr_data: Value = serde_json::from_str(&line)?;
-
-                                // raise an error if there if the id from attributes and the id from
-                                // the data do not match
-                                if attr_data["id"] != data["id"] {
-                                    return Err(IoError::new(
-                                        IoErrorKind::Other,
-                                        format!(
-                                            "Mismatched ids for line {} of {}: {} != {}",
-                                            line_number,
-                                            &input_path.doc_path,
-                                            attr_data["id"],
-                                            data["id"]
-                                        ),
-                                    ));
-                                }
-
-                                // raise an error if there is no attribute key
-                                if !attr_data["attributes"].is_object() {
-                                    return Err(IoError::new(
-                                        IoErrorKind::Other,
-                                        format!(
-                                            "Missing attributes for line {} of {}",
-                                            line_number, &input_path.doc_path
-                                        ),
-                                    ));
-                                }
-
-                                for (k, v) in attr_data["attributes"].as_object().unwrap().iter() {
-                                    attrs.insert(k.clone(), v.clone());
+                        let attr_data = attr_reader.attributes_for(&data["id"]).map_err(|e| {
+                            IoError::new(
+                                IoErrorKind::Other,
+                                format!(
+                                    "Error joining attributes for line {} of {}: {}",
+                                    line_number, &input_path.doc_path, e
+                                ),
+                            )
+                        })?;
+                        match attr_data {
+                            Some(attributes) => {
+                                for (k, v) in attributes.into_iter() {
+                                    attrs.insert(k, v);
                                 }
                             }
-                            Some(Err(e)) => {
-                                if attr_reader_failure_counts[attr_reader_index] == 0 {
-                                    log::warn!(
-                                        "Error reading attributes from {} at line {}: {}",
-                                        input_path.attribute_paths[attr_reader_index],
-                                        line_number,
-                                        e
-                                    );
-                                }
-                                attr_reader_failure_counts[attr_reader_index] += 1;
-                                break;
-                            }
                             None => {
                                 if attr_reader_failure_counts[attr_reader_index] == 0 {
                                     log::warn!(
@@ -344,7 +406,6 @@ impl Shard {
                                     );
                                 }
                                 attr_reader_failure_counts[attr_reader_index] += 1;
-                                break;
                             }
                         }
                     }
@@ -368,8 +429,15 @@ impl Shard {
                         .should_keep(&data)
                         .map_err(|s| IoError::new(IoErrorKind::Other, s))?;
 
-                    if should_write {
-                        let mut replacements = span_replacers
+                    if should_write && self.passthrough {
+                        // the document is written exactly as it was read
+                        lines_written += 1;
+                        writer.write_all(&raw_line)?;
+                        if !raw_line.ends_with(b"\n") {
+                            writer.write_all(b"\n")?;
+                        }
+                    } else if should_write {
+                        let replacements = span_replacers
                             .iter()
                             .map(|replacer| replacer.find_spans_to_replace(&data))
                             .collect::<Result<Vec<Vec<SpanReplacement>>, IoError>>()?
@@ -378,68 +446,10 @@ impl Shard {
                             .collect::<Vec<SpanReplacement>>();
 
                         if !replacements.is_empty() {
-                            replacements.sort_by(|a, b| a.start.cmp(&b.start));
-
-                            let mut new_text = String::new();
-                            let old_text = data["text"].as_str().unwrap().to_owned();
-                            let mut span_index = 0;
-                            let mut i = 0;
-                            let mut span_start_byte_index = 0;
-                            let mut chars = old_text.char_indices();
-                            let mut byte_index_with_char = chars.next();
-                            while byte_index_with_char.is_some() {
-                                let (byte_index, c) = byte_index_with_char.unwrap();
-                                if span_index < replacements.len() {
-                                    let is_inside_span = i >= replacements[span_index].start
-                                        && i < replacements[span_index].end;
-                                    if i == replacements[span_index].start {
-                                        span_start_byte_index = byte_index;
-                                    }
-                                    if !is_inside_span {
-                                        if i == replacements[span_index].end {
-                                            if !replacements[span_index].replacement.is_empty() {
-                                                let replacement_text = replacements[span_index]
-                                                    .replacement
-                                                    .to_owned()
-                                                    .replace(
-                                                        "{}",
-                                                        old_text[span_start_byte_index..byte_index]
-                                                            .to_owned()
-                                                            .as_str(),
-                                                    );
-                                                new_text.push_str(&replacement_text);
-                                            }
-                                            while span_index < replacements.len()
-                                                && replacements[span_index].start < i
-                                            {
-                                                span_index += 1;
-                                            }
-                                        }
-                                        if span_index < replacements.len()
-                                            && replacements[span_index].start == i
-                                        {
-                                            span_start_byte_index = byte_index;
-                                        } else {
-                                            new_text.push(c);
-                                        }
-                                    }
-                                } else {
-                                    new_text.push(c);
-                                }
-                                i += 1;
-                                byte_index_with_char = chars.next();
-                            }
-                            if span_index < replacements.len()
-                                && !replacements[span_index].replacement.is_empty()
-                            {
-                                let replacement_text =
-                                    replacements[span_index].replacement.to_owned().replace(
-                                        "{}",
-                                        old_text[span_start_byte_index..].to_owned().as_str(),
-                                    );
-                                new_text.push_str(&replacement_text);
-                            }
-
+                            let new_text = SpanReplacement::apply(
+                                data["text"].as_str().unwrap(),
+                                replacements,
+                            );
                             data["text"] = Value::String(new_text);
                         }
 
@@ -491,6 +501,14 @@ impl Shard {
                             failure_count
                         );
                     }
+                    let rows_unmatched = local_attr_readers[index].rows_unmatched();
+                    if rows_unmatched > 0 {
+                        log::warn!(
+                            "{} attribute rows from {} did not match any document",
+                            rows_unmatched,
+                            attribute_path
+                        );
+                    }
 
                     cache.finalize_input(attribute_path)?;
                 }
@@ -543,6 +561,16 @@ pub mod shard_config {
         pub span_replacement: Option<Vec<SpanReplacementConfig>>,
         pub output: StreamOutputConfig,
         pub compression: Option<CompressionConfig>,
+        // how attribute files are matched with documents
+        pub join: Option<AttributesJoinConfig>,
+    }
+
+    #[derive(Serialize, Deserialize, Clone)]
+    pub struct AttributesJoinConfig {
+        // one of lockstep (default), sorted, or hash
+        pub strategy: Option<String>,
+        // rows the hash join keeps in memory before spilling to disk
+        pub max_buffered_rows: Option<usize>,
     }
 
     #[derive(Serialize, Deserialize, Clone)]
@@ -566,6 +594,8 @@ pub mod shard_config {
         pub max_size_in_bytes: usize,
         pub discard_fields: Option<Vec<String>>,
         pub min_text_length: Option<usize>,
+        // copy kept documents to the output as they are, without merging attributes
+        pub passthrough: Option<bool>,
     }
 
     #[derive(Serialize, Deserialize, Clone)]
@@ -596,6 +626,76 @@ pub mod shard_config {
         pub replacement: String,
     }
 
+    impl SpanReplacement {
+        // Replace spans in text. Span offsets are in characters, and spans from all replacers
+        // can be mixed. Overlapping spans are merged into one, which is replaced using the
+        // replacement of the span that starts first; empty spans and spans past the end of the
+        // text are ignored. Output is built in a single pass over the text.
+        pub fn apply(text: &str, mut spans: Vec<SpanReplacement>) -> String {
+            spans.retain(|span| span.start < span.end);
+            if spans.is_empty() {
+                return text.to_owned();
+            }
+
+            // stable sort, so spans starting at the same offset keep the order of the replacers
+            spans.sort_by_key(|span| span.start);
+            let mut merged: Vec<SpanReplacement> = Vec::with_capacity(spans.len());
+            for span in spans {
+                match merged.last_mut() {
+                    Some(last) if span.start < last.end => last.end = last.end.max(span.end),
+                    _ => merged.push(span),
+                }
+            }
+
+            // merged spans are sorted and disjoint, so char offsets can be mapped to byte offsets
+            // by walking the text once; for ASCII text, offsets are the same.
+            let is_ascii = text.is_ascii();
+            let mut char_bytes = text
+                .char_indices()
+                .map(|(byte_offset, _)| byte_offset)
+                .chain(std::iter::once(text.len()));
+            let mut chars_seen = 0;
+            let mut last_byte = 0;
+            let mut to_byte = |char_offset: usize| -> usize {
+                if is_ascii {
+                    return char_offset.min(text.len());
+                }
+                while chars_seen <= char_offset {
+                    match char_bytes.next() {
+                        Some(byte_offset) => {
+                            last_byte = byte_offset;
+                            chars_seen += 1;
+                        }
+                        None => return text.len(),
+                    }
+                }
+                last_byte
+            };
+
+            let mut new_text = String::with_capacity(text.len());
+            let mut cursor = 0;
+            for span in merged.iter() {
+                let start = to_byte(span.start);
+                let end = to_byte(span.end);
+                if start >= end {
+                    // span starts past the end of the text; so do all the ones after it
+                    break;
+                }
+                new_text.push_str(&text[cursor..start]);
+                // `{}` in the replacement is substituted with the text of the span
+                for (i, part) in span.replacement.split("{}").enumerate() {
+                    if i > 0 {
+                        new_text.push_str(&text[start..end]);
+                    }
+                    new_text.push_str(part);
+                }
+                cursor = end;
+            }
+            new_text.push_str(&text[cursor..]);
+            new_text
+        }
+    }
+
     pub struct SpanReplacer {
         selector: Selector,
         min_score: f64,
@@ -648,6 +748,8 @@ pub mod shard_config {
             match self.selector.select(json) {
                 // we found an array of spans; we process them one by one
                 Ok(Value::Array(spans)) => {
+                    // replacement is the same for all spans in a document, so we only get it once
+                    let mut replacement: Option<String> = None;
                     let replacements: Vec<SpanReplacement> = spans
                         .iter()
                         .filter_map(|span| {
@@ -656,12 +758,13 @@ pub mod shard_config {
                             let end = span[1].as_u64().unwrap();
                             let score = span[2].as_f64().unwrap();
                             if score >= self.min_score && score < self.max_score {
-                                let replacement = SpanReplacement {
+                                let replacement = replacement
+                                    .get_or_insert_with(|| self.replacement.get(json).unwrap());
+                                Some(SpanReplacement {
                                     start: start as usize,
                                     end: end as usize,
-                                    replacement: self.replacement.get(json).unwrap(),
-                                };
-                                Some(replacement)
+                                    replacement: replacement.clone(),
+                                })
                             } else {
                                 None
                             }
@@ -877,3 +980,203 @@ pub fn get_object_sizes(locations: &Vec<String>) -> Result<Vec<usize>, IoError>
         ))
     }
 }
+
+#[cfg(test)]
+mod tests {
+    use super::shard_config::{SpanReplacement, SpanReplacementConfig, SpanReplacer};
+    use super::trim_line_ending;
+    use flate2::read::MultiGzDecoder;
+    use serde_json::Value;
+    use std::fs::File;
+    use std::io::{BufRead, BufReader};
+
+    #[test]
+    fn test_trim_line_ending() {
+        assert_eq!(trim_line_ending(b"{}\n"), b"{}");
+        assert_eq!(trim_line_ending(b"{}\r\n"), b"{}");
+        assert_eq!(trim_line_ending(b"{}"), b"{}");
+        assert_eq!(trim_line_ending(b"{}\r"), b"{}\r");
+        assert_eq!(trim_line_ending(b"\n"), b"");
+    }
+
+    fn span(start: usize, end: usize, replacement: &str) -> SpanReplacement {
+        SpanReplacement {
+            start,
+            end,
+            replacement: replacement.to_string(),
+        }
+    }
+
+    #[test]
+    fn test_apply_span_replacements() {
+        let text = "hello world, this is a test";
+        assert_eq!(SpanReplacement::apply(text, vec![]), text);
+        assert_eq!(
+            SpanReplacement::apply(text, vec![span(6, 11, "")]),
+            "hello , this is a test"
+        );
+        // spans are sorted, and the original text is substituted for `{}`
+        assert_eq!(
+            SpanReplacement::apply(text, vec![span(23, 27, "<{}>"), span(0, 5, "[{}|{}]")]),
+            "[hello|hello] world, this is a <test>"
+        );
+        // adjacent spans are replaced separately
+        assert_eq!(
+            SpanReplacement::apply(text, vec![span(0, 5, "A"), span(5, 11, "B")]),
+            "AB, this is a test"
+        );
+        // overlapping spans are merged, and the replacement of the first one is used
+        assert_eq!(
+            SpanReplacement::apply(
+                text,
+                vec![span(3, 11, "B"), span(0, 5, "A"), span(8, 12, "C")]
+            ),
+            "A this is a test"
+        );
+        // empty spans and spans past the end of the text are ignored
+        assert_eq!(
+            SpanReplacement::apply(
+                text,
+                vec![span(4, 4, "X"), span(23, 100, ""), span(200, 300, "Y")]
+            ),
+            "hello world, this is a "
+        );
+    }
+
+    #[test]
+    fn test_apply_span_replacements_unicode() {
+        let text = "héllo wörld ✓ done";
+        assert_eq!(
+            SpanReplacement::apply(text, vec![span(6, 11, "[{}]"), span(12, 13, "")]),
+            "héllo [wörld]  done"
+        );
+        assert_eq!(
+            SpanReplacement::apply(text, vec![span(0, 1, "H"), span(14, 40, "")]),
+            "Héllo wörld ✓ "
+        );
+        assert_eq!(SpanReplacement::apply("✓✓✓", vec![span(1, 2, "x")]), "✓x✓");
+        // overlapping spans over characters of different byte lengths
+        assert_eq!(
+            SpanReplacement::apply("a😀b✓c", vec![span(1, 3, "[{}]"), span(2, 4, "")]),
+            "a[😀b✓]c"
+        );
+    }
+
+    // Reference implementation: mark replaced characters one by one, and emit the replacement
+    // of a merged span at the character where it starts.
+    fn apply_char_by_char(text: &str, spans: &[SpanReplacement]) -> String {
+        let chars: Vec<char> = text.chars().collect();
+        let mut sorted: Vec<&SpanReplacement> = spans.iter().filter(|s| s.start < s.end).collect();
+        sorted.sort_by_key(|s| s.start);
+        let mut merged: Vec<(usize, usize, &str)> = Vec::new();
+        for s in sorted {
+            match merged.last_mut() {
+                Some(last) if s.start < last.1 => last.1 = last.1.max(s.end),
+                _ => merged.push((s.start, s.end, &s.replacement)),
+            }
+        }
+        let mut new_text = String::new();
+        let mut i = 0;
+        for (start, end, replacement) in merged {
+            if start >= chars.len() {
+                break;
+            }
+            let end = end.min(chars.len());
+            new_text.extend(&chars[i..start]);
+            let original: String = chars[start..end].iter().collect();
+            new_text.push_str(&replacement.replace("{}", &original));
+            i = end;
+        }
+        new_text.extend(&chars[i..]);
+        new_text
+    }
+
+    #[test]
+    fn test_apply_span_replacements_random() {
+        use rand::rngs::StdRng;
+        use rand::{Rng, SeedableRng};
+
+        let alphabet = ['a', 'é', '✓', '😀', ' '];
+        let replacements = ["", "x", "[{}]", "{}{}"];
+        let mut rng = StdRng::seed_from_u64(42);
+        for _ in 0..2000 {
+            let text: String = (0..rng.gen_range(0..20))
+                .map(|_| alphabet[rng.gen_range(0..alphabet.len())])
+                .collect();
+            let spans: Vec<SpanReplacement> = (0..rng.gen_range(0..5))
+                .map(|_| {
+                    let start = rng.gen_range(0..25);
+                    span(
+                        start,
+                        start + rng.gen_range(0..8),
+                        replacements[rng.gen_range(0..replacements.len())],
+                    )
+                })
+                .collect();
+            let expected = apply_char_by_char(&text, &spans);
+            assert_eq!(SpanReplacement::apply(&text, spans), expected, "{:?}", text);
+        }
+    }
+
+    fn read_jsonl(path: &str) -> Vec<Value> {
+        BufReader::new(MultiGzDecoder::new(File::open(path).unwrap()))
+            .lines()
+            .map(|line| serde_json::from_str(&line.unwrap()).unwrap())
+            .collect()
+    }
+
+    // Replace spans in the documents of tests/data/provided as the mixer tests configure it,
+    // and check the text against their expected outputs.
+    fn check_provided_spans(attribute: &str, spans: Vec<(&str, &str)>, expected: &str) {
+        let replacers: Vec<SpanReplacer> = spans
+            .into_iter()
+            .map(|(span, replacement)| {
+                SpanReplacer::new(&SpanReplacementConfig {
+                    span: span.to_string(),
+                    min_score: Some(0.5),
+                    max_score: None,
+                    replacement: replacement.to_string(),
+                    syntax: None,
+                })
+            })
+            .collect();
+        let docs = read_jsonl("tests/data/provided/documents/000.json.gz");
+        let attrs = read_jsonl(&format!(
+            "tests/data/provided/attributes/{}/000.json.gz",
+            attribute
+        ));
+        let expected = read_jsonl(&format!("tests/data/expected/{}.json.gz", expected));
+        assert_eq!(docs.len(), expected.len());
+
+        for ((doc, attrs), expected) in docs.iter().zip(attrs.iter()).zip(expected.iter()) {
+            assert_eq!(doc["id"], expected["id"]);
+            let replacements = replacers
+                .iter()
+                .flat_map(|replacer| replacer.find_spans_to_replace(attrs).unwrap())
+                .collect();
+            let text = SpanReplacement::apply(doc["text"].as_str().unwrap(), replacements);
+            assert_eq!(text, expected["text"].as_str().unwrap(), "{}", doc["id"]);
+        }
+    }
+
+    #[test]
+    fn test_email_spans() {
+        check_provided_spans(
+            "pii",
+            vec![
+                ("$.attributes.pii.email", "[B-EMAIL]{}[E-EMAIL]"),
+                ("$.attributes.pii.company_name", ""),
+            ],
+            "email-spans",
+        );
+    }
+
+    #[test]
+    fn test_paragraph_spans() {
+        check_provided_spans(
+            "duplicate_paragraphs",
+            vec![("$.attributes.bff_duplicate_paragraph_spans", "")],
+            "remove-paragraphs",
+        );
+    }
+}
@@ -6,10 +6,14 @@ Unit tests for taggers/*.py
 
 """
 
+import random
 from unittest import TestCase
+from unittest.mock import patch
 
+from dolma.core import keyword_matcher
 from dolma.core.data_types import Document
-from dolma.taggers.c4 import C4Tagger, FasterC4Tagger
+from dolma.core.keyword_matcher import KeywordMatcher
+from dolma.taggers.c4 import NAUGHTY_PHRASES, NAUGHTY_WORDS, C4Tagger, FasterC4Tagger
 
 
 class TestC4Tagger(TestCase):
@@ -121,3 +125,45 @@ class TestC4Tagger(TestCase):
 class TestFasterC4Tagger(TestC4Tagger):
     def setUp(self):
         self.tagger = FasterC4Tagger()
+
+
+class TestKeywordMatcher(TestCase):
+    def make_matcher(self, words=(), phrases=()) -> KeywordMatcher:
+        return KeywordMatcher(words=words, phrases=phrases)
+
+    def test_words_match_whole_tokens(self):
+        matcher = self.make_matcher(words=["ass", "anal"], phrases=["strap on"])
+        self.assertEqual(matcher.search("an ass here"), (3, 6, "ass"))
+        self.assertEqual(matcher.search("ass"), (0, 3, "ass"))
+        self.assertEqual(matcher.search("a\tanal\n"), (2, 6, "anal"))
+        self.assertIsNone(matcher.search("class analysis assessment ass,"))
+        self.assertIsNone(matcher.search(""))
+
+    def test_phrases_match_anywhere(self):
+        matcher = self.make_matcher(words=["ass"], phrases=["strap on", "two girls"])
+        self.assertEqual(matcher.search("we strap onto it"), (3, 11, "strap on"))
+        self.assertEqual(matcher.search("xtwo girlsx"), (1, 10, "two girls"))
+        self.assertIsNone(matcher.search("strap, on"))
+
+    def test_empty(self):
+        self.assertIsNone(self.make_matcher().search("anything at all"))
+        self.assertIsNone(self.make_matcher(words=["ass"]).search("a phrase"))
+        self.assertIsNone(self.make_matcher(phrases=["strap on"]).search("ass"))
+
+    def test_same_as_sets(self):
+        rng = random.Random(0)
+        vocab = list(NAUGHTY_WORDS) + [p for phrase in NAUGHTY_PHRASES for p in phrase.split()] + ["the", "a"]
+        matcher = self.make_matcher(words=NAUGHTY_WORDS, phrases=NAUGHTY_PHRASES)
+        for _ in range(500):
+            tokens = [rng.choice(vocab) + rng.choice(["", "", "", ",", "s"]) for _ in range(rng.randint(0, 8))]
+            text = "".join(t + rng.choice([" ", "\n", "  "]) for t in tokens)
+            expected = any(w in NAUGHTY_WORDS for w in text.split()) or any(p in text for p in NAUGHTY_PHRASES)
+            self.assertEqual(matcher.search(text) is not None, expected, text)
+
+
+class TestKeywordMatcherRegex(TestKeywordMatcher):
+    def make_matcher(self, words=(), phrases=()) -> KeywordMatcher:
+        with patch.object(keyword_matcher, "AHOCORASICK_AVAILABLE", False):
+            matcher = KeywordMatcher(words=words, phrases=phrases)
+        self.assertIsNone(matcher._automaton)
+        return matcher
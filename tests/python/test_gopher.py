@@ -6,10 +6,16 @@ Unit tests for taggers/*.py
 
 """
 
+import random
 from unittest import TestCase
 
 from dolma.core.data_types import Document
-from dolma.taggers.gopher import GopherTagger
+from dolma.taggers.gopher import (
+    COUNT_MOST_COMMON_NGRAMS,
+    GopherTagger,
+    all_ngram_counts,
+    ngram_statistics,
+)
 
 
 class TestGopherTagger(TestCase):
@@ -301,3 +307,34 @@ class TestGopherTagger(TestCase):
         d = doc_result.to_json()
         self.assertEqual(d["spans"][7]["type"], "required_word_count")
         self.assertEqual(d["spans"][7]["score"], 2.0)
+
+
+class TestNgramStatistics(TestCase):
+    def reference(self, words):
+        most_common, duplicate = [], []
+        character_count = sum(len(w) for w in words)
+        for n, ngram_counts in all_ngram_counts(words):
+            if not ngram_counts:
+                continue
+            if n in COUNT_MOST_COMMON_NGRAMS:
+                ngram, count = ngram_counts.most_common(1)[0]
+                most_common.append((n, count * sum(len(w) for w in ngram) / max(character_count, 1)))
+            else:
+                ng_char_count = sum(count * sum(len(w) for w in ng) for ng, count in ngram_counts.items())
+                dup_char_count = sum(
+                    count * sum(len(w) for w in ng) for ng, count in ngram_counts.items() if count > 1
+                )
+                duplicate.append((n, dup_char_count / max(ng_char_count, 1)))
+        return most_common, duplicate
+
+    def test_same_as_counter(self):
+        rng = random.Random(0)
+        vocab = ["a", "bb", "ccc", "the", "of", "and", "dddddddd"]
+        for _ in range(500):
+            words = [rng.choice(vocab[: rng.randint(1, len(vocab))]) for _ in range(rng.randint(0, 60))]
+            self.assertEqual(ngram_statistics(words), self.reference(words), words)
+
+    def test_ids(self):
+        words = "the cat and the dog and the cat and the dog".split()
+        ids = [{"the": 7, "cat": 3, "and": 1, "dog": 9}[w] for w in words]
+        self.assertEqual(ngram_statistics(words, ids=ids), self.reference(words))
@@ -1,8 +1,14 @@
+import re
+import tempfile
 import unittest
 from typing import Callable, Dict, List, Optional, Tuple, Type
+from unittest.mock import Mock
+
+import fasttext
 
 from dolma.core import BaseTagger, Document, Span
 from dolma.taggers.language import (
+    CascadeLanguageTaggerParagraph,
     Cld2EnglishLanguageParagraphTagger,
     Cld2EnglishLanguageTagger,
     Cld2LanguageFilterParagraphWithDocScoreTagger,
@@ -19,6 +25,8 @@ from dolma.taggers.language import (
     LinguaEnglishTaggerParagraph,
     LinguaTagger,
     LinguaTaggerParagraph,
+    LruCache,
+    dominant_script,
 )
 
 ENGLISH_PARAGRAPH = """
@@ -38,6 +46,28 @@ JAPANESE_PARAGRAPH = """
 """.strip()
 
 
+def train_tiny_fasttext_model(path: str) -> None:
+    """Train a tiny fastText model for en, fr, it, and ja on the sentences of the paragraphs above; training
+    uses a single thread, so the model is the same on every run."""
+    paragraphs = {
+        "en": ENGLISH_PARAGRAPH,
+        "fr": FRENCH_PARAGRAPH,
+        "it": ITALIAN_PARAGRAPH,
+        "ja": JAPANESE_PARAGRAPH,
+    }
+    train_path = f"{path}.train.txt"
+    with open(train_path, "w", encoding="utf-8") as f:
+        for lang, paragraph in paragraphs.items():
+            for sentence in re.split(r"(?<=[.。])\s*", paragraph.lower().replace("\n", " ")):
+                if sentence:
+                    f.write(f"__label__{lang} {sentence}\n")
+
+    model = fasttext.train_supervised(
+        train_path, dim=8, bucket=2000, minn=1, maxn=3, epoch=100, lr=1.0, thread=1, verbose=0
+    )
+    model.save_model(path)
+
+
 class BaseEnglishTaggerTest:
     doc_tagger_cls: Type[BaseTagger]
     par_tagger_cls: Type[BaseTagger]
@@ -191,3 +221,169 @@ class TestLingua(BaseMultilingualTaggerTest, unittest.TestCase):
 class TestLinguaEnglish(BaseEnglishTaggerTest, unittest.TestCase):
     doc_tagger_cls = LinguaEnglishTagger
     par_tagger_cls = LinguaEnglishTaggerParagraph
+
+
+class TestLruCache(unittest.TestCase):
+    def test_eviction(self):
+        cache: LruCache[str, int] = LruCache(max_size=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+
+        # "b" is now the least recently used item
+        cache.put("c", 3)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+
+
+class CountingCld2Tagger(Cld2LanguageTaggerParagraph):
+    CACHE_SIZE = 4
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.calls: List[str] = []
+
+    def predict_text(self, text: str) -> List[Tuple[str, float]]:
+        self.calls.append(text)
+        return super().predict_text(text)
+
+
+class TestBatchedPrediction(unittest.TestCase):
+    def setUp(self) -> None:
+        self.docs = [
+            Document(text=f"Home\n{ENGLISH_PARAGRAPH}\nShare this", id="0", source=__file__),
+            Document(text=f"Home\n{FRENCH_PARAGRAPH}\nHome", id="1", source=__file__),
+            Document(text=f"{ITALIAN_PARAGRAPH}\n{JAPANESE_PARAGRAPH}\nShare this", id="2", source=__file__),
+            Document(text="", id="3", source=__file__),
+        ]
+
+    def test_batch_same_as_single(self):
+        for tagger_cls in (Cld2LanguageTagger, Cld2LanguageFilterParagraphWithDocScoreTagger, LinguaEnglishTagger):
+            tagger = tagger_cls()
+            expected = [tagger_cls().predict(doc).spans for doc in self.docs]
+            self.assertEqual([r.spans for r in tagger.predict_batch(self.docs)], expected)
+
+    def test_cache(self):
+        tagger = CountingCld2Tagger()
+        results = tagger.predict_batch(self.docs)
+        expected = [Cld2LanguageTaggerParagraph().predict(doc).spans for doc in self.docs]
+        self.assertEqual([r.spans for r in results], expected)
+
+        # repeated paragraphs are only classified once
+        self.assertEqual(tagger.calls.count("Home\n"), 1)
+        self.assertEqual(tagger.calls.count("Share this"), 1)
+
+        # short paragraphs are looked up in the cache on later calls, long ones are classified again
+        tagger.calls.clear()
+        self.assertEqual(tagger.predict(self.docs[0]).spans, results[0].spans)
+        self.assertEqual(tagger.calls, [f"{ENGLISH_PARAGRAPH}\n"])
+
+    def test_cache_disabled(self):
+        tagger = CountingCld2Tagger()
+        tagger.CACHE_SIZE = 0
+        tagger.predict(self.docs[0])
+        tagger.predict(self.docs[0])
+        self.assertEqual(tagger.calls.count("Home\n"), 2)
+
+    def test_lingua_parallel_prediction(self):
+        texts = [ENGLISH_PARAGRAPH, FRENCH_PARAGRAPH, "Share this"]
+
+        # texts are classified one by one unless parallel prediction is enabled
+        tagger = LinguaTagger()
+        tagger.detector = Mock(wraps=tagger.detector)
+        expected = tagger.predict_texts(texts)
+        tagger.detector.compute_language_confidence_values_in_parallel.assert_not_called()
+
+        # the thread pool may sum probabilities in a different order, so scores can differ in the last digits
+        tagger.PARALLEL_PREDICTION = True
+        for predicted, expected_predicted in zip(tagger.predict_texts(texts), expected):
+            self.assertEqual([lang for lang, _ in predicted], [lang for lang, _ in expected_predicted])
+            for (_, score), (_, expected_score) in zip(predicted, expected_predicted):
+                self.assertAlmostEqual(score, expected_score)
+        tagger.detector.compute_language_confidence_values_in_parallel.assert_called_once()
+
+
+class TinyFastTextDocumentTagger(FastTextAllLanguagesDocumentTagger):
+    MODEL_PATH = ""
+
+
+class TinyFastTextParagraphTagger(FastTextAllLanguageParagraphTagger):
+    MODEL_PATH = ""
+
+
+class TestBatchedFastTextPrediction(unittest.TestCase):
+    setUp = TestBatchedPrediction.setUp
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.model_dir = tempfile.TemporaryDirectory()
+        model_path = f"{cls.model_dir.name}/tiny-lid.bin"
+        train_tiny_fasttext_model(model_path)
+        TinyFastTextDocumentTagger.MODEL_PATH = TinyFastTextParagraphTagger.MODEL_PATH = model_path
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.model_dir.cleanup()
+
+    def test_batch_same_as_single(self):
+        for tagger_cls in (TinyFastTextDocumentTagger, TinyFastTextParagraphTagger):
+            tagger = tagger_cls()
+            expected = [tagger_cls().predict(doc).spans for doc in self.docs]
+            self.assertEqual([r.spans for r in tagger.predict_batch(self.docs)], expected)
+
+    def test_predict_texts(self):
+        tagger = TinyFastTextDocumentTagger()
+        texts = [ENGLISH_PARAGRAPH, FRENCH_PARAGRAPH, ITALIAN_PARAGRAPH, JAPANESE_PARAGRAPH, ""]
+        self.assertEqual(tagger.predict_texts(texts), [tagger.predict_text(text) for text in texts])
+        self.assertEqual(
+            [max(preds, key=lambda p: p[1])[0] for preds in tagger.predict_texts(texts[:4])],
+            ["en", "fr", "it", "ja"],
+        )
+
+
+class Cld2LinguaCascadeTagger(CascadeLanguageTaggerParagraph):
+    # the fastText model is not needed to test the cascade logic
+    BACKENDS = ("cld2", "lingua")
+
+
+class TestCascadeLanguageTagger(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tagger = Cld2LinguaCascadeTagger()
+
+    def test_dominant_script(self):
+        self.assertEqual(dominant_script(ENGLISH_PARAGRAPH), "Latin")
+        self.assertIn(dominant_script(JAPANESE_PARAGRAPH), {"Han", "Hiragana", "Katakana"})
+        self.assertEqual(dominant_script("Привет, мир! Hello"), "Cyrillic")
+        self.assertIsNone(dominant_script("1234 !?"))
+
+    def test_cascade(self):
+        doc = Document(text=f"{ENGLISH_PARAGRAPH}\nShare this\n{FRENCH_PARAGRAPH}", id="0", source=__file__)
+        result = self.tagger.predict(doc)
+
+        by_paragraph: Dict[Tuple[int, int], Dict[str, float]] = {}
+        for span in result.spans:
+            by_paragraph.setdefault((span.start, span.end), {})[span.type] = span.score
+        english, share, french = (by_paragraph[k] for k in sorted(by_paragraph))
+
+        # long paragraphs are decided by cld2; short ones are too hard for it, so lingua decides
+        self.assertEqual(max(english, key=english.__getitem__), "decided_by_cld2")
+        self.assertGreater(english["en"], 0.9)
+        self.assertIn("decided_by_lingua", share)
+        self.assertNotIn("decided_by_cld2", share)
+        self.assertIn("decided_by_cld2", french)
+        self.assertGreater(french["fr"], 0.9)
+
+    def test_script_mismatch(self):
+        class WrongScriptCascadeTagger(Cld2LinguaCascadeTagger):
+            def predict_with_backend(self, backend: str, texts: List[str]) -> List[List[Tuple[str, float]]]:
+                if backend == "cld2":
+                    return [[("en", 1.0)] for _ in texts]
+                return super().predict_with_backend(backend, texts)
+
+        tagger = WrongScriptCascadeTagger()
+        english, japanese = tagger.predict_texts([ENGLISH_PARAGRAPH, JAPANESE_PARAGRAPH])
+        self.assertEqual(english, [("en", 1.0), ("decided_by_cld2", 1.0)])
+        self.assertEqual(japanese[-1], ("decided_by_lingua", 1.0))
+        self.assertEqual(max(japanese[:-1], key=lambda p: p[1])[0], "ja")
@@ -1,12 +1,16 @@
 import json
 from pathlib import Path
 from tempfile import NamedTemporaryFile, TemporaryDirectory
-from typing import List
+from typing import List, Tuple
 from unittest import TestCase
+from unittest.mock import patch
 
 import smart_open
+from rich.console import Console
 
 from dolma.cli.__main__ import main
+from dolma.cli.mixer import print_plan
+from dolma.core.errors import DolmaConfigError
 
 from .utils import (
     TestCasePipeline,
@@ -252,3 +256,208 @@ class TestMixerPipeline(TestCasePipeline):
 
             with self.assertRaises(Exception):
                 main(argv=["-c", str(config_fp), "mix"])
+
+    def _run_passthrough(self, filter_config: dict) -> Tuple[List[str], List[str]]:
+        source_dir = Path(self.makeUniquePath())
+        output_dir = Path(self.makeUniquePath())
+
+        # non-compact separators, escaped characters, and extra fields are all kept in passthrough
+        documents = [
+            {"id": str(i), "text": text, "source": __file__, "metadata": {"title": f"Café {i}"}}
+            for i, text in enumerate(["short", "a longer document", "another long document", "tiny"])
+        ]
+        docs_path = self.writeUnits(units=documents, unit_type="documents", ext_dir=source_dir)
+
+        # line endings are mixed too; passthrough keeps them as they are
+        input_lines = [json.dumps(doc) + ("\r\n" if i % 2 == 0 else "\n") for i, doc in enumerate(documents)]
+        with smart_open.open(docs_path[0], "wb") as f:
+            f.write("".join(input_lines).encode("utf-8"))
+
+        self.writeAttributes(
+            attributes=[[(0, 5, 0.9)], [(0, 17, 0.1)], [(0, 21, 0.8)], []],
+            attribute_name="test",
+            ext_dir=source_dir,
+        )
+
+        config = {
+            "streams": [
+                {
+                    "name": "test",
+                    "documents": docs_path,
+                    "attributes": ["test"],
+                    "output": {"path": str(output_dir), "max_size_in_bytes": 10000000, "passthrough": True},
+                    "filter": filter_config,
+                }
+            ],
+            "processes": 1,
+        }
+        config_path = self.writeConfig(config=config)
+        main(argv=["-c", config_path, "mix"])
+
+        output_lines: List[str] = []
+        for path in sorted(output_dir.iterdir()):
+            with smart_open.open(path, "rb") as f:
+                output_lines.extend(ln.decode("utf-8") for ln in f)
+        return input_lines, output_lines
+
+    def test_passthrough_attributes_only(self):
+        input_lines, output_lines = self._run_passthrough({"include": ["$.attributes[?(@.test[0][2] > 0.5)]"]})
+        self.assertEqual(output_lines, [input_lines[0], input_lines[2]])
+
+    def test_passthrough_full_document(self):
+        input_lines, output_lines = self._run_passthrough(
+            {"include": [".text | length > 5"], "exclude": [".attributes.test[0][2]? > 0.5"], "syntax": "jq"}
+        )
+        self.assertEqual(output_lines, [input_lines[1]])
+
+    def test_passthrough_rejects_span_replacement(self):
+        source_dir = Path(self.makeUniquePath())
+        output_dir = Path(self.makeUniquePath())
+
+        docs_path = self.writeDocs(docs=["This is a test"], ext_dir=source_dir)
+        self.writeAttributes(attributes=[[(0, 4, 1.0)]], attribute_name="test", ext_dir=source_dir)
+
+        config = {
+            "streams": [
+                {
+                    "name": "test",
+                    "documents": docs_path,
+                    "attributes": ["test"],
+                    "output": {"path": str(output_dir), "max_size_in_bytes": 10000000, "passthrough": True},
+                    "span_replacement": [{"span": "$.attributes.test", "min_score": 0.5, "replacement": ""}],
+                }
+            ],
+            "processes": 1,
+        }
+        config_path = self.writeConfig(config=config)
+
+        with self.assertRaises(DolmaConfigError):
+            main(argv=["-c", config_path, "mix"])
+
+    def test_invalid_join_strategy(self):
+        source_dir = Path(self.makeUniquePath())
+        output_dir = Path(self.makeUniquePath())
+
+        docs_path = self.writeDocs(docs=["This is a test"], ext_dir=source_dir)
+        self.writeAttributes(attributes=[[(0, 4, 1.0)]], attribute_name="test", ext_dir=source_dir)
+
+        config = {
+            "streams": [
+                {
+                    "name": "test",
+                    "documents": docs_path,
+                    "attributes": ["test"],
+                    "output": {"path": str(output_dir), "max_size_in_bytes": 10000000},
+                    "filter": {"include": ["$.attributes[?(@.test[0][2] > 0.5)]"]},
+                    "join": {"strategy": "merge"},
+                }
+            ],
+            "processes": 1,
+        }
+        config_path = self.writeConfig(config=config)
+
+        with self.assertRaises(DolmaConfigError):
+            main(argv=["-c", config_path, "mix"])
+
+    def _run_join(self, attribute_ids: List[str], join_config: dict) -> List[str]:
+        source_dir = Path(self.makeUniquePath())
+        output_dir = Path(self.makeUniquePath())
+
+        docs_path = self.writeDocs(docs=[f"document {i}" for i in range(5)], ext_dir=source_dir)
+        scores = {"0": 0.9, "1": 0.1, "2": 0.6, "3": 0.8, "4": 0.7, "9": 1.0}
+        attributes = [{"id": i, "attributes": {"test": [[0, 10, scores[i]]]}} for i in attribute_ids]
+        self.writeUnits(units=attributes, unit_type="attributes/test", ext_dir=source_dir)
+
+        config = {
+            "streams": [
+                {
+                    "name": "test",
+                    "documents": docs_path,
+                    "attributes": ["test"],
+                    "output": {"path": str(output_dir), "max_size_in_bytes": 10000000},
+                    "filter": {"include": ["$.attributes[?(@.test[0][2] > 0.5)]"]},
+                    "join": join_config,
+                }
+            ],
+            "processes": 1,
+        }
+        config_path = self.writeConfig(config=config)
+        main(argv=["-c", config_path, "mix"])
+
+        return [doc["id"] for doc in self.readUnits(list(output_dir.iterdir()))]
+
+    def test_hash_join(self):
+        # rows out of order, a row without a document, and a document without a row
+        attribute_ids = ["3", "0", "9", "4", "1"]
+        self.assertEqual(self._run_join(attribute_ids, {"strategy": "hash"}), ["0", "3", "4"])
+
+        # same join, with most rows spilled to disk
+        config = {"strategy": "hash", "max_buffered_rows": 1}
+        self.assertEqual(self._run_join(attribute_ids, config), ["0", "3", "4"])
+
+    def test_sorted_join(self):
+        self.assertEqual(self._run_join(["0", "1", "3", "4", "9"], {"strategy": "sorted"}), ["0", "3", "4"])
+
+        # once rows are found to be out of order, the rest of the documents are joined with the hash join;
+        # document 0 was passed before its row was read, so it has no attributes
+        self.assertEqual(self._run_join(["3", "0", "4"], {"strategy": "sorted"}), ["3", "4"])
+
+    def test_lockstep_join_rejects_out_of_order(self):
+        self.assertEqual(self._run_join(["0", "1", "2", "3", "4"], {"strategy": "lockstep"}), ["0", "2", "3", "4"])
+        with self.assertRaises(Exception):
+            self._run_join(["3", "0", "9", "4", "1"], {"strategy": "lockstep"})
+
+    def test_plan(self):
+        with open(MIXER) as f:
+            config = json.load(f)
+        config["plan"] = True
+        config_path = self.writeConfig(config=config)
+
+        with patch("dolma.cli.mixer.print_plan") as print_plan_mock, patch("dolma.cli.mixer.mixer") as mixer_mock:
+            main(argv=["-c", config_path, "mix"])
+        mixer_mock.assert_not_called()
+        (plans,), _ = print_plan_mock.call_args
+
+        # the only input file is sampled in full, so estimates are exact
+        (plan,) = plans
+        self.assertEqual(plan["name"], "mixer-test")
+        self.assertEqual((plan["input_files"], plan["sampled_files"], plan["sampled_documents"]), (1, 1, 10))
+        self.assertEqual(plan["documents"], {"value": 10.0, "low": 10.0, "high": 10.0})
+
+        kept = len(load_jsonl("tests/data/expected/mixer.json.gz"))
+        self.assertEqual(plan["kept_documents"], {"value": kept, "low": kept, "high": kept})
+        self.assertGreater(plan["kept_bytes"]["value"], 0)
+        self.assertEqual(plan["kept_bytes"]["low"], plan["kept_bytes"]["high"])
+
+    def test_plan_requires_positive_sizes(self):
+        with open(MIXER) as f:
+            config = json.load(f)
+        for sizes in ({"plan_sample_size": 0}, {"plan_max_files": 0}):
+            config_path = self.writeConfig(config={**config, "plan": True, **sizes})
+            with patch("dolma.cli.mixer.mixer_plan") as mixer_plan_mock, self.assertRaises(DolmaConfigError):
+                main(argv=["-c", config_path, "mix"])
+            mixer_plan_mock.assert_not_called()
+
+    def test_print_plan(self):
+        estimate = {"value": 1500.0, "low": 1200.0, "high": 1800.0}
+        plans = [
+            {
+                "name": "test",
+                "input_files": 4,
+                "input_bytes": 3 * 1024**2,
+                "sampled_files": 2,
+                "sampled_documents": 100,
+                "documents": {"value": 2000.0, "low": 2000.0, "high": 2000.0},
+                "kept_documents": estimate,
+                "kept_bytes": {"value": 2048.0, "low": 1024.0, "high": 4096.0},
+                "shards": 1,
+            }
+        ]
+        console = Console(record=True, width=200)
+        print_plan(plans, console=console)
+        output = console.export_text()
+
+        self.assertIn("3.0 MB", output)
+        self.assertIn("1,500 (1,200 - 1,800)", output)
+        self.assertIn("2.0 KB (1.0 KB - 4.0 KB)", output)
+        self.assertIn("2,000", output)
@@ -0,0 +1,85 @@
+"""
+
+Unit tests for taggers/pii.py
+
+"""
+
+import re
+from unittest import TestCase
+
+from dolma.core.data_types import Document
+from dolma.taggers.pii import FastPiiRegex, PiiRegexScanner, PiiRegexV1
+
+TEXT_WITH_PII = (
+    "Write to john.doe@example.com or call 555 123 4567.\n"
+    "The server is at 192.168.0.1, see the ISBN 1234 on page 10.\n"
+)
+TEXT_WITHOUT_PII = "A document with no emails, phone numbers or addresses.\nJust words."
+
+
+class TestPiiRegexScanner(TestCase):
+    def setUp(self):
+        self.tagger = PiiRegexV1()
+        self.scanner = self.tagger.pii_scanner
+
+    def test_same_as_regexes(self):
+        for text in (TEXT_WITH_PII, TEXT_WITHOUT_PII, "", "x@y 1.2.3.4 @ 12 1234"):
+            expected = [
+                (pii_type, match.span())
+                for pii_type, regex in self.tagger.pii_type_to_regex.items()
+                for match in regex.finditer(text)
+            ]
+            self.assertEqual([(pii_type, match.span()) for pii_type, match in self.scanner.scan(text)], expected)
+
+    def test_prefilter(self):
+        self.assertTrue(self.scanner.may_contain_pii(TEXT_WITH_PII))
+        self.assertFalse(self.scanner.may_contain_pii(TEXT_WITHOUT_PII))
+        self.assertFalse(self.scanner.may_contain_pii("no candidates in 202 either."))
+        self.assertEqual(list(self.scanner.scan(TEXT_WITHOUT_PII)), [])
+
+    def test_missing_prefilter(self):
+        with self.assertRaises(ValueError):
+            PiiRegexScanner(patterns={"EMAIL_ADDRESS": re.compile("@")}, prefilters={})
+
+
+class TestPiiRegexV1(TestCase):
+    def setUp(self):
+        self.tagger = PiiRegexV1()
+
+    def test_predict(self):
+        doc = Document(source="", version="", id="", text=TEXT_WITH_PII)
+        result = self.tagger.predict(doc=doc)
+        self.assertEqual(
+            [(s.mention(doc.text).strip(), s.type) for s in result.spans if s.type != "doc"],
+            [
+                ("john.doe@example.com", "EMAIL_ADDRESS"),
+                ("555 123 4567", "PHONE_NUMBER"),
+                ("192.168.0.1", "IP_ADDRESS"),
+            ],
+        )
+
+        doc = Document(source="", version="", id="", text=TEXT_WITHOUT_PII)
+        result = self.tagger.predict(doc=doc)
+        self.assertEqual([s.type for s in result.spans], ["doc"])
+        self.assertEqual(result.spans[0].score, 0.0)
+
+
+class TestFastPiiRegex(TestCase):
+    def setUp(self):
+        self.tagger = FastPiiRegex()
+
+    def test_predict(self):
+        doc = Document(source="", version="", id="", text=TEXT_WITH_PII)
+        result = self.tagger.predict(doc=doc)
+        self.assertEqual(
+            [(s.mention(doc.text).strip(" .\n"), s.type) for s in result.spans if s.type.isupper()],
+            [
+                ("john.doe@example.com", "EMAIL_ADDRESS"),
+                ("555 123 4567", "PHONE_NUMBER"),
+                ("192.168.0.1", "IP_ADDRESS"),
+            ],
+        )
+
+        doc = Document(source="", version="", id="", text=TEXT_WITHOUT_PII)
+        result = self.tagger.predict(doc=doc)
+        self.assertEqual([(s.type, s.score) for s in result.spans], [("doc_count", 0.0), ("doc_frac", 1.0)])
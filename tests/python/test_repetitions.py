@@ -102,6 +102,13 @@ class TestRepetitionsTagger(unittest.TestCase):
         self.assertEqual(all_result.spans[2].score, 0)
         self.assertEqual(all_result.spans[2], par_result.spans[2])
 
+    def test_time_budget(self):
+        self.repetitions_tagger.time_budget = -1.0
+        result = self.repetitions_tagger.predict(self.doc_with_reps)
+        self.assertEqual([s.type for s in result.spans if s.type == "repetition"], [])
+        self.assertEqual(result.spans[-1].type, "doc_frac_repetition")
+        self.assertEqual(result.spans[-1].score, 0)
+
 
 class TestTokenizerRepetitionsTagger(unittest.TestCase):
     def setUp(self) -> None:
@@ -1,15 +1,46 @@
+import random
+import re
+import time
+from typing import Iterator, Tuple
 from unittest import TestCase
 
 import numpy as np
 
 from dolma.taggers.repetitions.utils import (
+    find_char_repetitions,
     find_end_first_consecutive_true,
     find_periodic_sequences,
+    find_periodic_sequences_batch,
     find_start_last_consecutive_true,
     group_consecutive_values,
 )
 
 
+def _find_periodic_sequences_reference(
+    arr: np.ndarray, max_period: int, min_period: int = 1, mask_value: int = -1
+) -> Iterator[Tuple[int, int, int, int]]:
+    """The original implementation of `find_periodic_sequences`, which reshapes the array for every period."""
+    max_period = min(max_period, len(arr) // 3)
+    for period in range(min_period, max_period + 1):
+        padded_arr = np.pad(arr, (0, period - (len(arr) % period)), constant_values=mask_value)
+        shaped_arr = padded_arr.reshape(-1, period)
+        is_equal_to_prev_row = shaped_arr == np.roll(shaped_arr, shift=1, axis=0)
+        rows_with_period, *_ = np.where(is_equal_to_prev_row.all(axis=1))
+        if len(rows_with_period) == 0:
+            continue
+
+        for sequence in group_consecutive_values(rows_with_period):
+            start_row = sequence[0]
+            end_row = sequence[-1]
+            start_offset = find_start_last_consecutive_true(is_equal_to_prev_row[start_row - 1])
+            start_offset = period - start_offset if start_offset > 0 else 0
+            end_offset = find_end_first_consecutive_true(is_equal_to_prev_row[end_row + 1])
+            start_pos = (start_row - 1) * period - start_offset
+            end_pos = ((end_row + 1) * period) + end_offset
+            if (end_pos - start_pos) // period > 2:
+                yield (start_pos, end_pos, period, (end_pos - start_pos) // period)
+
+
 class TestTrueLocsDetection(TestCase):
     def test_find_end_first_consecutive_true(self):
         arr = np.array([True, True, False, True])
@@ -124,3 +155,96 @@ class TestTrueLocsDetection(TestCase):
         arr = np.array(list(map(int, "112233445566778899")))
         sequences = list(find_periodic_sequences(arr, max_period=10))
         self.assertEqual(len(sequences), 0)
+
+    def test_find_periodic_sequences_batch(self):
+        arrs = [
+            self._to_array("5000007"),
+            self._to_array(""),
+            self._to_array("123456789"),
+            np.array(list(map(int, "004646464639955055055046550"))),
+        ]
+        batched = find_periodic_sequences_batch(arrs, min_period=1, max_period=3)
+        self.assertEqual(len(batched), len(arrs))
+        for arr, sequences in zip(arrs, batched):
+            self.assertEqual(sequences, list(find_periodic_sequences(arr, min_period=1, max_period=3)))
+        self.assertEqual(batched[0], [(1, 6, 1, 5)])
+        self.assertEqual(batched[1], [])
+        self.assertEqual(batched[3], [(2, 10, 2, 4), (13, 22, 3, 3)])
+
+        # repetitions never span two arrays
+        batched = find_periodic_sequences_batch([self._to_array("1212"), self._to_array("1212")], max_period=2)
+        self.assertEqual(batched, [[], []])
+
+        self.assertEqual(find_periodic_sequences_batch([], max_period=3), [])
+        with self.assertRaises(ValueError):
+            find_periodic_sequences_batch([self._to_array("11"), np.array([1, -1])], max_period=3)
+
+    def test_find_periodic_sequences_random(self):
+        # every sequence found is a repetition at least 3 times of its period
+        rng = np.random.RandomState(0)
+        for _ in range(100):
+            arr = rng.randint(0, 3, size=rng.randint(0, 100))
+            for seq in find_periodic_sequences(arr, max_period=10):
+                self.assertGreaterEqual(seq.times, 3)
+                self.assertTrue(
+                    (arr[seq.start + seq.period : seq.end] == arr[seq.start : seq.end - seq.period]).all()
+                )
+
+    def test_same_as_reference(self):
+        rng = np.random.RandomState(0)
+        arrs = []
+        for _ in range(500):
+            # random arrays rarely contain repetitions, so some are built from repeated units
+            units = [rng.randint(0, 4, size=rng.randint(1, 8)) for _ in range(rng.randint(1, 4))]
+            parts = [np.tile(unit, rng.randint(1, 6)) for unit in units] + [
+                rng.randint(0, 4, size=rng.randint(0, 10))
+            ]
+            arrs.append(np.concatenate([parts[i] for i in rng.permutation(len(parts))]))
+
+        for min_period, max_period in ((1, 1), (1, 10), (3, 7)):
+            batched = find_periodic_sequences_batch(arrs, min_period=min_period, max_period=max_period)
+            for arr, sequences in zip(arrs, batched):
+                expected = list(
+                    _find_periodic_sequences_reference(arr, min_period=min_period, max_period=max_period)
+                )
+                self.assertEqual([tuple(seq) for seq in sequences], expected, arr.tolist())
+
+
+class TestFindCharRepetitions(TestCase):
+    REGEX = re.compile(r"(.+?)(\s?\1){3,}")
+
+    def _regex_repetitions(self, text: str) -> list:
+        return [
+            (m.start(), m.end(), len(m.group(1)), m.group(0).count(m.group(1))) for m in self.REGEX.finditer(text)
+        ]
+
+    def test_examples(self):
+        text = "blah blah blah blah blah\nMMMMMMMMMM, bass banana bass banana bass banana bass banana"
+        sequences = list(find_char_repetitions(text))
+        self.assertEqual([text[s.start : s.end] for s in sequences], [text[:24], "MMMMMMMMMM", text[36:]])
+        self.assertEqual([(s.period, s.times) for s in sequences], [(4, 5), (1, 10), (12, 4)])
+
+        self.assertEqual(list(find_char_repetitions("no repetitions here")), [])
+        self.assertEqual(list(find_char_repetitions("")), [])
+
+    def test_same_as_regex(self):
+        rng = random.Random(0)
+        for _ in range(2000):
+            alphabet = rng.choice(["ab", "ab ", "abc \n", "a b\t\n", "abcdefgh "])
+            units = ["".join(rng.choices(alphabet, k=rng.randint(1, 20))) for _ in range(rng.randint(1, 4))]
+            text = "".join((u + rng.choice(["", " ", "\n"])) * rng.randint(1, 6) for u in units)
+            if text and rng.random() < 0.5:
+                # break some of the repetitions
+                i = rng.randrange(len(text))
+                text = text[:i] + rng.choice(alphabet) + text[i + 1 :]
+            self.assertEqual([tuple(s) for s in find_char_repetitions(text)], self._regex_repetitions(text), text)
+
+    def test_long_units(self):
+        unit = "".join(random.Random(1).choices("abcdefghijklmnopqrstuvwxyz", k=300))
+        text = "start " + " ".join([unit] * 4) + " " + unit[:-1] + " end"
+        self.assertEqual([tuple(s) for s in find_char_repetitions(text)], self._regex_repetitions(text))
+        self.assertEqual(list(find_char_repetitions(text))[0].period, 301)
+
+    def test_deadline(self):
+        with self.assertRaises(TimeoutError):
+            list(find_char_repetitions("aaaa bbbb", deadline=time.monotonic() - 1))
@@ -3,6 +3,7 @@ import json
 from pathlib import Path
 from tempfile import NamedTemporaryFile, TemporaryDirectory
 from unittest import TestCase
+from unittest.mock import patch
 
 import numpy
 import smart_open
@@ -10,7 +11,16 @@ from tokenizers import Tokenizer as BaseTokenizer
 from typing_extensions import TypedDict
 
 from dolma.cli.__main__ import main
-from dolma.tokenizer import Tokenizer, tokenize_in_parallel
+from dolma.tokenizer import (
+    TokenCache,
+    TokenizedDataset,
+    Tokenizer,
+    TokenizerOutput,
+    tokenize_in_parallel,
+)
+from dolma.tokenizer.executor import MemMapParallelWriter
+from dolma.tokenizer.packing import SequencePacker
+from dolma.tokenizer.tokenizer import tokenize_file
 
 TEST_DIR = Path(__file__).parent.parent.resolve()
 
@@ -117,6 +127,48 @@ class TestTokenizer(TestCase):
         self.assertEqual(no_split_tokens, split_tokens)
         self.assertEqual(split_tokens, TEXT_NEWLINE_START["gpt_neo"])
 
+    def test_split_into_paragraphs(self):
+        tok = Tokenizer.from_file(**GPT_NEO_TOKENIZER, segment_before_tokenization=True)
+        texts = ["", "abc", "abc\n", "\n\nabc\ndef\n\n\nghi", "a\n\n"]
+        batch, slices = tok.split_into_paragraphs(texts)
+        self.assertEqual(slices, [(0, 1), (1, 2), (2, 4), (4, 7), (7, 9)])
+        self.assertEqual(batch, ["", "abc", "abc", "\n", "\n\nabc", "\ndef", "\n\n\nghi", "a", "\n\n"])
+
+    def test_encode_batch_by_paragraph(self):
+        texts = [TEXT_WITH_NEW_LINES["text"], TEXT_NEWLINE_START["text"], TEXT_WITH_NO_NEWLINES["text"]]
+        for config, name in ((LLAMA_TOKENIZER, "llama"), (GPT_NEO_TOKENIZER, "gpt_neo")):
+            split_tok = Tokenizer.from_file(**config, segment_before_tokenization=True)
+
+            # paragraphs of all documents in a batch are encoded together, and then merged back per document
+            expected = [TEXT_WITH_NEW_LINES[name], TEXT_NEWLINE_START[name], TEXT_WITH_NO_NEWLINES[name]]
+            self.assertEqual(split_tok.encode_batch(texts), expected)
+            self.assertEqual(split_tok.encode_batch(texts[::-1]), expected[::-1])
+
+    def test_tokenize_file_skips_failed_rows(self):
+        texts = [f"document {i}" for i in range(5)]
+        texts[2] = "BAD document"
+        encode_batch = Tokenizer.encode_batch
+
+        def failing_encode_batch(tokenizer, inputs, *args, **kwargs):
+            if any(text.startswith("BAD") for text in inputs):
+                raise ValueError("bad document")
+            return encode_batch(tokenizer, inputs, *args, **kwargs)
+
+        with TemporaryDirectory() as tmpdir:
+            path = f"{tmpdir}/documents.jsonl.gz"
+            with smart_open.open(path, "wt") as f:
+                for i, text in enumerate(texts):
+                    f.write(json.dumps({"id": str(i), "text": text}) + "\n")
+
+            with patch.object(Tokenizer, "encode_batch", new=failing_encode_batch):
+                outputs = list(tokenize_file(GPT_NEO_TOKENIZER["filename"], path, batch_size=64))
+
+        # only the document that fails on its own is skipped
+        tokenizer = Tokenizer.from_file(GPT_NEO_TOKENIZER["filename"])
+        self.assertEqual([output.id for output in outputs], ["0", "1", "3", "4"])
+        for output in outputs:
+            self.assertEqual(list(output.tokens), tokenizer.encode(texts[int(output.id)]))
+
 
 class TestTokenizerCli(TestCase):
     def test_llama_segment_e2e(self, segment: bool = True, fast: bool = True, refresh: int = 0):
@@ -415,3 +467,302 @@ class TestTokenizeSpecialTokens(TestCase):
         tokens_default = tokenizer_default.encode(text)
         tokens_split = tokenizer_split.encode(text)
         self.assertEqual(tokens_default, tokens_split)
+
+
+class TestSequencePacker(TestCase):
+    def _make_output(self, id_: str, length: int) -> TokenizerOutput:
+        return TokenizerOutput.from_tokens(id=id_, src="src", loc=0, tokens=list(range(length)))
+
+    def test_split_long_documents(self):
+        packer = SequencePacker(seq_len=4)
+        instances = packer.add(self._make_output("a", 10))
+
+        # two full instances are emitted right away, the remaining two tokens are kept in an open bin
+        self.assertEqual([[(o.start, o.end) for o in instance] for instance in instances], [[(0, 4)], [(4, 8)]])
+        self.assertEqual(len(packer), 1)
+        self.assertEqual([[(o.start, o.end) for o in instance] for instance in packer.flush()], [[(8, 10)]])
+        self.assertEqual(len(packer), 0)
+
+    def test_best_fit(self):
+        packer = SequencePacker(seq_len=10, algorithm="best_fit")
+        self.assertEqual(packer.add_many([self._make_output("a", 5), self._make_output("b", 8)]), [])
+
+        # "c" fits in both bins, but the one with "b" is the tightest fit, so it gets completed
+        instances = packer.add(self._make_output("c", 2))
+        self.assertEqual([[o.id for o in instance] for instance in instances], [["b", "c"]])
+
+    def test_first_fit(self):
+        packer = SequencePacker(seq_len=10, algorithm="first_fit")
+        self.assertEqual(packer.add_many([self._make_output("a", 5), self._make_output("b", 8)]), [])
+        self.assertEqual(packer.add(self._make_output("c", 2)), [])
+        self.assertEqual([[o.id for o in instance] for instance in packer.flush()], [["b"], ["a", "c"]])
+
+    def test_max_open_bins(self):
+        packer = SequencePacker(seq_len=10, max_open_bins=2)
+        self.assertEqual(packer.add_many([self._make_output("a", 6), self._make_output("b", 7)]), [])
+
+        # no bin fits "c", so the fullest one is emitted to make room
+        instances = packer.add(self._make_output("c", 8))
+        self.assertEqual([[o.id for o in instance] for instance in instances], [["b"]])
+        self.assertEqual(len(packer), 2)
+
+
+class TestPackingTokenizer(TestCase):
+    def test_packing(self):
+        seq_len = 64
+
+        with TemporaryDirectory() as tmpdir:
+            tokenize_in_parallel(
+                sources=[f"{TEST_DIR}/data/provided/documents/000.json.gz"],
+                destination=tmpdir,
+                tokenizer_name_or_path=GPT_NEO_TOKENIZER["filename"],
+                bos_token_id=GPT_NEO_TOKENIZER["bos_token_id"],
+                eos_token_id=GPT_NEO_TOKENIZER["eos_token_id"],
+                pad_token_id=GPT_NEO_TOKENIZER["pad_token_id"],
+                seq_len=seq_len,
+                debug=True,
+            )
+
+            with smart_open.open(f"{tmpdir}/part-0-00000.csv.gz") as f:
+                metadata = [
+                    MetadataDict(start=int(row[0]), end=int(row[1]), id=row[2], src=row[3], pos=int(row[4]))
+                    for row in csv.reader(f)
+                ]
+
+            with open(f"{tmpdir}/part-0-00000.stats.json") as f:
+                stats = json.load(f)
+
+            memmap = numpy.memmap(f"{tmpdir}/part-0-00000.npy", dtype=numpy.uint16, mode="r")
+
+        # all instances are exactly seq_len tokens long
+        self.assertEqual(len(memmap) % seq_len, 0)
+        self.assertEqual(stats["tokens"] + stats["padding_tokens"], len(memmap))
+
+        with smart_open.open(f"{TEST_DIR}/data/provided/documents/000.json.gz") as f:
+            documents = [json.loads(line) for line in f]
+        self.assertEqual(stats["documents"], sum(1 for d in documents if d["text"].strip()))
+
+        # no document chunk crosses an instance boundary
+        for m in metadata:
+            self.assertEqual(m["start"] // seq_len, (m["end"] - 1) // seq_len)
+
+        # concatenating the chunks of each document gives back the original text
+        tokenizer = BaseTokenizer.from_file(GPT_NEO_TOKENIZER["filename"])
+        chunks: dict = {}
+        for m in metadata:
+            chunks.setdefault(m["pos"], []).extend(memmap[m["start"] : m["end"]].tolist())
+        for pos, tokens in chunks.items():
+            self.assertEqual(tokens[-1], GPT_NEO_TOKENIZER["eos_token_id"])
+            self.assertEqual(tokenizer.decode(tokens), documents[pos - 1]["text"])
+
+
+class TestTokenizedDataset(TestCase):
+    def test_random_access(self):
+        source = f"{TEST_DIR}/data/provided/documents/000.json.gz"
+
+        with TemporaryDirectory() as tmpdir:
+            tokenize_in_parallel(
+                sources=[source],
+                destination=tmpdir,
+                tokenizer_name_or_path=GPT_NEO_TOKENIZER["filename"],
+                bos_token_id=GPT_NEO_TOKENIZER["bos_token_id"],
+                eos_token_id=GPT_NEO_TOKENIZER["eos_token_id"],
+                pad_token_id=GPT_NEO_TOKENIZER["pad_token_id"],
+                debug=True,
+            )
+
+            with smart_open.open(f"{tmpdir}/part-0-00000.csv.gz") as f:
+                metadata = [
+                    MetadataDict(start=int(row[0]), end=int(row[1]), id=row[2], src=row[3], pos=int(row[4]))
+                    for row in csv.reader(f)
+                ]
+
+            dataset = TokenizedDataset(tmpdir)
+            self.assertEqual(dataset.paths, [f"{tmpdir}/part-0-00000.npy"])
+            self.assertEqual(len(dataset), len(metadata))
+            self.assertEqual(dataset.num_tokens, sum(m["end"] - m["start"] for m in metadata))
+            self.assertEqual(dataset.sources, [source])
+
+            with smart_open.open(source) as f:
+                documents = [json.loads(line) for line in f]
+
+            tokenizer = BaseTokenizer.from_file(GPT_NEO_TOKENIZER["filename"])
+            for i, m in enumerate(metadata):
+                output = dataset.get(i)
+                self.assertEqual(output.id, m["id"])
+                self.assertEqual(output.src, m["src"])
+                self.assertEqual(output.loc, m["pos"])
+                self.assertEqual(tokenizer.decode(output.tokens), documents[m["pos"] - 1]["text"])
+
+            self.assertEqual(dataset[-1].tolist(), dataset.get(len(dataset) - 1).tokens.tolist())
+            self.assertEqual([t.tolist() for t in dataset[1:3]], [dataset[1].tolist(), dataset[2].tolist()])
+            self.assertEqual(dataset.filter_by_source(source).tolist(), list(range(len(dataset))))
+            self.assertEqual(dataset.filter_by_source("missing").tolist(), [])
+
+            with self.assertRaises(IndexError):
+                dataset[len(dataset)]
+
+
+class TestResumableTokenizer(TestCase):
+    def _tokenize(self, destination: str, metadata_dir: str, **kwargs):
+        tokenize_in_parallel(
+            sources=[f"{TEST_DIR}/data/provided/documents/*.gz", f"{TEST_DIR}/data/multiple_files/*.gz"],
+            destination=destination,
+            metadata_dir=metadata_dir,
+            tokenizer_name_or_path=GPT_NEO_TOKENIZER["filename"],
+            bos_token_id=GPT_NEO_TOKENIZER["bos_token_id"],
+            eos_token_id=GPT_NEO_TOKENIZER["eos_token_id"],
+            pad_token_id=GPT_NEO_TOKENIZER["pad_token_id"],
+            ring_size=2,
+            local_shuffle=4,
+            sample_ring_prop=True,
+            max_size=4096,
+            seq_len=256,
+            debug=True,
+            **kwargs,
+        )
+
+    def _read_outputs(self, destination: str) -> dict:
+        # metadata files are gzipped, and gzip headers contain a timestamp, so we compare decompressed content
+        return {p.name: smart_open.open(p, "rb").read() for p in Path(destination).iterdir()}
+
+    def test_deterministic(self):
+        with TemporaryDirectory() as tmpdir:
+            self._tokenize(f"{tmpdir}/dst1", f"{tmpdir}/meta1")
+            self._tokenize(f"{tmpdir}/dst2", f"{tmpdir}/meta2")
+            first, second = self._read_outputs(f"{tmpdir}/dst1"), self._read_outputs(f"{tmpdir}/dst2")
+
+        self.assertGreater(len(first), 4)
+        self.assertEqual(first.keys(), second.keys())
+        for name in first:
+            self.assertEqual(first[name], second[name], name)
+
+    def test_resume(self):
+        save_checkpoint = MemMapParallelWriter._save_checkpoint
+        calls = []
+
+        def crash_on_second_checkpoint(path, checkpoint):
+            calls.append(checkpoint.memmap_index)
+            if len(calls) == 2:
+                raise RuntimeError("Simulated crash")
+            save_checkpoint(path, checkpoint)
+
+        with TemporaryDirectory() as tmpdir:
+            self._tokenize(f"{tmpdir}/expected", f"{tmpdir}/meta-expected")
+
+            with patch.object(MemMapParallelWriter, "_save_checkpoint", side_effect=crash_on_second_checkpoint):
+                with self.assertRaises(RuntimeError):
+                    self._tokenize(f"{tmpdir}/resumed", f"{tmpdir}/meta-resumed")
+            self.assertTrue(Path(f"{tmpdir}/meta-resumed/0.ckpt").exists())
+
+            # second run picks up from the checkpoint, then removes it once done
+            self._tokenize(f"{tmpdir}/resumed", f"{tmpdir}/meta-resumed")
+            self.assertFalse(Path(f"{tmpdir}/meta-resumed/0.ckpt").exists())
+            self.assertTrue(Path(f"{tmpdir}/meta-resumed/0.done").exists())
+
+            expected = self._read_outputs(f"{tmpdir}/expected")
+            resumed = self._read_outputs(f"{tmpdir}/resumed")
+
+        self.assertEqual(expected.keys(), resumed.keys())
+        for name in expected:
+            self.assertEqual(expected[name], resumed[name], name)
+
+    def test_skip_completed(self):
+        with TemporaryDirectory() as tmpdir:
+            self._tokenize(f"{tmpdir}/dst1", f"{tmpdir}/meta")
+            expected = self._read_outputs(f"{tmpdir}/dst1")
+
+            # same settings and destination: every group is already done, so nothing is written
+            for path in Path(f"{tmpdir}/dst1").iterdir():
+                path.unlink()
+            self._tokenize(f"{tmpdir}/dst1", f"{tmpdir}/meta")
+            self.assertFalse(any(Path(f"{tmpdir}/dst1").iterdir()))
+
+            # unless we ask to ignore the done files
+            self._tokenize(f"{tmpdir}/dst1", f"{tmpdir}/meta", ignore_existing=True)
+            self.assertEqual(self._read_outputs(f"{tmpdir}/dst1"), expected)
+
+            # a new destination is tokenized again
+            self._tokenize(f"{tmpdir}/dst2", f"{tmpdir}/meta")
+            self.assertEqual(self._read_outputs(f"{tmpdir}/dst2"), expected)
+
+    def test_settings_changed(self):
+        with TemporaryDirectory() as tmpdir:
+            self._tokenize(f"{tmpdir}/dst1", f"{tmpdir}/meta")
+            self._tokenize(f"{tmpdir}/dst2", f"{tmpdir}/meta", dtype="uint32")
+            self._tokenize(f"{tmpdir}/expected", f"{tmpdir}/meta-expected", dtype="uint32")
+            self.assertEqual(self._read_outputs(f"{tmpdir}/expected"), self._read_outputs(f"{tmpdir}/dst2"))
+
+
+class TestTokenCache(TestCase):
+    def test_put_get(self):
+        with TemporaryDirectory() as tmpdir:
+            cache = TokenCache(tmpdir, fingerprint="test", dtype="uint16", num_shards=4)
+            keys = [cache.key(f"document {i}") for i in range(20)]
+            for i, key in enumerate(keys):
+                self.assertIsNone(cache.get(key))
+                cache.put(key, list(range(i + 1)))
+
+            # buffered entries are available before flushing
+            self.assertEqual(cache.get(keys[3]).tolist(), [0, 1, 2, 3])
+            cache.flush()
+            self.assertEqual(len(list(Path(tmpdir, "test").glob("*/*.idx.npz"))), 4)
+
+            reloaded = TokenCache(tmpdir, fingerprint="test", dtype="uint16", num_shards=4)
+            for i, key in enumerate(keys):
+                self.assertEqual(reloaded.get(key).tolist(), list(range(i + 1)))
+            self.assertIsNone(reloaded.get(cache.key("missing")))
+            self.assertEqual((reloaded.hits, reloaded.misses), (20, 1))
+
+            # caches for other tokenizers are kept separate
+            self.assertIsNone(TokenCache(tmpdir, fingerprint="other", dtype="uint16").get(keys[0]))
+
+    def test_evict(self):
+        with TemporaryDirectory() as tmpdir:
+            cache = TokenCache(tmpdir, fingerprint="test", dtype="uint16", num_shards=1, max_size=4096)
+            keys = [cache.key(f"document {i}") for i in range(8)]
+            for key in keys:
+                cache.put(key, [1] * 512)
+                cache.flush()
+
+            sizes = [f.stat().st_size for f in Path(tmpdir, "test").glob("*/*")]
+            self.assertLessEqual(sum(sizes), 4096)
+            self.assertIsNone(cache.get(keys[0]))
+            self.assertEqual(cache.get(keys[-1]).tolist(), [1] * 512)
+
+    def test_tokenize_with_cache(self):
+        sources = [f"{TEST_DIR}/data/provided/documents/*.gz"]
+        kwargs = dict(
+            tokenizer_name_or_path=GPT_NEO_TOKENIZER["filename"],
+            bos_token_id=GPT_NEO_TOKENIZER["bos_token_id"],
+            eos_token_id=GPT_NEO_TOKENIZER["eos_token_id"],
+            pad_token_id=GPT_NEO_TOKENIZER["pad_token_id"],
+            debug=True,
+        )
+        with TemporaryDirectory() as tmpdir:
+            tokenize_in_parallel(sources=sources, destination=f"{tmpdir}/expected", **kwargs)
+            for run in ("first", "second"):
+                tokenize_in_parallel(
+                    sources=sources,
+                    destination=f"{tmpdir}/{run}",
+                    metadata_dir=f"{tmpdir}/meta-{run}",
+                    token_cache_path=f"{tmpdir}/cache",
+                    **kwargs,
+                )
+
+            tokenizer = Tokenizer.from_file(
+                GPT_NEO_TOKENIZER["filename"],
+                bos_token_id=GPT_NEO_TOKENIZER["bos_token_id"],
+                eos_token_id=GPT_NEO_TOKENIZER["eos_token_id"],
+                pad_token_id=GPT_NEO_TOKENIZER["pad_token_id"],
+            )
+            cache = TokenCache.from_tokenizer(f"{tmpdir}/cache", tokenizer)
+            with smart_open.open(f"{TEST_DIR}/data/provided/documents/000.json.gz") as f:
+                for line in f:
+                    text = json.loads(line)["text"]
+                    self.assertEqual(cache.get(cache.key(text)).tolist(), tokenizer.encode(text))
+
+            expected = numpy.memmap(f"{tmpdir}/expected/part-0-00000.npy", dtype="uint16", mode="r")
+            for run in ("first", "second"):
+                output = numpy.memmap(f"{tmpdir}/{run}/part-0-00000.npy", dtype="uint16", mode="r")
+                self.assertEqual(output.tolist(), expected.tolist())
@@ -2,10 +2,12 @@ import tempfile
 from contextlib import ExitStack
 from pathlib import Path
 from unittest import TestCase
+from unittest.mock import patch
 
+from dolma.core.blocklist_index import BlocklistIndex
 from dolma.core.data_types import DocumentWithMetadata
 from dolma.core.url_blocker import UrlBlocker
-from dolma.taggers.url import BaseDomainTagger, BaseUrlTagger
+from dolma.taggers.url import AdbUrlTagger, BaseDomainTagger, BaseUrlTagger
 
 LOCAL_DATA = Path(__file__).parent.parent / "data"
 
@@ -43,6 +45,78 @@ class TestUrlBlocker(TestCase):
         self.assertTrue(engine.check_network_urls("pjatr.com", None, "image"))
         self.assertFalse(engine.check_network_urls("pjatr.com", None, "document"))
 
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            engine = UrlBlocker.from_adb_paths(LOCAL_DATA / "urls/easylist.txt.gz", cache_dir=temp_dir)
+            (cache_path,) = Path(temp_dir).glob("*.bin")
+
+            loaded = UrlBlocker.load(cache_path)
+            for url in ("berush.com", "example.com", "http://example.com/-advertisement-icon."):
+                self.assertEqual(loaded.check_network_urls(url), engine.check_network_urls(url))
+
+            # a second engine for the same rules comes from the cache
+            cached = UrlBlocker.from_adb_paths(LOCAL_DATA / "urls/easylist.txt.gz", cache_dir=temp_dir)
+            self.assertTrue(cached.check_network_urls("berush.com"))
+            self.assertEqual(len(list(Path(temp_dir).glob("*.bin"))), 1)
+
+            cache_path.write_bytes(b"not an engine")
+            with self.assertRaises(ValueError):
+                UrlBlocker.load(cache_path)
+
+    def test_check_network_urls_batch(self):
+        engine = UrlBlocker.from_adb_paths(LOCAL_DATA / "urls/easylist.txt.gz")
+        urls = ["berush.com", "example.com", "http://pjatr.com"]
+        self.assertEqual(engine.check_network_urls_batch(urls), [engine.check_network_urls(url) for url in urls])
+        self.assertEqual(engine.check_network_urls_batch(urls[1:], None, "image"), [False, True])
+        self.assertEqual(engine.check_network_urls_batch(urls[1:], None, "document"), [False, False])
+        self.assertEqual(engine.check_network_urls_batch([]), [])
+
+    def test_cache_dir_not_writable(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with patch.object(UrlBlocker, "save", side_effect=PermissionError("read-only")):
+                engine = UrlBlocker.from_adb_paths(LOCAL_DATA / "urls/easylist.txt.gz", cache_dir=temp_dir)
+            self.assertTrue(engine.check_network_urls("berush.com"))
+            self.assertEqual(list(Path(temp_dir).iterdir()), [])
+
+    def test_adb_url_tagger(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+
+            class EasyListTagger(AdbUrlTagger):
+                BLOCKLIST_PATHS = [str(LOCAL_DATA / "urls/easylist.txt.gz")]
+                ENGINE_CACHE_DIR = temp_dir
+
+            tagger = EasyListTagger()
+            self.assertTrue(tagger.check_url("berush.com"))
+            self.assertFalse(tagger.check_url("example.com"))
+            self.assertEqual(len(list(Path(temp_dir).glob("*.bin"))), 1)
+
+            # other workers load the engine saved by the first one
+            with patch.object(UrlBlocker, "__init__", side_effect=AssertionError):
+                self.assertTrue(EasyListTagger().check_url("berush.com"))
+
+
+class TestBlocklistIndex(TestCase):
+    def test_build_and_load(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            entries = [f"example{i}.com" for i in range(1000)]
+            index = BlocklistIndex.build(entries + entries[:10], f"{temp_dir}/index.npy")
+            self.assertEqual(len(index), 1000)
+            self.assertIn("example0.com", index)
+            self.assertNotIn("example1000.com", index)
+
+            loaded = BlocklistIndex.load(f"{temp_dir}/index.npy")
+            self.assertTrue(all(e in loaded for e in entries))
+            self.assertTrue(loaded.contains_any(["example.com", "example999.com"]))
+            self.assertFalse(loaded.contains_any(["example.com", "example-1.com"]))
+            self.assertFalse(loaded.contains_any([]))
+
+    def test_empty(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            index = BlocklistIndex.build([], f"{temp_dir}/index.npy")
+            self.assertEqual(len(index), 0)
+            self.assertNotIn("example.com", index)
+            self.assertFalse(index.contains_any(["example.com"]))
+
 
 class TestUrlMatcher(TestCase):
     links_tagger: BaseUrlTagger
@@ -66,9 +140,11 @@ class TestUrlMatcher(TestCase):
 
         class TestLinksTagger(BaseUrlTagger):
             BLOCKLIST_PATHS = [test_links]
+            BLOCKLIST_INDEX_DIR = temp_dir
 
         class TestDomainTagger(BaseDomainTagger):
             BLOCKLIST_PATHS = [test_domains]
+            BLOCKLIST_INDEX_DIR = temp_dir
 
         self.links_tagger = TestLinksTagger()
         self.domains_tagger = TestDomainTagger()
@@ -125,3 +201,51 @@ class TestUrlMatcher(TestCase):
 
         doc = self.make_doc("http://example.com/foo")
         self.assertTrue(self.domains_tagger.predict(doc).spans)
+
+    def test_index_is_reused(self):
+        index_path = self.links_tagger.blocklist_index_path()
+        self.assertTrue(Path(index_path).exists())
+
+        # a new tagger loads the index instead of parsing the blocklist again
+        with patch.object(self.links_tagger.__class__, "iter_blocklist", side_effect=AssertionError):
+            tagger = self.links_tagger.__class__()
+        self.assertTrue(tagger.predict(self.make_doc("http://example.com/foo/bar")).spans)
+        self.assertEqual(tagger.blocklist_index_path(), index_path)
+        self.assertNotEqual(self.domains_tagger.blocklist_index_path(), index_path)
+
+    def test_file_url_blocklist(self):
+        (blocklist_path,) = self.domains_tagger.BLOCKLIST_PATHS
+
+        class FileUrlDomainTagger(BaseDomainTagger):
+            BLOCKLIST_PATHS = [Path(blocklist_path).as_uri()]
+            BLOCKLIST_INDEX_DIR = self.domains_tagger.BLOCKLIST_INDEX_DIR
+
+        tagger = FileUrlDomainTagger()
+        self.assertTrue(tagger.predict(self.make_doc("http://example.com")).spans)
+        self.assertFalse(tagger.predict(self.make_doc("http://example4.com")).spans)
+
+    def test_remote_blocklist_version(self):
+        temp_dir = self.domains_tagger.BLOCKLIST_INDEX_DIR
+
+        class RemoteDomainTagger(BaseDomainTagger):
+            BLOCKLIST_PATHS = ["https://example.org/blocklist/domains.txt"]
+            BLOCKLIST_INDEX_DIR = temp_dir
+
+        # downloads are named after the URL and the ETag of the remote file; both versions have the same size
+        downloads = {}
+        for etag, domain in (("v1", "example.com"), ("v2", "example.net")):
+            downloads[etag] = f"{temp_dir}/download.{etag}"
+            with open(downloads[etag], "w") as f:
+                f.write(f"{domain}\n")
+
+        with patch("dolma.taggers.url.download_cached_path", return_value=downloads["v1"]):
+            v1_index_path = RemoteDomainTagger.blocklist_index_path()
+            v1_tagger = RemoteDomainTagger()
+        with patch("dolma.taggers.url.download_cached_path", return_value=downloads["v2"]):
+            v2_index_path = RemoteDomainTagger.blocklist_index_path()
+            v2_tagger = RemoteDomainTagger()
+
+        self.assertNotEqual(v1_index_path, v2_index_path)
+        self.assertTrue(v1_tagger.predict(self.make_doc("http://example.com")).spans)
+        self.assertFalse(v2_tagger.predict(self.make_doc("http://example.com")).spans)
+        self.assertTrue(v2_tagger.predict(self.make_doc("http://example.net")).spans)
@@ -1,3 +1,4 @@
+import datetime
 import json
 import os
 import tempfile
@@ -6,10 +7,16 @@ from contextlib import ExitStack
 from itertools import chain
 from pathlib import Path
 from typing import Dict, List
+from urllib.parse import urlsplit
 
 import smart_open
+from fastwarc.warc import ArchiveIterator, WarcRecordType
 
 from dolma.warc import create_and_run_warc_pipeline
+from dolma.warc import processor as warc_processor
+from dolma.warc.filters import WarcRecordPrefilter
+from dolma.warc.processor import WarcProcessor
+from dolma.warc.utils import CharsetResolver, parse_http_date
 
 DATA_PATH = Path(__file__).parent.parent / "data/warc"
 
@@ -22,13 +29,12 @@ class TestWarcExtractor(unittest.TestCase):
     def tearDown(self) -> None:
         self.stack.close()
 
-    def _run_pipeline(self, html: bool = False, pretag: bool = False) -> Dict[str, List[dict]]:
+    def _run_pipeline(self, html: bool = False, pretag: bool = False, **kwargs) -> Dict[str, List[dict]]:
+        kwargs = {"num_processes": 1, "debug": True, **kwargs}
         create_and_run_warc_pipeline(
             documents=[f"{DATA_PATH}/*.warc.gz"],
             destination=[self.tempdir],
-            num_processes=1,
             ignore_existing=False,
-            debug=True,
             source_name="test",
             skip_no_pre_taggers=pretag,
             skip_no_post_taggers=False,
@@ -36,6 +42,7 @@ class TestWarcExtractor(unittest.TestCase):
             linearizer_name="resiliparse",
             pre_taggers=["cc_re"],
             post_taggers=["lingua_1e2"],
+            **kwargs,
         )
         outputs: Dict[str, List[dict]] = {}
         for fn in os.listdir(self.tempdir):
@@ -103,3 +110,159 @@ class TestWarcExtractor(unittest.TestCase):
             {"by_4_0", "by_3_0"},
         )
         self.assertIn("cc_re__cc_re__cc_by_4_0", sample1[2]["attributes"])
+
+    def test_parallel_records(self):
+        outputs = self._run_pipeline(html=True)
+        for fn in os.listdir(self.tempdir):
+            os.remove(os.path.join(self.tempdir, fn))
+        parallel_outputs = self._run_pipeline(html=True, num_processes=2, debug=False, parallel_records=True)
+
+        self.assertEqual(outputs.keys(), parallel_outputs.keys())
+        for fn, samples in outputs.items():
+            # documents are written in the same order; only the time they were added differs
+            for sample in chain(samples, parallel_outputs[fn]):
+                sample.pop("added")
+            self.assertEqual(samples, parallel_outputs[fn])
+
+    def test_worker_resets_charsets_per_file(self):
+        warc_processor._init_extraction_worker({"source_name": "test"})
+        extractor = warc_processor._WORKER_EXTRACTOR
+        assert extractor is not None
+
+        warc_processor._extract_batch([], date_added="", file_key="a.warc.gz")
+        extractor.charset_resolver.host_charsets["example.com"] = "cp1252"
+
+        # charsets are kept for batches from the same file, and forgotten when records from another file arrive
+        warc_processor._extract_batch([], date_added="", file_key="a.warc.gz")
+        self.assertEqual(extractor.charset_resolver.host_charsets, {"example.com": "cp1252"})
+        warc_processor._extract_batch([], date_added="", file_key="b.warc.gz")
+        self.assertEqual(extractor.charset_resolver.host_charsets, {})
+
+    def test_prefilter(self):
+        outputs = self._run_pipeline(blocked_domains=["allenai.org"], max_content_length=100_000)
+        sample1 = outputs["sample-0001.jsonl.gz"]
+        self.assertEqual(len(outputs["sample-0000.jsonl.gz"]), 21)
+        self.assertEqual(len(sample1), 10)
+        self.assertFalse(any("allenai.org" in sample["metadata"]["url"] for sample in sample1))
+
+        outputs = self._run_pipeline(allowed_content_types=["application/pdf"])
+        self.assertEqual(sum(map(len, outputs.values())), 0)
+
+
+class TestWarcRecordPrefilter(unittest.TestCase):
+    def _kept_hosts(self, prefilter: WarcRecordPrefilter) -> List[str]:
+        hosts = []
+        with open(DATA_PATH / "sample-0001.warc.gz", "rb") as f:
+            it = ArchiveIterator(
+                f, record_types=WarcRecordType.response | WarcRecordType.warcinfo, func_filter=prefilter
+            )
+            for record in it:
+                if record.record_type == WarcRecordType.warcinfo:
+                    hosts.append("warcinfo")
+                else:
+                    hosts.append(urlsplit(record.headers.get("WARC-Target-URI").strip("<>")).hostname)
+        return hosts
+
+    def test_empty(self):
+        prefilter = WarcRecordPrefilter()
+        self.assertTrue(prefilter.is_empty)
+        self.assertEqual(len(self._kept_hosts(prefilter)), 16)
+
+    def test_content_type_and_status(self):
+        self.assertEqual(len(self._kept_hosts(WarcRecordPrefilter(content_types=["text/html"]))), 16)
+        self.assertEqual(len(self._kept_hosts(WarcRecordPrefilter(content_types=["TEXT/*"]))), 16)
+        self.assertEqual(self._kept_hosts(WarcRecordPrefilter(content_types=["application/pdf"])), ["warcinfo"])
+        self.assertEqual(len(self._kept_hosts(WarcRecordPrefilter(status_codes=[200]))), 16)
+        self.assertEqual(self._kept_hosts(WarcRecordPrefilter(status_codes=[404])), ["warcinfo"])
+
+    def test_domains_and_urls(self):
+        hosts = self._kept_hosts(WarcRecordPrefilter(blocked_domains=["allenai.org", "commoncrawl.org."]))
+        self.assertEqual(hosts, ["warcinfo"] + ["creativecommons.org"] * 4 + ["www.semanticscholar.org"])
+
+        hosts = self._kept_hosts(WarcRecordPrefilter(blocked_url_patterns=[r"/20\d\d/", r"^https://commoncrawl"]))
+        self.assertEqual(hosts.count("creativecommons.org"), 2)
+        self.assertNotIn("commoncrawl.org", hosts)
+        self.assertEqual(hosts.count("allenai.org"), 4)
+
+    def test_content_length(self):
+        self.assertEqual(len(self._kept_hosts(WarcRecordPrefilter(min_content_length=100_000))), 5)
+        self.assertEqual(len(self._kept_hosts(WarcRecordPrefilter(max_content_length=30_000))), 5)
+
+
+class TestCharsetResolver(unittest.TestCase):
+    def setUp(self) -> None:
+        self.resolver = CharsetResolver()
+        self.text = "<html><body><p>Café crème, déjà vu, naïve façade.</p></body></html>"
+
+    def test_http_charset(self):
+        self.assertEqual(self.resolver(self.text.encode("cp1252"), http_charset="cp1252"), self.text)
+        # wrong or unknown charsets in the headers are ignored
+        self.assertEqual(self.resolver(self.text.encode("utf-8"), http_charset="ascii"), self.text)
+        self.assertEqual(self.resolver(self.text.encode("utf-8"), http_charset="utf8mb4"), self.text)
+
+    def test_meta_charset(self):
+        for meta, charset in (
+            ('<meta charset="iso-8859-15">', "iso-8859-15"),
+            ("<meta http-equiv='Content-Type' content='text/html; charset=ISO-8859-15'>", "ISO-8859-15"),
+        ):
+            html = self.text.replace("<html>", f"<html><head>{meta}</head>")
+            self.assertEqual(self.resolver.sniff_meta_charset(html.encode("iso-8859-15")), charset)
+            self.assertEqual(self.resolver(html.encode("iso-8859-15")), html)
+
+        html = self.text.replace("<html>", '<html><head><meta charset="UTF-16"></head>')
+        self.assertEqual(self.resolver.sniff_meta_charset(html.encode("utf-8")), "utf-8")
+        self.assertEqual(self.resolver(html.encode("utf-8")), html)
+
+    def test_host_cache(self):
+        html = self.text.replace("<html>", '<html><head><meta charset="cp1252"></head>')
+        self.assertEqual(self.resolver(html.encode("cp1252"), url="<https://www.example.com/a>"), html)
+        self.assertEqual(self.resolver.host_charsets, {"www.example.com": "cp1252"})
+
+        # utf-8 pages decode as utf-8 and do not replace the cached charset
+        self.assertEqual(self.resolver(self.text.encode("utf-8"), url="https://www.example.com/b"), self.text)
+        self.assertEqual(self.resolver.host_charsets, {"www.example.com": "cp1252"})
+
+        # a page without any declared charset from the same host uses the cached one
+        self.assertEqual(self.resolver(self.text.encode("cp1252"), url="https://www.example.com/c"), self.text)
+
+    def test_detect(self):
+        text = "Съешь же ещё этих мягких французских булок, да выпей чаю. " * 50
+        self.assertEqual(self.resolver(text.encode("cp1251"), url="https://example.ru/"), text)
+        self.assertEqual(self.resolver.host_charsets, {"example.ru": "cp1251"})
+        self.assertEqual(self.resolver(b""), "")
+
+
+class TestParseHttpDate(unittest.TestCase):
+    def test_formats(self):
+        expected = datetime.datetime(1994, 11, 6, 8, 49, 37)
+        for date_str in (
+            "Sun, 06 Nov 1994 08:49:37 GMT",
+            "sun, 6 nov 1994 08:49:37 gmt",
+            "Sun, 06 Nov 1994 08:49:37 +0200",
+            "Sun, 06 November 1994 08:49:37 PST",
+            "Sunday, 06-Nov-94 08:49:37 GMT",
+            "Sun Nov  6 08:49:37 1994",
+            "1994-11-06T08:49:37Z",
+            "1994-11-06 08:49:37+01:00",
+        ):
+            self.assertEqual(parse_http_date(date_str), expected, date_str)
+
+        self.assertEqual(parse_http_date("Sat, 06-Nov-04 08:49:37 GMT"), expected.replace(year=2004))
+        self.assertEqual(parse_http_date("1994-11-06T08:49:37.12Z"), expected.replace(microsecond=120000))
+
+    def test_unrecognized(self):
+        for date_str in ("", "yesterday", "Sun, 31 Feb 1994 08:49:37 GMT", "Sun, 06 Nov 1994 08:49:37 XYZ"):
+            self.assertIsNone(parse_http_date(date_str), date_str)
+
+    def test_warc_timestamp(self):
+        self.assertEqual(
+            WarcProcessor._format_to_dolma_timestamp(
+                WarcProcessor._parse_warc_timestamp("1994-11-06T08:49:37.1234Z")
+            ),
+            "1994-11-06T08:49:37.123Z",
+        )
+        # formats that are not parsed directly go through dateparser
+        self.assertEqual(
+            WarcProcessor._parse_warc_timestamp("November 6, 1994 08:49:37").replace(tzinfo=None),
+            datetime.datetime(1994, 11, 6, 8, 49, 37),
+        )